@@ -0,0 +1,46 @@
+"""
+This file defines AxisLimits, which picks the limits of a graph's axis
+from the range of the data it shows. The limits leave room around the
+data and only move once the data leaves them or shrinks well inside
+them, so that a graph's axes, and its cached background with their
+tick labels (see GraphRenderer.plot_background), rarely change.
+"""
+
+
+class AxisLimits:
+    """
+    The limits of one axis, following the data's running min and max with
+    hysteresis.
+    """
+
+    def __init__(self, margin=0.1, shrink=0.5, lead=0.0):
+        """
+        @param margin: The room to leave on each side, as a fraction of the data's range.
+        @param shrink: How small a fraction of the limits the data's range may shrink
+                       to before the limits close in on it.
+        @param lead: Extra room to leave above the data, as a fraction of its range,
+                     for data that only grows, like time.
+        """
+        self.margin = margin
+        self.shrink = shrink
+        self.lead = lead
+        self.limits = None
+
+    def update(self, low, high):
+        """
+        Moves the limits if the data no longer fits them well.
+        @param low: The smallest value of the data.
+        @param high: The largest value of the data.
+        @return: The (low, high) limits.
+        """
+        if self.limits is not None:
+            limit_low, limit_high = self.limits
+            if limit_low <= low and high <= limit_high and high - low >= self.shrink * (limit_high - limit_low):
+                return self.limits
+
+        span = high - low
+        if span <= 0:
+            span = abs(high) * 0.1 or 1.0
+        self.limits = (low - self.margin * span, high + (self.margin + self.lead) * span)
+
+        return self.limits
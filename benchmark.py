@@ -0,0 +1,364 @@
+"""
+This file benchmarks each stage of the pipeline without a display:
+Networker frame parsing, GUIBackend decoding and dispatch, sensor log
+writes, GraphRenderer's drawing of the graphs with matplotlib's Agg
+backend, and GUIFrontend's update_log_displays. Run it before a test
+campaign to check the configured sample rates leave headroom:
+
+    python benchmark.py [--rates 1000 10000] [--buffers 1000 60000] [--output results.json]
+
+Each stage is run at every per-channel sample rate and buffer size it
+depends on. Results are printed and written as JSON (by default to
+benchmark-<date>-<time>.json) so runs can be compared.
+"""
+
+import argparse
+import configparser
+import json
+import os
+import platform
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from capture import CaptureWriter
+from decimation import MIN_MAX, STRIDE
+from logger import LogLevel, Logger
+from model import GUIBackend
+from networking.networker import Networker
+from networking.server_info import ServerInfo, payload_dtype
+from sensor_log import TextLog
+
+# Sensors send a frame per channel this often, in seconds
+FRAME_INTERVAL = 0.01
+
+# Each measurement is repeated for at least this long, in seconds
+MIN_TIME = 0.5
+
+
+class SilentAdapter:
+    """
+    A Back2FrontAdapter that ignores messages.
+    """
+
+    @staticmethod
+    def display_msg(msg):
+        pass
+
+    @staticmethod
+    def display_alert(msg):
+        pass
+
+
+class TextStandIn:
+    """
+    Stands in for the data log's Text widget when there's no display, so
+    update_log_displays can still be timed without the cost of Tk itself.
+    """
+
+    def insert(self, index, text, *tags):
+        pass
+
+    def delete(self, start, end=None):
+        pass
+
+
+def timed(func, min_time=MIN_TIME):
+    """
+    Calls a function repeatedly for at least min_time seconds.
+    @param func: The function to call.
+    @param min_time: The minimum total time in seconds.
+    @return: The mean time per call in seconds.
+    """
+    func()
+    calls = 0
+    started = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        func()
+        calls += 1
+        elapsed = time.perf_counter() - started
+
+    return elapsed / calls
+
+
+def make_config(buffer_size, log_dir):
+    """
+    Reads config.ini, with every channel buffer set to buffer_size samples
+    and sensor logs going to log_dir.
+    """
+    config = configparser.RawConfigParser()
+    config.read('config.ini')
+    for section in ("Buffers", "Logging"):
+        if not config.has_section(section):
+            config.add_section(section)
+
+    for name in ServerInfo.filenames.values():
+        config.set("Buffers", name, str(buffer_size))
+    config.set("Logging", "Directory", log_dir)
+
+    return config
+
+
+def make_frames(info, rate, start=0):
+    """
+    Builds one payload message per channel holding FRAME_INTERVAL seconds of samples.
+    @param info: The ServerInfo layout class.
+    @param rate: The sample rate of each channel in Hz.
+    @param start: The timestamp of the first sample, in microseconds.
+    @return: A list of (mtype, nbytes, message) tuples.
+    """
+    count = max(1, int(rate * FRAME_INTERVAL))
+    records = np.zeros(count, dtype=payload_dtype(info))
+    records['data'] = np.random.randint(0, 4096, count)
+    records['time'] = start + np.arange(count) * int(1e6 / rate)
+    message = records.tobytes()
+
+    return [(mtype, len(message), message) for mtype in ServerInfo.filenames]
+
+
+def ingest_result(name, seconds, rate, frames, **params):
+    """
+    Describes a measurement of processing frames, each holding FRAME_INTERVAL
+    seconds of one channel's samples.
+    @param name: The name of the benchmark.
+    @param seconds: The time taken to process the frames.
+    @param rate: The sample rate of each channel in Hz.
+    @param frames: The number of frames processed.
+    @return: A dict of results.
+    """
+    samples = frames * max(1, int(rate * FRAME_INTERVAL))
+    required = rate * frames
+    result = {'benchmark': name, 'rate': rate, 'seconds': seconds, 'samples_per_second': samples / seconds,
+              'required_samples_per_second': required, 'headroom': samples / seconds / required}
+    result.update(params)
+
+    return result
+
+
+def bench_parse(config, rate):
+    """
+    Times Networker receiving and parsing frames from a socket.
+    """
+    nw = Networker(Logger(name='benchmark', level=LogLevel.ERROR), config)
+    sender, nw.recv_sock = socket.socketpair()
+    nw.connected = True
+    nw.reset_recv_buffer()
+
+    info = nw.server_info.info
+    chunk = b''.join(nw.header_struct.pack(mtype, nbytes) + message
+                     for mtype, nbytes, message in make_frames(info, rate))
+    repeats = max(1, (8 << 20) // len(chunk))
+    frames = repeats * len(ServerInfo.filenames)
+    writer = threading.Thread(target=sender.sendall, args=(chunk * repeats,))
+
+    started = time.perf_counter()
+    writer.start()
+    received = 0
+    while received < frames:
+        received += len(nw.read_messages())
+    seconds = time.perf_counter() - started
+
+    writer.join()
+    sender.close()
+    nw.recv_sock.close()
+
+    return ingest_result('networker_parse', seconds / repeats, rate, len(ServerInfo.filenames))
+
+
+def bench_backend(config, rate, buffer_size):
+    """
+    Times GUIBackend decoding one frame and dispatching a batch of one frame per channel.
+    """
+    backend = GUIBackend(SilentAdapter(), config)
+    frames = make_frames(backend.nw.server_info.info, rate)
+    mtype, nbytes, message = frames[0]
+    batch = [frame + (time.perf_counter(),) for frame in frames]
+
+    results = [
+        ingest_result('read_payload', timed(lambda: backend.read_payload(message, nbytes, mtype)), rate, 1,
+                      buffer=buffer_size),
+        ingest_result('process_recv_message', timed(lambda: backend._process_recv_message(batch)), rate,
+                      len(frames), buffer=buffer_size)
+    ]
+    backend.close()
+
+    return results
+
+
+def bench_log_writes(log_dir, rate):
+    """
+    Times writing one frame's samples to a text log and to a binary capture.
+    """
+    count = max(1, int(rate * FRAME_INTERVAL))
+    times = np.arange(count, dtype=np.uint64)
+    raw = np.random.randint(0, 4096, count).astype(np.uint16)
+    cal = raw * 0.0093895
+
+    text_log = TextLog(os.path.join(log_dir, 'benchmark.log'), 1 << 20)
+    capture = CaptureWriter(os.path.join(log_dir, 'benchmark.cap'), raw.dtype.itemsize)
+    results = [
+        ingest_result('text_log_write', timed(lambda: text_log.write(times, raw, cal)), rate, 1),
+        ingest_result('capture_write', timed(lambda: capture.write(times, raw, cal)), rate, 1)
+    ]
+    text_log.close()
+    capture.close()
+
+    return results
+
+
+def make_frontend(frontend_class, backend, config):
+    """
+    Builds a GUIFrontend around backend without its graphs, with the data
+    log in a hidden Tk window if there's a display.
+    @return: The frontend, and 'tk' or 'none' for the kind of data log widget.
+    """
+    frontend = frontend_class.__new__(frontend_class)
+    frontend.backend_adapter = backend
+    frontend.config = config
+    frontend.choices = [name for name in ServerInfo.filenames.values()]
+    frontend.logged_versions = None
+
+    row_labels = frontend.init_log_layout()
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+        root.withdraw()
+        frontend.data_logs = tk.Text(root)
+        for label in row_labels:
+            frontend.data_logs.insert('end',
+                                      label.ljust(frontend.LOG_COLUMN_WIDTH * (len(frontend.choices) + 1)) + '\n')
+        widget = 'tk'
+    except Exception:
+        frontend.data_logs = TextStandIn()
+        widget = 'none'
+
+    return frontend, widget
+
+
+def bench_render(config, rate, buffer_size):
+    """
+    Times drawing the graphs in each decimation mode, and update_log_displays,
+    with full buffers. New samples arrive before every frame, as while live, but
+    the time they take to ingest isn't counted.
+    """
+    from graph_renderer import GraphRenderer, GraphSettings, create_figure
+    from view import GUIFrontend
+
+    backend = GUIBackend(SilentAdapter(), config)
+    info = backend.nw.server_info.info
+    budget = 1 / float(config.get("Display", "Target Framerate"))
+
+    start = 0
+    for _ in range(max(1, buffer_size // max(1, int(rate * FRAME_INTERVAL)))):
+        for mtype, nbytes, message in make_frames(info, rate, start):
+            backend.read_payload(message, nbytes, mtype)
+        start += int(FRAME_INTERVAL * 1e6)
+    frames = make_frames(info, rate, start)
+
+    def ingest():
+        for mtype, nbytes, message in frames:
+            backend.read_payload(message, nbytes, mtype)
+
+    ingest_seconds = timed(ingest)
+
+    def render_result(name, seconds, **params):
+        seconds = max(seconds - ingest_seconds, 1e-9)
+        result = {'benchmark': name, 'rate': rate, 'buffer': buffer_size, 'seconds': seconds,
+                  'frame_budget': budget, 'headroom': budget / seconds}
+        result.update(params)
+        return result
+
+    results = []
+    frames_to_skip = int(config.get("Display", "Skip Frames for Axis Update"))
+    for mode, fine in ((MIN_MAX, False), (STRIDE, False), (MIN_MAX, True)):
+        renderer = GraphRenderer(backend, *create_figure(850, 725, 75))
+        settings = GraphSettings(["LC_MAIN", "LC1", "TC2", "PT_INJE"], [mode] * 4, fine, False, 1.0, frames_to_skip)
+
+        def draw():
+            ingest()
+            renderer.draw(settings)
+
+        results.append(render_result('draw_graphs', timed(draw), mode='Fine' if fine else mode))
+
+    frontend, widget = make_frontend(GUIFrontend, backend, config)
+
+    def update():
+        ingest()
+        frontend.update_log_displays()
+
+    results.append(render_result('update_log_displays', timed(update), widget=widget))
+    backend.close()
+
+    return results
+
+
+def describe_run():
+    """
+    @return: A dict describing the machine and code being benchmarked.
+    """
+    import matplotlib
+
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit, 'platform': platform.platform(),
+            'python': platform.python_version(), 'numpy': np.__version__, 'matplotlib': matplotlib.__version__}
+
+
+def main():
+    """
+    Runs the benchmarks given on the command line.
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks the ingest and render pipeline.")
+    parser.add_argument('--rates', type=int, nargs='+', default=[1000, 10000, 50000],
+                        help="per channel sample rates in Hz")
+    parser.add_argument('--buffers', type=int, nargs='+', default=[1000, 60000],
+                        help="ring buffer sizes in samples")
+    parser.add_argument('--output', default=time.strftime('benchmark-%Y%m%d-%H%M%S.json'),
+                        help="the file to write results to")
+    args = parser.parse_args()
+
+    # Must be chosen before pyplot is imported
+    import matplotlib
+    matplotlib.use('Agg')
+
+    run = describe_run()
+    run['results'] = results = []
+
+    def report(new_results):
+        for result in new_results:
+            params = ' '.join('{0}={1}'.format(key, result[key]) for key in ('rate', 'buffer', 'mode', 'widget')
+                              if key in result)
+            print("{0:<22} {1:<40} {2:10.1f} us  headroom {3:8.1f}x".format(
+                result['benchmark'], params, 1e6 * result['seconds'], result['headroom']))
+        results.extend(new_results)
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        for rate in args.rates:
+            config = make_config(args.buffers[0], log_dir)
+            report([bench_parse(config, rate)])
+            report(bench_log_writes(log_dir, rate))
+            for buffer_size in args.buffers:
+                config = make_config(buffer_size, log_dir)
+                report(bench_backend(config, rate, buffer_size))
+                try:
+                    report(bench_render(config, rate, buffer_size))
+                except ImportError as e:
+                    print("Skipping render benchmarks: " + str(e))
+                    results.append({'benchmark': 'render', 'rate': rate, 'buffer': buffer_size,
+                                    'skipped': str(e)})
+
+    with open(args.output, 'w') as f:
+        json.dump(run, f, indent=2)
+    print("Results written to " + args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+This file defines Calibration, which turns raw sensor values into
+physical units, and load_calibrations, which reads them from the
+[Calibration] section of config.ini. Entries look like either
+
+    PT_FEED_SEND=(-0.275787487, 1069)
+    TC1_SEND=poly(-250, 0.1611, 1.2e-7)
+
+where the first is a linear (slope, intercept) pair and the second lists
+polynomial coefficients, lowest power first.
+"""
+
+import re
+
+import numpy as np
+
+from networking.server_info import ServerInfo
+
+
+class Calibration:
+    """
+    A polynomial calibration curve. Raw values that are at most two bytes
+    wide are calibrated by indexing a lookup table holding the curve's value
+    for every possible input, so nonlinear curves cost the same as linear ones.
+    """
+
+    # Raw values wider than this are evaluated directly instead of through a lookup table
+    MAX_TABLE_BYTES = 2
+
+    def __init__(self, coefficients):
+        """
+        @param coefficients: The polynomial coefficients, lowest power first.
+        """
+        self.coefficients = np.array(coefficients, dtype=np.float64)
+        self.tables = {}
+
+    @staticmethod
+    def linear(slope, intercept):
+        """
+        Creates a linear calibration.
+        @param slope: The slope.
+        @param intercept: The y-intercept.
+        @return: The Calibration.
+        """
+        return Calibration([intercept, slope])
+
+    @staticmethod
+    def parse(text):
+        """
+        Parses a calibration from config.ini (see the top of this file).
+        @param text: The text to parse.
+        @return: The Calibration.
+        """
+        match = re.fullmatch(r'\s*(poly)?\s*\((.*)\)\s*', text)
+        if match is None:
+            raise ValueError("Invalid calibration: " + text)
+
+        numbers = [float(number) for number in match.group(2).split(',')]
+        if match.group(1) is not None:
+            return Calibration(numbers)
+        elif len(numbers) == 2:
+            return Calibration.linear(*numbers)
+        else:
+            raise ValueError("A linear calibration needs a slope and an intercept: " + text)
+
+    def __str__(self):
+        if len(self.coefficients) == 2:
+            return '({0}, {1})'.format(self.coefficients[1], self.coefficients[0])
+
+        return 'poly(' + ', '.join(str(c) for c in self.coefficients) + ')'
+
+    def evaluate(self, raw):
+        """
+        Evaluates the curve directly.
+        @param raw: An array of raw values.
+        @return: An array of calibrated values.
+        """
+        return np.polynomial.polynomial.polyval(np.asarray(raw, dtype=np.float64), self.coefficients)
+
+    def lookup_table(self, raw_bytes):
+        """
+        Gets the lookup table for raw values of a given width, building it
+        the first time it's needed.
+        @param raw_bytes: The width of the raw values in bytes.
+        @return: An array of 2 ** (8 * raw_bytes) calibrated values.
+        """
+        table = self.tables.get(raw_bytes)
+        if table is None:
+            table = self.evaluate(np.arange(1 << (8 * raw_bytes)))
+            self.tables[raw_bytes] = table
+
+        return table
+
+    def apply(self, raw):
+        """
+        Calibrates an array of raw values.
+        @param raw: An array of unsigned integers.
+        @return: An array of calibrated values.
+        """
+        if raw.dtype.kind == 'u' and raw.dtype.itemsize <= Calibration.MAX_TABLE_BYTES:
+            return self.lookup_table(raw.dtype.itemsize).take(raw)
+
+        return self.evaluate(raw)
+
+
+def load_calibrations(config):
+    """
+    Loads the calibration of every channel from the [Calibration] section of
+    the config. Channels that aren't in the config use ServerInfo.calibrations.
+    @param config: The config to read.
+    @return: A dictionary from mtype to Calibration.
+    """
+    calibrations = {mtype: Calibration.linear(*calibration)
+                    for mtype, calibration in ServerInfo.calibrations.items()}
+
+    if config.has_section("Calibration"):
+        for key, text in config.items("Calibration"):
+            mtype = getattr(ServerInfo, key.upper(), None)
+            if mtype not in ServerInfo.filenames:
+                raise ValueError("Unknown channel in [Calibration]: " + key)
+
+            calibrations[mtype] = Calibration.parse(text)
+
+    return calibrations
@@ -0,0 +1,193 @@
+"""
+This file defines the binary capture format used for sensor logs, along
+with CaptureWriter and CaptureReader for writing and loading it. Run this
+file to convert a capture back to the text log format:
+
+    python capture.py logs/capture-20180301-120000/LC_MAIN.cap [LC_MAIN.log]
+
+Each channel is stored in two files. <channel>.cap holds a 32 byte header
+followed by fixed-width, little endian records of (raw value, calibrated
+value, timestamp). <channel>.idx is a sparse time index holding the
+(timestamp, record number) of every index_stride-th record, so a reader
+can find any time range without scanning the whole capture.
+"""
+
+import os
+import struct
+import sys
+
+import numpy as np
+
+MAGIC = b'MK11CAP\0'
+VERSION = 1
+
+# magic, version, raw value bytes, record size, index stride, reserved
+HEADER = struct.Struct('<8sHHII12x')
+
+INDEX_DTYPE = np.dtype([('time', '<u8'), ('record', '<u8')])
+
+
+def capture_dtype(raw_bytes):
+    """
+    Builds the dtype of one capture record.
+    @param raw_bytes: The width of the raw sensor value in bytes.
+    @return: A packed dtype with 'raw', 'cal' and 'time' fields.
+    """
+    return np.dtype([('raw', '<u' + str(raw_bytes)), ('cal', '<f8'), ('time', '<u8')])
+
+
+class CaptureWriter:
+    """
+    Appends records for one channel to a capture and its index. Not thread
+    safe; SensorLogWriter only uses it from its writer thread.
+    """
+
+    def __init__(self, path, raw_bytes, index_stride=1024, buffering=1 << 20):
+        """
+        Creates a new capture, overwriting any existing one.
+        @param path: The path of the .cap file. The index is written next to it.
+        @param raw_bytes: The width of the raw sensor value in bytes.
+        @param index_stride: How many records apart index entries are.
+        @param buffering: The buffer size for the underlying files.
+        """
+        self.dtype = capture_dtype(raw_bytes)
+        self.index_stride = index_stride
+        self.records = 0
+
+        self.data_file = open(path, 'wb', buffering=buffering)
+        self.index_file = open(os.path.splitext(path)[0] + '.idx', 'wb')
+        self.data_file.write(HEADER.pack(MAGIC, VERSION, raw_bytes, self.dtype.itemsize, index_stride))
+
+    def write(self, times, raw, cal):
+        """
+        Appends a block of samples.
+        @param times: An array of timestamps.
+        @param raw: An array of raw sensor values.
+        @param cal: An array of calibrated values.
+        @return: The number of bytes written.
+        """
+        count = len(times)
+        block = np.empty(count, dtype=self.dtype)
+        block['raw'] = raw
+        block['cal'] = cal
+        block['time'] = times
+        self.data_file.write(block.tobytes())
+
+        # Index every record whose number is a multiple of the stride
+        first = -self.records % self.index_stride
+        indexed = np.arange(first, count, self.index_stride)
+        if len(indexed) > 0:
+            index = np.empty(len(indexed), dtype=INDEX_DTYPE)
+            index['time'] = block['time'][indexed]
+            index['record'] = indexed + self.records
+            self.index_file.write(index.tobytes())
+
+        self.records += count
+
+        return block.nbytes
+
+    def flush(self):
+        """
+        Flushes buffered records and index entries to disk.
+        """
+        self.data_file.flush()
+        self.index_file.flush()
+
+    def close(self):
+        """
+        Flushes and closes the capture.
+        """
+        self.data_file.close()
+        self.index_file.close()
+
+
+class CaptureReader:
+    """
+    Memory maps a capture for fast post-fire loading. Only the part of the
+    file that was complete when the reader was opened is visible.
+    """
+
+    def __init__(self, path):
+        """
+        Opens a capture.
+        @param path: The path of the .cap file.
+        """
+        with open(path, 'rb') as f:
+            magic, version, raw_bytes, record_size, self.index_stride = HEADER.unpack(f.read(HEADER.size))
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(path + " is not a version " + str(VERSION) + " capture")
+
+        self.dtype = capture_dtype(raw_bytes)
+        assert self.dtype.itemsize == record_size
+
+        # Ignore a partially written record at the end of the file
+        count = (os.path.getsize(path) - HEADER.size) // record_size
+        if count > 0:
+            self.records = np.memmap(path, dtype=self.dtype, mode='r', offset=HEADER.size, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+        index_path = os.path.splitext(path)[0] + '.idx'
+        if os.path.exists(index_path):
+            index = np.fromfile(index_path, dtype=INDEX_DTYPE)
+            self.index = index[index['record'] < count]
+        else:
+            self.index = np.zeros(0, dtype=INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    def time_range(self, start, end):
+        """
+        Gets the records with start <= timestamp < end. Uses the index to
+        narrow the search, so only a few pages of the file are touched
+        besides the ones holding the result.
+        @param start: The first timestamp to include.
+        @param end: The timestamp to stop at.
+        @return: A structured array (a view into the capture) of records.
+        """
+        lo = 0
+        hi = len(self.records)
+        if len(self.index) > 0:
+            i = np.searchsorted(self.index['time'], start, side='left') - 1
+            if i >= 0:
+                lo = int(self.index['record'][i])
+            j = np.searchsorted(self.index['time'], end, side='left')
+            if j < len(self.index):
+                hi = int(self.index['record'][j])
+
+        times = self.records['time'][lo:hi]
+        first = lo + int(np.searchsorted(times, start, side='left'))
+        last = lo + int(np.searchsorted(times, end, side='left'))
+
+        return self.records[first:last]
+
+    def to_text(self, path, chunk=1 << 16):
+        """
+        Converts the capture to the "time raw calibrated" text log format.
+        @param path: The path of the text log to write.
+        @param chunk: The number of records to convert at a time.
+        """
+        with open(path, 'w') as f:
+            for i in range(0, len(self.records), chunk):
+                block = self.records[i:i + chunk]
+                f.write(''.join(['{0} {1} {2}\n'.format(t, d, c) for t, d, c in
+                                 zip(block['time'].tolist(), block['raw'].tolist(), block['cal'].tolist())]))
+
+
+def main():
+    """
+    Converts the capture given on the command line to a text log.
+    """
+    if len(sys.argv) < 2:
+        print("Usage: python capture.py <capture.cap> [<output.log>]")
+        sys.exit(1)
+
+    cap_path = sys.argv[1]
+    log_path = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(cap_path)[0] + '.log'
+    CaptureReader(cap_path).to_text(log_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,17 @@
 """
 This file defines GUIController, which instantiates a GUIBackend
 and GUIFrontend instance, and the adapters between them. Run this
-file to start mission control.
+file to start mission control, or with --headless to only record data
+(see recorder.py).
 """
 
+import argparse
 import configparser
+import os
 
+from ingest import ProcessBackend
 from model import GUIBackend
-from view import GUIFrontend
+from replay import parse_speed
 
 
 class GUIController:
@@ -17,9 +21,9 @@ class GUIController:
     without breaking decoupling.
     """
 
-    def __init__(self):
-        config = configparser.RawConfigParser()
-        config.read('config.ini')
+    def __init__(self, config):
+        # Imported here so that headless mode doesn't load tkinter or matplotlib
+        from view import GUIFrontend
 
         class Back2FrontAdapter:
             """
@@ -39,6 +43,14 @@ class GUIController:
                 """
                 frontend.network_log_append(msg)
 
+            @staticmethod
+            def display_alert(msg):
+                """
+                Shows the operator a message that needs their attention, e.g. a dropped command.
+                @param msg: The message to show.
+                """
+                frontend.show_alert(msg)
+
         class Front2BackAdapter:
             """
             An adapter from GUIFrontend to GUIBackend, which allows
@@ -90,6 +102,53 @@ class GUIController:
                 """
                 return backend.get_queue(name)
 
+            @staticmethod
+            def get_stats(name):
+                """
+                Get the rolling statistics of a channel.
+                @param name: The name of the desired channel.
+                @return: The newest (value, time) pair or None, and a list with
+                         a dict of statistics for each configured window.
+                """
+                return backend.get_stats(name)
+
+            @staticmethod
+            def get_statistics_windows():
+                """
+                Get the window sizes the rolling statistics are kept over.
+                @return: A list of window sizes in samples.
+                """
+                return backend.get_statistics_windows()
+
+            @staticmethod
+            def get_history(name, start, end, width):
+                """
+                Get the history of a channel between two timestamps, reduced
+                to a fixed number of buckets.
+                @param name: The name of the desired channel.
+                @param start: The first timestamp, or None for the oldest one kept.
+                @param end: The last timestamp, or None for the newest one.
+                @param width: The number of buckets to return.
+                @return: A dict of 'min', 'max', 'mean' and 'time' arrays, or None.
+                """
+                return backend.get_history(name, start, end, width)
+
+            @staticmethod
+            def get_metrics():
+                """
+                Get the current value of every backend metric.
+                @return: A dict from metric name to a dict of values.
+                """
+                return backend.get_metrics()
+
+            @staticmethod
+            def get_outages():
+                """
+                Get the gaps in the samples from lost connections.
+                @return: A list of (start, end) sample times.
+                """
+                return backend.get_outages()
+
             @staticmethod
             def add_point(p):
                 """
@@ -114,27 +173,82 @@ class GUIController:
                 """
                 return backend.get_calibration()
 
-        backend = GUIBackend(Back2FrontAdapter(), config)
+            @staticmethod
+            def set_linear_calibration(name, slope, y_int):
+                """
+                Changes the calibration of a channel to a line and
+                recalibrates the data stored for it.
+                @param name: The name of the channel.
+                @param slope: The slope.
+                @param y_int: The y-intercept.
+                """
+                backend.set_linear_calibration(name, slope, y_int)
+
+            @staticmethod
+            def reload_calibrations():
+                """
+                Reloads every channel's calibration from config.ini.
+                """
+                backend.reload_calibrations()
+
+        # In process mode, ingest runs in its own process (see ingest.py)
+        if config.get("Backend", "Mode", fallback="thread") == "process":
+            backend = ProcessBackend(Back2FrontAdapter(), config)
+        else:
+            backend = GUIBackend(Back2FrontAdapter(), config)
         self.backend = backend
 
         frontend = GUIFrontend(Front2BackAdapter(), config)
         self.frontend = frontend
 
-    def start(self):
+    def start(self, replay=None):
         """
         Starts the controller by starting the backend and the
-        frontend.
+        frontend, and closes the backend once the frontend exits.
+        @param replay: A (path, speed) pair to replay recorded logs (see replay.py).
         """
         self.backend.start()
+        if replay is not None:
+            self.backend.start_replay(*replay)
         self.frontend.start()
+        self.backend.close()
 
 
 def main():
     """
-    Starts mission control by instantiating and starting GUIController.
+    Starts mission control by instantiating and starting GUIController,
+    or a Recorder when run with --headless.
     """
-    controller = GUIController()
-    controller.start()
+    parser = argparse.ArgumentParser(description="Mission control for the Mark 1-1 engine controller.")
+    parser.add_argument('--headless', action='store_true', help="record data without the GUI")
+    parser.add_argument('--address', help="the address to connect to (headless only)")
+    parser.add_argument('--port', help="the port to connect to (headless only)")
+    parser.add_argument('--log-dir', help="the directory to write sensor logs to")
+    parser.add_argument('--replay', metavar='PATH', help="replay recorded logs from a directory or file")
+    parser.add_argument('--speed', type=parse_speed, default=1.0,
+                        help="replay speed as a multiple of real time, or max (default 1)")
+    args = parser.parse_args()
+
+    # Don't append replayed samples to the logs they came from
+    if args.replay is not None and args.log_dir is None:
+        args.log_dir = os.path.join('logs', 'replay')
+    replay = (args.replay, args.speed) if args.replay is not None else None
+
+    config = configparser.RawConfigParser()
+    config.read('config.ini')
+    for section, option, value in (("UI Defaults", "Address", args.address), ("UI Defaults", "Port", args.port),
+                                   ("Logging", "Directory", args.log_dir)):
+        if value is not None:
+            if not config.has_section(section):
+                config.add_section(section)
+            config.set(section, option, value)
+
+    if args.headless:
+        import recorder
+        recorder.main(config, replay)
+    else:
+        controller = GUIController(config)
+        controller.start(replay)
 
 
 if __name__ == "__main__":
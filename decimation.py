@@ -0,0 +1,84 @@
+"""
+This file defines the ways GUIFrontend can reduce a channel's samples
+to the number of points it actually draws.
+"""
+
+import numpy as np
+
+# Decimation modes that can be selected for each plot
+STRIDE = "Stride"
+MIN_MAX = "Min/Max"
+# The whole session, from the backend's history pyramid rather than the newest samples
+SESSION = "Session"
+MODES = [MIN_MAX, STRIDE, SESSION]
+
+
+def stride(values, times, ratio):
+    """
+    Keeps every ratio-th sample. Cheap, but hides anything shorter than
+    ratio samples.
+    @param values: An array of sample values.
+    @param times: An array of timestamps.
+    @param ratio: How many samples to advance per kept sample.
+    @return: The decimated (values, times).
+    """
+    return values[::ratio], times[::ratio]
+
+
+def min_max(values, times, n_points):
+    """
+    Splits the samples into n_points / 2 buckets and keeps the minimum and
+    maximum of each, in the order they occurred. Transients survive no
+    matter how short they are.
+    @param values: An array of sample values.
+    @param times: An array of timestamps.
+    @param n_points: The number of points to return (at most).
+    @return: The decimated (values, times).
+    """
+    count = len(values)
+    buckets = n_points // 2
+    if count <= n_points or buckets == 0:
+        return values, times
+
+    size = count // buckets
+    # Buckets are aligned to the newest sample. Whatever is left over at the
+    # oldest end becomes one extra (smaller) bucket.
+    remainder = count - size * buckets
+
+    out_values = np.empty(2 * buckets + 2 * (remainder > 0), dtype=values.dtype)
+    out_times = np.empty(len(out_values), dtype=times.dtype)
+
+    if remainder > 0:
+        first, second = sorted((int(values[:remainder].argmin()), int(values[:remainder].argmax())))
+        out_values[0:2] = values[[first, second]]
+        out_times[0:2] = times[[first, second]]
+
+    bucket_values = values[remainder:].reshape(buckets, size)
+    bucket_times = times[remainder:].reshape(buckets, size)
+    low = bucket_values.argmin(axis=1)
+    high = bucket_values.argmax(axis=1)
+    first = np.minimum(low, high)
+    second = np.maximum(low, high)
+    rows = np.arange(buckets)
+
+    offset = 2 * (remainder > 0)
+    out_values[offset::2] = bucket_values[rows, first]
+    out_values[offset + 1::2] = bucket_values[rows, second]
+    out_times[offset::2] = bucket_times[rows, first]
+    out_times[offset + 1::2] = bucket_times[rows, second]
+
+    return out_values, out_times
+
+
+def envelope(series):
+    """
+    Turns reduced history (see DownsamplePyramid.series) into a line that
+    goes through the minimum and maximum of every bucket.
+    @param series: A dict of 'min', 'max' and 'time' arrays.
+    @return: The (values, times) to plot.
+    """
+    values = np.empty(2 * len(series['time']))
+    values[0::2] = series['min']
+    values[1::2] = series['max']
+
+    return values, np.repeat(series['time'], 2)
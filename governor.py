@@ -0,0 +1,95 @@
+"""
+This file defines FrameGovernor, which keeps the GUI's drawing within a
+share of the Tk thread's time so that it stays responsive to input at
+any data rate. It measures what each frame costs and first stretches
+the frame interval, then lowers the quality level, which draws fewer
+points per graph and repaints axes less often.
+"""
+
+
+class FrameGovernor:
+    """
+    Adapts the frame interval and quality level to the measured frame cost.
+    The load is the smoothed frame cost as a multiple of the budget at the
+    target frame interval: at a load of 2, frames cost twice what the
+    target frame rate can afford.
+    """
+
+    # Weight of the newest frame in the smoothed frame cost
+    SMOOTHING = 0.2
+
+    # The longest frame interval, in milliseconds
+    MAX_INTERVAL_MS = 500
+
+    # The quality level goes up after this many frames in a row over DEGRADE_LOAD,
+    # and down after this many in a row under RECOVER_LOAD
+    HOLD_FRAMES = 20
+    DEGRADE_LOAD = 2.0
+    RECOVER_LOAD = 0.5
+
+    # The lowest quality, at which graphs get 1 / 2 ** MAX_LEVEL of their usual points
+    MAX_LEVEL = 4
+
+    def __init__(self, target_interval_ms, budget, skip_frames):
+        """
+        @param target_interval_ms: The frame interval to run at when frames are cheap enough.
+        @param budget: The fraction of time drawing may take, e.g. 0.5.
+        @param skip_frames: The configured number of frames between axis repaints.
+        """
+        self.target_interval_ms = target_interval_ms
+        self.budget = budget
+        self.skip_frames = skip_frames
+
+        self.cost = 0.0
+        self.level = 0
+        self.interval_ms = target_interval_ms
+        self.held = 0
+
+    @property
+    def load(self):
+        return self.cost * 1000 / (self.budget * self.target_interval_ms)
+
+    @property
+    def point_scale(self):
+        """
+        The fraction of the usual number of points to draw per graph.
+        """
+        return 0.5 ** self.level
+
+    @property
+    def frames_to_skip(self):
+        """
+        The number of frames between axis repaints.
+        """
+        return max(1, self.skip_frames) + self.level if self.level else self.skip_frames
+
+    def record(self, seconds):
+        """
+        Records what a frame cost and adapts the interval and quality level.
+        @param seconds: The time the frame took to draw.
+        @return: True if the quality level changed, so graphs need redrawing.
+        """
+        self.cost += FrameGovernor.SMOOTHING * (seconds - self.cost)
+        load = self.load
+
+        self.interval_ms = int(min(FrameGovernor.MAX_INTERVAL_MS, self.target_interval_ms * max(1.0, load)))
+
+        if load > FrameGovernor.DEGRADE_LOAD and self.level < FrameGovernor.MAX_LEVEL:
+            step = 1
+        elif load < FrameGovernor.RECOVER_LOAD and self.level > 0:
+            step = -1
+        else:
+            self.held = 0
+            return False
+
+        # Only change level once the load has stayed high or low for a while
+        self.held += 1
+        if self.held < FrameGovernor.HOLD_FRAMES:
+            return False
+
+        self.held = 0
+        self.level += step
+        # Halving or doubling the points roughly halves or doubles the cost
+        self.cost *= 0.5 ** step
+
+        return True
@@ -0,0 +1,458 @@
+"""
+This file defines GraphRenderer, which draws the four mission control
+graphs into an off screen Agg canvas on its own thread, from snapshots
+of the channels' buffers. Drawing a frame can take tens of milliseconds,
+so doing it on the Tk thread held up the valve and ignition buttons.
+GUIFrontend only hands it the graph settings each frame and copies the
+finished pixels onto its Tk canvas (see GUIFrontend.draw_graphs).
+"""
+
+import threading
+import time
+
+from collections import OrderedDict
+
+import numpy as np
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PolyCollection
+from matplotlib.figure import Figure
+from matplotlib.ticker import AutoLocator
+from matplotlib.transforms import Bbox
+
+from axis_limits import AxisLimits
+from decimation import MIN_MAX, SESSION, envelope, min_max, stride
+from gui_constants import data_limits, data_lengths, samples_to_keep, str_to_byte
+
+
+def create_figure(width, height, dpi):
+    """
+    Creates the figure with the four graphs, without a canvas. It isn't
+    made with pyplot, which would tie it to the GUI's Tk window, so it can
+    be drawn from any thread.
+    @param width: The width of the figure in pixels.
+    @param height: The height of the figure in pixels.
+    @param dpi: The figure's dots per inch.
+    @return: The figure, and lists of the plots, axes and outage spans of the graphs.
+    """
+    figure = Figure(figsize=(float(width) / dpi, float(height) / dpi), dpi=dpi)
+    axes_list = figure.subplots(nrows=2, ncols=2).flatten()
+    figure.subplots_adjust(top=.9, bottom=.1, left=.12, right=.95, wspace=.3, hspace=.5)
+
+    # The lines are animated so that they're left out of the cached backgrounds (see plot_background)
+    plots = [axes.plot([0], [0], animated=True)[0] for axes in axes_list]
+
+    # Shading over the times the connection was down, spanning the height of each graph
+    outage_spans = []
+    for axes in axes_list:
+        spans = PolyCollection([], transform=axes.get_xaxis_transform(), facecolor='red', alpha=0.2,
+                               animated=True)
+        axes.add_collection(spans, autolim=False)
+        outage_spans.append(spans)
+
+    return figure, plots, axes_list, outage_spans
+
+
+class GraphSettings:
+    """
+    What the user has chosen to show on the graphs, read from the Tk
+    variables on the Tk thread, since the renderer's thread can't touch them.
+    """
+
+    def __init__(self, selections, modes, fine, set_limits, point_scale, frames_to_skip):
+        """
+        @param selections: The name of the channel each graph shows, e.g. "LC1".
+        @param modes: The decimation mode of each graph, one of decimation.MODES.
+        @param fine: Whether the Fine Control box is checked, which shows every sample.
+        @param set_limits: Whether the Data Limits box is checked.
+        @param point_scale: The fraction of the usual number of points to draw per graph.
+        @param frames_to_skip: The number of frames between axis limit updates.
+        """
+        self.selections = selections
+        self.modes = modes
+        self.fine = fine
+        self.set_limits = set_limits
+        self.point_scale = point_scale
+        self.frames_to_skip = frames_to_skip
+
+
+class GraphRenderer:
+    """
+    Draws the graphs with custom blitting. Frames are drawn on the renderer's
+    thread and copied into a second buffer once finished, so the Tk thread
+    never sees a half drawn frame and never waits for one: it takes whichever
+    parts of the last finished frame changed (see present).
+
+    draw can also be called directly, without starting the thread (see
+    benchmark.py).
+    """
+
+    # Most graph backgrounds kept (see plot_background), each a quarter of the figure's pixels
+    MAX_BACKGROUNDS = 16
+    # Room around a channel's data limits when the Data Limits box is checked, as a fraction of them
+    DATA_LIMITS_MARGIN = 0.05
+    # Room left ahead of the newest sample, as a fraction of the time shown, so the
+    # x limits and tick labels only move after that much more data has arrived
+    TIME_LEAD = 0.5
+    # How often (in seconds) the gaps from lost connections are fetched for the graphs
+    OUTAGE_POLL_INTERVAL = 0.5
+
+    def __init__(self, backend_adapter, figure, plots, axes_list, outage_spans):
+        """
+        @param backend_adapter: Where the channels' buffers and outages are read from.
+        @param figure: The figure to draw, from create_figure.
+        @param plots: The figure's lines.
+        @param axes_list: The figure's axes.
+        @param outage_spans: The figure's outage shading.
+        """
+        self.backend_adapter = backend_adapter
+        self.figure = figure
+        self.plots = plots
+        self.axes_list = axes_list
+        self.outage_spans = outage_spans
+        self.canvas = FigureCanvasAgg(figure)
+
+        self.frame_count = 0
+
+        # Gaps in the samples from lost connections, shaded on the graphs
+        self.outages = []
+        self.last_outage_update = 0.0
+
+        # What each graph last drew (see plot_version) and the background it was last drawn
+        # on, so that graphs without new data aren't redrawn
+        self.drawn_versions = [None] * 4
+        self.drawn_backgrounds = [None] * 4
+        # Each channel's (x, y) AxisLimits, kept while it isn't shown so switching back reuses them
+        self.axis_limits = {}
+        # Graph backgrounds with their axes and tick labels, by (graph, channel, x limits, y limits)
+        self.backgrounds = OrderedDict()
+
+        self.graph_area = self.init_refresh_settings()
+
+        # The last finished frame, and the (x, y, width, height) regions of it that changed
+        # since present last took them
+        self.frame = np.array(self.canvas.buffer_rgba())
+        self.changed = set()
+        self.frame_seconds = None
+        self.frame_lock = threading.Lock()
+
+        # The newest settings to draw with. Redraws are counted rather than flagged, so
+        # that one asked for while a frame is being drawn isn't lost.
+        self.settings = None
+        self.redraws_requested = 0
+        self.redraws_done = 0
+        self.busy = False
+        self.requested = threading.Event()
+        self.thread = None
+
+    def init_refresh_settings(self):
+        """
+        Draws the graphs without ticks or lines, which is restored under each
+        graph's axes when its background is drawn (see plot_background).
+        @return: A graph_area for the graphs.
+        """
+        for i in range(4):
+            self.axes_list[i].set_yticks([])
+            self.axes_list[i].set_xticks([])
+        self.canvas.draw()
+        for i in range(4):
+            self.axes_list[i].xaxis.set_major_locator(AutoLocator())
+            self.axes_list[i].yaxis.set_major_locator(AutoLocator())
+        [width, height] = self.canvas.get_width_height()
+        graph_area = self.canvas.copy_from_bbox(Bbox.from_bounds(0, 0, width, height))
+
+        return graph_area
+
+    def start(self):
+        """
+        Starts drawing on the renderer's thread whenever request is called.
+        """
+        self.thread = threading.Thread(target=self._run, name='GraphRenderer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self, settings, redraw=False):
+        """
+        Asks for a frame to be drawn with the given settings, without waiting
+        for it. Only the newest settings are drawn if frames are requested
+        faster than they're drawn.
+        @param settings: The GraphSettings to draw with.
+        @param redraw: Whether to redraw every graph even if nothing changed.
+        """
+        self.settings = settings
+        if redraw:
+            self.redraws_requested += 1
+        self.busy = True
+        self.requested.set()
+
+    def present(self, pixels):
+        """
+        Copies the parts of the last finished frame that changed since the
+        last call. Called from the Tk thread.
+        @param pixels: The (height, width, 4) RGBA array to copy into.
+        @return: A list of the (x, y, width, height) regions copied, in display
+                 coordinates, and how many seconds the newest frame took to draw.
+        """
+        with self.frame_lock:
+            changed, self.changed = self.changed, set()
+            seconds, self.frame_seconds = self.frame_seconds, None
+            for region in changed:
+                rows, columns = self.region_slices(region)
+                pixels[rows, columns] = self.frame[rows, columns]
+
+        return list(changed), seconds
+
+    def region_slices(self, region):
+        """
+        @param region: An (x, y, width, height) region in display coordinates.
+        @return: The rows and columns of the pixels covering it.
+        """
+        x, y, width, height = region
+        # Pixel rows count from the top, while display coordinates count from the bottom
+        rows = self.frame.shape[0]
+        return (slice(max(0, int(rows - np.ceil(y + height))), int(rows - np.floor(y))),
+                slice(max(0, int(np.floor(x))), int(np.ceil(x + width))))
+
+    def _run(self):
+        """
+        The renderer's thread, which draws a frame whenever one is requested.
+        """
+        while True:
+            self.requested.wait()
+            self.requested.clear()
+
+            redraws = self.redraws_requested
+            if redraws != self.redraws_done:
+                self.redraws_done = redraws
+                self.drawn_versions = [None] * 4
+                self.drawn_backgrounds = [None] * 4
+
+            start = time.perf_counter()
+            regions = self.draw(self.settings)
+            if regions:
+                self.publish(regions, time.perf_counter() - start)
+
+            self.busy = self.requested.is_set()
+
+    def publish(self, regions, seconds):
+        """
+        Copies the regions of the canvas that were drawn into the finished frame.
+        @param regions: The Bboxes drawn.
+        @param seconds: How long the frame took to draw.
+        """
+        pixels = np.asarray(self.canvas.buffer_rgba())
+        with self.frame_lock:
+            for region in regions:
+                region = tuple(region.bounds)
+                rows, columns = self.region_slices(region)
+                self.frame[rows, columns] = pixels[rows, columns]
+                self.changed.add(region)
+            self.frame_seconds = seconds
+
+    def draw(self, settings):
+        """
+        Draws the graphs. Only graphs whose channel has new samples, or whose
+        settings changed, are redrawn. Each is drawn over a cached background
+        with its axes, so the axes are only drawn when their limits move.
+        @param settings: The GraphSettings to draw with.
+        @return: A list of the Bboxes of the canvas that were drawn.
+        """
+        self.update_outages()
+
+        # Limits only move every few frames, when the axes may be redrawn
+        self.frame_count = self.frame_count + 1
+        if self.frame_count >= settings.frames_to_skip or settings.frames_to_skip == 0:
+            self.frame_count = 0
+            update_axes = True
+        else:
+            update_axes = False
+
+        # Decimated data is only computed once per frame for each channel and
+        # mode, even if several plots show it.
+        plot_data = {}
+        regions = []
+        for i in range(4):
+            graph_selection = settings.selections[i]
+            mode = settings.modes[i]
+
+            version = self.plot_version(graph_selection, mode, settings)
+            if version == self.drawn_versions[i]:
+                continue
+            self.drawn_versions[i] = version
+
+            if (graph_selection, mode) not in plot_data:
+                plot_data[graph_selection, mode] = self.get_plot_data(graph_selection, mode, settings,
+                                                                      int(self.axes_list[i].bbox.width))
+
+            values, times = plot_data[graph_selection, mode]
+            axes = self.axes_list[i]
+            self.plots[i].set_xdata(times)
+            self.plots[i].set_ydata(values)
+
+            key = self.drawn_backgrounds[i]
+            if update_axes or key is None or key[1] != graph_selection:
+                xlim, ylim = self.get_limits(graph_selection, values, times, settings.set_limits)
+                key = (i, graph_selection, xlim, ylim)
+            else:
+                xlim, ylim = key[2], key[3]
+            if axes.get_xlim() != xlim:
+                axes.set_xlim(xlim)
+            if axes.get_ylim() != ylim:
+                axes.set_ylim(ylim)
+            self.show_outages(i)
+
+            # Only the axes' box is redrawn unless the tick labels around it change too
+            regions.append(self.plot_region(i) if key != self.drawn_backgrounds[i] else axes.bbox)
+            self.canvas.restore_region(self.plot_background(key))
+            axes.draw_artist(self.outage_spans[i])
+            axes.draw_artist(self.plots[i])
+            self.drawn_backgrounds[i] = key
+
+        return regions
+
+    def get_limits(self, graph_selection, values, times, set_limits):
+        """
+        Gets the axis limits for a channel's data. They follow the data with
+        hysteresis (see axis_limits.py), or when the Data Limits box is checked,
+        the y limits are fixed to the channel's range in gui_constants.data_limits.
+        An outage that's still going on extends the x limits to the estimated
+        current time.
+        @param graph_selection: The name of the channel, e.g. "LC1".
+        @param values: The values drawn.
+        @param times: The times drawn.
+        @param set_limits: Whether the Data Limits box is checked.
+        @return: The (low, high) x limits and y limits.
+        """
+        if graph_selection not in self.axis_limits:
+            # Time only grows, so the x limits leave room ahead of the newest sample
+            self.axis_limits[graph_selection] = (AxisLimits(margin=0.0, lead=GraphRenderer.TIME_LEAD),
+                                                 AxisLimits())
+        x_limits, y_limits = self.axis_limits[graph_selection]
+
+        if len(times) == 0:
+            return x_limits.limits or (0.0, 1.0), y_limits.limits or (0.0, 1.0)
+
+        oldest, newest = float(times[0]), float(times[-1])
+        ongoing = [end for start, end in self.outages if start <= newest < end]
+        xlim = x_limits.update(oldest, max([newest] + ongoing))
+
+        if set_limits and graph_selection in data_limits:
+            limit = data_limits[graph_selection]
+            margin = GraphRenderer.DATA_LIMITS_MARGIN * limit
+            ylim = (-margin, limit + margin)
+        else:
+            low, high = np.nanmin(values), np.nanmax(values)
+            ylim = y_limits.update(float(low), float(high)) if np.isfinite(low) else (y_limits.limits or (0.0, 1.0))
+
+        return xlim, ylim
+
+    def plot_background(self, key):
+        """
+        Gets a graph's background: its quarter of the figure with the axes and
+        tick labels for the given limits but without the line. It's drawn the
+        first time it's needed and cached, so the axes are only drawn again
+        once the limits move to ones not seen recently.
+        @param key: The (graph index, channel, x limits, y limits) of the background.
+                    The graph's axes must already have those limits.
+        @return: A region of the canvas, for FigureCanvasAgg.restore_region.
+        """
+        background = self.backgrounds.get(key)
+        if background is not None:
+            self.backgrounds.move_to_end(key)
+            return background
+
+        i = key[0]
+        region = self.plot_region(i)
+        self.restore_background(region)
+        # Animated artists, i.e. the line and outage shading, aren't drawn
+        self.axes_list[i].draw(self.canvas.get_renderer())
+        background = self.canvas.copy_from_bbox(region)
+
+        self.backgrounds[key] = background
+        if len(self.backgrounds) > GraphRenderer.MAX_BACKGROUNDS:
+            self.backgrounds.popitem(last=False)
+
+        return background
+
+    def plot_version(self, graph_selection, mode, settings):
+        """
+        Identifies what a graph would draw, so that it's only redrawn when
+        that changes: the channel's buffer sequence number (see RingBuffer),
+        the graph's settings and the outages.
+        @param graph_selection: The name of the channel, e.g. "LC1".
+        @param mode: The decimation mode, one of decimation.MODES.
+        @param settings: The GraphSettings to draw with.
+        @return: A tuple that changes whenever the graph would.
+        """
+        sequence = self.backend_adapter.get_queue(str_to_byte[graph_selection]).sequence
+        return (graph_selection, mode, sequence, settings.fine, settings.set_limits, settings.point_scale,
+                len(self.outages), self.outages[-1] if self.outages else None)
+
+    def plot_region(self, i):
+        """
+        Gets the part of the canvas a graph and its tick labels are drawn in,
+        which is its quarter of the figure.
+        @param i: The index of the graph.
+        @return: A Bbox in display coordinates.
+        """
+        width, height = self.canvas.get_width_height()
+        row, column = divmod(i, 2)
+        return Bbox.from_bounds(column * width / 2, (1 - row) * height / 2, width / 2, height / 2)
+
+    def restore_background(self, bbox):
+        """
+        Restores part of the empty graphs saved by init_refresh_settings.
+        @param bbox: The part to restore, in display coordinates.
+        """
+        # Regions measure from the top left, while display coordinates measure from the bottom left
+        height = self.canvas.get_width_height()[1]
+        x0, y0, _, _ = self.graph_area.get_extents()
+        self.canvas.restore_region(self.graph_area, bbox=(bbox.x0, height - bbox.y1, bbox.x1, height - bbox.y0),
+                                   xy=(x0, y0))
+
+    def update_outages(self):
+        """
+        Fetches the gaps in the samples from lost connections, at most every
+        OUTAGE_POLL_INTERVAL seconds.
+        """
+        now = time.perf_counter()
+        if now - self.last_outage_update >= GraphRenderer.OUTAGE_POLL_INTERVAL:
+            self.last_outage_update = now
+            self.outages = self.backend_adapter.get_outages() or []
+
+    def show_outages(self, i):
+        """
+        Shades the gaps from lost connections in a graph.
+        @param i: The index of the graph.
+        """
+        left, right = self.axes_list[i].get_xlim()
+        self.outage_spans[i].set_verts([[(start, 0), (start, 1), (end, 1), (end, 0)]
+                                        for start, end in self.outages if end >= left and start <= right])
+
+    def get_plot_data(self, graph_selection, mode, settings, width):
+        """
+        Gets the newest samples of a channel, decimated down to about as many
+        points as we want to show in a graph (scaled by point_scale), or the
+        whole session's history.
+        @param graph_selection: The name of the channel, e.g. "LC1".
+        @param mode: The decimation mode, one of decimation.MODES.
+        @param settings: The GraphSettings to draw with.
+        @param width: The width of the graph in pixels.
+        @return: The (values, times) to plot.
+        """
+        if mode == SESSION:
+            series = self.backend_adapter.get_history(str_to_byte[graph_selection], None, None,
+                                                      max(1, int(width * settings.point_scale)))
+            if series is not None:
+                return envelope(series)
+
+        data_queue = self.backend_adapter.get_queue(str_to_byte[graph_selection])
+        values, times, _ = data_queue.snapshot(data_lengths[graph_selection])
+
+        if settings.fine:
+            return values, times
+        elif mode == MIN_MAX:
+            return min_max(values, times, max(1, int(samples_to_keep[graph_selection] * settings.point_scale)))
+        else:
+            data_ratio = int(data_lengths[graph_selection] / samples_to_keep[graph_selection] / settings.point_scale)
+            return stride(values, times, data_ratio)
@@ -0,0 +1,346 @@
+"""
+This file defines ProcessBackend, which runs a GUIBackend (networking,
+decoding, calibration and disk logging) in a child process so that
+ingest never waits on the GUI for the GIL. The child publishes every
+channel's ring buffer and rolling statistics in shared memory, and the
+GUI process reads them in place. Select it with Mode=process in the
+[Backend] section of config.ini.
+"""
+
+import configparser
+import multiprocessing
+import threading
+import time
+
+from queue import Empty
+
+import numpy as np
+
+from concurrency import run_async
+from logger import LogLevel, Logger
+from metrics import Metrics
+from model import GUIBackend, create_channel_stores, get_statistics_windows
+
+
+class SharedArena:
+    """
+    Hands out zeroed NumPy arrays carved from a single shared memory block.
+    Its allocate method can be passed anywhere np.zeros is accepted as an
+    allocator (e.g. RingBuffer). Arrays are laid out in the order they are
+    allocated, so two processes that allocate the same shapes in the same
+    order end up with the same arrays.
+    """
+
+    # Arrays start on cache line boundaries
+    ALIGNMENT = 64
+
+    def __init__(self, size=None, name=None):
+        """
+        Creates a new block, or attaches to an existing one.
+        @param size: The size of the block to create, in bytes.
+        @param name: The name of an existing block to attach to instead.
+        """
+        # Only imported here, as it needs Python 3.8 while thread mode runs on older versions
+        from multiprocessing import shared_memory
+
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        self.name = self.shm.name
+        self.offset = 0
+
+    @staticmethod
+    def measure(build):
+        """
+        Measures how big an arena needs to be.
+        @param build: A function that takes an allocator and allocates everything
+                      that should go in the arena with it.
+        @return: The size in bytes.
+        """
+        size = 0
+
+        def allocate(shape, dtype=np.float64):
+            nonlocal size
+            size = SharedArena._align(size) + np.dtype(dtype).itemsize * int(np.prod(shape))
+            return np.zeros(shape, dtype=dtype)
+
+        build(allocate)
+        return size
+
+    @staticmethod
+    def _align(offset):
+        return -(-offset // SharedArena.ALIGNMENT) * SharedArena.ALIGNMENT
+
+    def allocate(self, shape, dtype=np.float64):
+        """
+        Allocates the next array. New blocks are zero-filled by the OS.
+        @param shape: The shape of the array.
+        @param dtype: The dtype of the array.
+        @return: An array backed by the shared memory block.
+        """
+        dtype = np.dtype(dtype)
+        offset = SharedArena._align(self.offset)
+        array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+        self.offset = offset + array.nbytes
+
+        return array
+
+    def close(self, unlink=False):
+        """
+        Detaches from the block. Arrays allocated from it must not be used afterwards.
+        @param unlink: Whether to also free the block, which only its creator should do.
+        """
+        if unlink:
+            self.shm.unlink()
+
+        try:
+            self.shm.close()
+        except BufferError:
+            # Arrays still refer to the block. It's unmapped once they're garbage collected.
+            pass
+
+
+def run_ingest(config_sections, arena_name, commands, replies, messages, metrics):
+    """
+    The entry point of the ingest process. Runs a GUIBackend whose channel
+    stores live in the shared arena, and calls its methods on behalf of the
+    ProcessBackend in the GUI process until told to stop.
+    @param config_sections: The config as a dict of sections.
+    @param arena_name: The name of the shared memory block.
+    @param commands: A queue of (request_id, method, args) tuples. A method of None stops the process.
+    @param replies: A queue to put (request_id, result) for commands with a request_id.
+    @param messages: A queue to put (adapter method, message) tuples for the GUI on, e.g.
+                     ('display_msg', line) for a log message.
+    @param metrics: A queue to put a snapshot of the metrics on every Metrics.SAMPLE_INTERVAL seconds.
+    """
+    config = configparser.RawConfigParser()
+    config.read_dict(config_sections)
+    arena = SharedArena(name=arena_name)
+
+    class Back2ParentAdapter:
+        """
+        Forwards messages meant for the frontend to the GUI process.
+        """
+
+        @staticmethod
+        def display_msg(msg):
+            messages.put(('display_msg', msg))
+
+        @staticmethod
+        def display_alert(msg):
+            messages.put(('display_alert', msg))
+
+    backend = GUIBackend(Back2ParentAdapter(), config, arena.allocate)
+    backend.start()
+
+    @run_async
+    def publish_metrics():
+        while True:
+            time.sleep(Metrics.SAMPLE_INTERVAL)
+            metrics.put(backend.get_metrics())
+
+    publish_metrics()
+
+    while True:
+        request_id, method, args = commands.get()
+        if method is None:
+            break
+
+        try:
+            result = getattr(backend, method)(*args)
+        except Exception as e:
+            backend.logger.error("Ingest command " + method + " failed: " + repr(e))
+            result = None
+
+        if request_id is not None:
+            replies.put((request_id, result))
+
+    backend.close()
+
+
+class ProcessBackend:
+    """
+    Stands in for GUIBackend in the GUI process while the real one runs in
+    an ingest process (see run_ingest). Ring buffers and statistics are read
+    straight from shared memory, and the ingest process publishes its metrics
+    every second. Everything else is sent to the ingest
+    process as a command: commands that return something wait for the
+    reply, the rest return immediately. Methods that aren't documented here
+    behave like the GUIBackend methods of the same name.
+    """
+
+    # How long to wait for the ingest process to answer, in seconds
+    REPLY_TIMEOUT = 5.0
+
+    def __init__(self, back2front_adapter, config):
+        """
+        @param back2front_adapter: The adapter used to display messages in the frontend.
+        @param config: The parsed config.ini.
+        """
+        self.back2front_adapter = back2front_adapter
+        self.config = config
+
+        self.logger = Logger(name='ingest',
+                             display_func=self.back2front_adapter.display_msg,
+                             level=LogLevel.DEBUG,
+                             outfile='ingest.log',
+                             display_log=True)
+
+        size = SharedArena.measure(lambda allocate: create_channel_stores(config, allocate))
+        self.arena = SharedArena(size=size)
+        self.queue_dict, self.stats, self.ingest_latency = create_channel_stores(config, self.arena.allocate)
+        self.queues = list(self.queue_dict.values())
+        self.statistics_windows = get_statistics_windows(config)
+
+        self.calib_points = []
+
+        # The newest metrics the ingest process published, so reading them never waits on it
+        self.latest_metrics = {}
+
+        # spawn rather than fork, so the child doesn't inherit Tk
+        context = multiprocessing.get_context('spawn')
+        self.commands = context.Queue()
+        self.replies = context.Queue()
+        self.messages = context.Queue()
+        self.metrics = context.Queue()
+        config_sections = {section: dict(config.items(section)) for section in config.sections()}
+        self.process = context.Process(target=run_ingest, name='ingest', daemon=True,
+                                       args=(config_sections, self.arena.name, self.commands,
+                                             self.replies, self.messages, self.metrics))
+
+        self.request_lock = threading.Lock()
+        self.next_request_id = 0
+
+    def start(self):
+        """
+        Starts the ingest process, forwarding its messages to the frontend and
+        receiving its metrics.
+        """
+        self.process.start()
+        self._forward_messages()
+        self._receive_metrics()
+
+    def close(self):
+        """
+        Stops the ingest process, which flushes and closes the sensor logs,
+        and frees the shared memory.
+        """
+        if self.process.is_alive():
+            self.commands.put((None, None, ()))
+            self.process.join(ProcessBackend.REPLY_TIMEOUT)
+            if self.process.is_alive():
+                self.logger.error("Ingest process didn't stop, terminating it")
+                self.process.terminate()
+
+        self.arena.close(unlink=True)
+
+    @run_async
+    def _forward_messages(self):
+        """
+        Displays the messages and alerts the ingest process sends.
+        """
+        while True:
+            method, msg = self.messages.get()
+            getattr(self.back2front_adapter, method)(msg)
+
+    @run_async
+    def _receive_metrics(self):
+        """
+        Keeps the newest metrics the ingest process published.
+        """
+        while True:
+            self.latest_metrics = self.metrics.get()
+
+    def _post(self, method, *args):
+        """
+        Has the ingest process call a GUIBackend method without waiting for it.
+        @param method: The name of the method.
+        @param args: The arguments to call it with.
+        """
+        self.commands.put((None, method, args))
+
+    def _call(self, method, *args):
+        """
+        Has the ingest process call a GUIBackend method and waits for the result.
+        @param method: The name of the method.
+        @param args: The arguments to call it with.
+        @return: What the method returned, or None if the ingest process didn't answer in time.
+        """
+        with self.request_lock:
+            self.next_request_id += 1
+            request_id = self.next_request_id
+            self.commands.put((request_id, method, args))
+
+            while True:
+                try:
+                    reply_id, result = self.replies.get(timeout=ProcessBackend.REPLY_TIMEOUT)
+                except Empty:
+                    self.logger.error("Ingest process didn't answer " + method)
+                    return None
+
+                # Replies to calls that timed out earlier are dropped
+                if reply_id == request_id:
+                    return result
+
+    def send_text(self, s):
+        self._post('send_text', s)
+
+    def send_num(self, i):
+        self._post('send_num', i)
+
+    def send(self, b):
+        self._post('send', b)
+
+    def connect(self, address, port):
+        self._post('connect', address, port)
+
+    def disconnect(self):
+        self._post('disconnect')
+
+    def start_replay(self, path, speed):
+        self._post('start_replay', path, speed)
+
+    def get_all_queues(self):
+        return self.queues
+
+    def get_queue(self, name):
+        return self.queue_dict[name]
+
+    def get_stats(self, name):
+        return self.stats[name].get()
+
+    def get_statistics_windows(self):
+        return self.statistics_windows
+
+    def get_history(self, name, start, end, width):
+        return self._call('get_history', name, start, end, width)
+
+    def get_metrics(self):
+        """
+        Gets the metrics the ingest process last published, which are at most
+        Metrics.SAMPLE_INTERVAL seconds old, without waiting for it.
+        """
+        return self.latest_metrics
+
+    def get_outages(self):
+        return self._call('get_outages')
+
+    def get_ingest_latency(self):
+        return float(self.ingest_latency[0]), float(self.ingest_latency[1])
+
+    def add_point(self, p):
+        self.calib_points.append(p)
+
+    def get_calibration(self):
+        return GUIBackend.get_calibration(self)
+
+    def clear_calibration(self):
+        self.calib_points = []
+
+    def set_linear_calibration(self, name, slope, y_int):
+        self._post('set_linear_calibration', name, slope, y_int)
+
+    def reload_calibrations(self):
+        self._post('reload_calibrations')
@@ -77,6 +77,16 @@ class Logger:
         """
         return self._print_log(LogLevel.ERROR, message)
 
+    def is_enabled(self, level):
+        """
+        Checks whether messages at a log level are shown, so that callers can
+        skip building messages that would be thrown away.
+
+        :param level: Target log level.
+        :return: True if messages at the level are shown.
+        """
+        return self.display_log and self.level['value'] >= level['value']
+
     def _print_log(self, level, message):
         """
         Print a log entry to standard output, with the timestamp, log level, and context name
@@ -86,7 +96,7 @@ class Logger:
         :param message: Message to log.
         """
         # Don't print if we are suppressing the message:
-        if self.level['value'] < level['value']:
+        if not self.is_enabled(level):
             return
 
         formatted_msg = self.format_log(level, message)
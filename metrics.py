@@ -0,0 +1,203 @@
+"""
+This file defines Metrics, a set of named counters, gauges and
+histograms that the pipeline updates as it runs, so we can tell whether
+the network, the backend or the renderer is falling behind. Updating a
+metric is a few attribute updates, cheap enough for the hot path. Rates
+and histogram percentiles are computed once per second by a sampler
+thread, which can also append snapshots to a file as JSON lines.
+"""
+
+import json
+import math
+import threading
+import time
+
+
+class Counter:
+    """
+    A running total, e.g. of bytes received, and its rate per second.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.rate = 0.0
+        self.last_total = 0
+
+    def add(self, amount=1):
+        """
+        Adds to the total.
+        """
+        self.total += amount
+
+    def sample(self, elapsed):
+        """
+        Updates the rate, given the seconds since the last sample.
+        """
+        total = self.total
+        self.rate = (total - self.last_total) / elapsed
+        self.last_total = total
+
+    def snapshot(self):
+        return {'total': self.total, 'rate': self.rate}
+
+
+class Gauge:
+    """
+    The latest value of something, e.g. a queue depth, and the highest value
+    seen in the last sample period.
+    """
+
+    def __init__(self):
+        self.value = 0.0
+        self.peak = 0.0
+        self.max = 0.0
+        self.updated = None
+
+    def set(self, value):
+        """
+        Sets the value, remembering when it was set.
+        """
+        self.value = value
+        self.updated = time.perf_counter()
+        if value > self.peak:
+            self.peak = value
+
+    def sample(self, elapsed):
+        self.max = self.peak
+        self.peak = self.value
+
+    def snapshot(self):
+        age = time.perf_counter() - self.updated if self.updated is not None else None
+        return {'value': self.value, 'max': self.max, 'age': age}
+
+
+class Histogram:
+    """
+    The distribution of durations, e.g. of rendering a frame, in buckets
+    that double in size from 1 microsecond. Percentiles are over the last
+    sample period.
+    """
+
+    BUCKETS = 40
+    SMALLEST = 1e-6
+
+    def __init__(self):
+        self.counts = [0] * Histogram.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.percentiles = {'count': 0, 'mean': 0.0, 'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+        self.max = 0.0
+
+    def record(self, value):
+        """
+        Records a duration in seconds.
+        """
+        bucket = math.frexp(value / Histogram.SMALLEST)[1] if value > Histogram.SMALLEST else 0
+        self.counts[min(bucket, Histogram.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def sample(self, elapsed):
+        counts, self.counts = self.counts, [0] * Histogram.BUCKETS
+        count, total, maximum = self.count, self.total, self.max
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+        self.percentiles = {'count': count, 'mean': total / count if count else 0.0,
+                            'p50': Histogram._percentile(counts, count, 0.5),
+                            'p99': Histogram._percentile(counts, count, 0.99), 'max': maximum}
+
+    @staticmethod
+    def _percentile(counts, count, fraction):
+        """
+        @return: The upper edge of the bucket holding the given fraction of values.
+        """
+        seen = 0
+        for bucket, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if count and seen >= fraction * count:
+                return Histogram.SMALLEST * 2 ** bucket
+
+        return 0.0
+
+    def snapshot(self):
+        return dict(self.percentiles)
+
+
+class Metrics:
+    """
+    A registry of metrics by name. Metrics are created the first time they
+    are asked for, so code can simply do metrics.counter('frames').add().
+    """
+
+    # How often rates and percentiles are updated, in seconds
+    SAMPLE_INTERVAL = 1.0
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def _get(self, name, kind):
+        metric = self.metrics.get(name)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.setdefault(name, kind())
+
+        return metric
+
+    def counter(self, name):
+        return self._get(name, Counter)
+
+    def gauge(self, name):
+        return self._get(name, Gauge)
+
+    def histogram(self, name):
+        return self._get(name, Histogram)
+
+    def snapshot(self):
+        """
+        @return: A dict from metric name to a dict of its current values.
+        """
+        with self.lock:
+            metrics = list(self.metrics.items())
+
+        return {name: metric.snapshot() for name, metric in metrics}
+
+    def start(self, dump_path=None, dump_interval=0.0):
+        """
+        Starts sampling rates and percentiles every SAMPLE_INTERVAL seconds.
+        @param dump_path: A file to append a snapshot to every dump_interval seconds, or None.
+        @param dump_interval: How often to dump, in seconds. 0 doesn't dump.
+        """
+        self.thread = threading.Thread(target=self._run, args=(dump_path, dump_interval), name='Metrics')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self, dump_path, dump_interval):
+        """
+        The sampler thread.
+        """
+        last_sample = time.perf_counter()
+        last_dump = last_sample
+
+        while True:
+            time.sleep(Metrics.SAMPLE_INTERVAL)
+            now = time.perf_counter()
+            with self.lock:
+                metrics = list(self.metrics.values())
+            for metric in metrics:
+                metric.sample(now - last_sample)
+            last_sample = now
+
+            if dump_path is not None and dump_interval > 0 and now - last_dump >= dump_interval:
+                last_dump = now
+                try:
+                    with open(dump_path, 'a') as f:
+                        f.write(json.dumps({'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                                            'metrics': self.snapshot()}) + '\n')
+                except OSError:
+                    pass
@@ -5,18 +5,78 @@ with the backend using a Front2BackAdapter, which is defined in
 in GUIController
 """
 
-import csv
 import os
-import struct
+import threading
 import time
 
-from queue import Queue
+from queue import Queue, Empty
+
+import numpy as np
+
+from calibration import Calibration, load_calibrations
 from concurrency import run_async
+from gui_constants import data_lengths
 from logger import LogLevel, Logger
+from metrics import Metrics
+from networking.command_sender import CommandSender
 from networking.networker import Networker, ServerInfo
+from networking.server_info import payload_dtype
+from pyramid import DownsamplePyramid
+from replay import Replay, load_recording
+from ring_buffer import RingBuffer
+from rolling_stats import RollingStats
+from sensor_log import SensorLogWriter
 from scipy import stats
 
 
+def get_buffer_capacity(config, name):
+    """
+    Gets how many samples to keep in memory for a channel. This is the
+    channel's entry in the [Buffers] section of the config if there is
+    one, and data_lengths otherwise.
+    @param config: The config to read.
+    @param name: The name of the channel, e.g. "LC1".
+    @return: The capacity of the channel's ring buffer.
+    """
+    if config.has_option("Buffers", name):
+        return int(config.get("Buffers", name))
+
+    return data_lengths[name]
+
+
+def get_statistics_windows(config):
+    """
+    Gets the window sizes (in samples) of the rolling statistics from the config.
+    @param config: The config to read.
+    @return: A list of window sizes.
+    """
+    return [int(w) for w in config.get("Statistics", "Windows", fallback="20").split(',')]
+
+
+def create_channel_stores(config, allocate=np.zeros):
+    """
+    Creates the ring buffer and rolling statistics of every channel, and the
+    array the ingest latency is published in. Arrays are allocated with
+    allocate in a fixed order, so two processes that call this with
+    SharedArenas over the same shared memory get objects backed by the same
+    arrays (see ingest.py).
+    @param config: The config to read capacities and windows from.
+    @param allocate: The function used to allocate zeroed arrays, called like np.zeros.
+    @return: A dict from mtype to RingBuffer, a dict from mtype to RollingStats and
+             a (mean, max) latency array.
+    """
+    windows = get_statistics_windows(config)
+    ticks_per_second = float(config.get("Server", "Timestamp Ticks Per Second", fallback=1000000))
+
+    buffers = {}
+    stats = {}
+    for mtype, name in ServerInfo.filenames.items():
+        buffers[mtype] = RingBuffer(get_buffer_capacity(config, name), allocate)
+        stats[mtype] = RollingStats(buffers[mtype], windows, ticks_per_second, allocate)
+
+    return buffers, stats, allocate(2, dtype=np.float64)
+
+
 class GUIBackend:
     """
     This class is responsible for getting data from the network queue
@@ -24,7 +84,21 @@ class GUIBackend:
     for sending data back to the Pi.
     """
 
-    def __init__(self, back2front_adapter, config):
+    # The most network messages processed before the queue is checked again
+    MAX_BATCH = 256
+
+    # How often (in seconds) the ingest latency is reported
+    LATENCY_REPORT_INTERVAL = 5.0
+
+    # How often (in seconds) bad frames are reported, so a flood of them can't flood the log
+    BAD_FRAME_REPORT_INTERVAL = 1.0
+
+    def __init__(self, back2front_adapter, config, allocate=np.zeros):
+        """
+        @param back2front_adapter: The adapter used to display messages in the frontend.
+        @param config: The parsed config.ini.
+        @param allocate: The function the channel buffers are allocated with (see create_channel_stores).
+        """
         self.back2front_adapter = back2front_adapter
         self.config = config
         self.info = ServerInfo()
@@ -43,64 +117,96 @@ class GUIBackend:
                            outfile='networker.log',
                            display_log=True)
 
-        self.nw = Networker(nw_logger, self.config, queue=self.nw_queue)
-
-        self.Q_LC1 = []
-        self.Q_LC2 = []
-        self.Q_LC3 = []
-        self.Q_LC_MAIN = []
-
-        self.Q_TC1 = []
-        self.Q_TC2 = []
-        self.Q_TC3 = []
-
-        self.Q_FEED = []
-        self.Q_INJE = []
-        self.Q_COMB = []
-
-        self.queues = [self.Q_LC1, self.Q_LC2, self.Q_LC3, self.Q_LC_MAIN, self.Q_TC1,
-                       self.Q_TC2, self.Q_TC3, self.Q_FEED, self.Q_INJE, self.Q_COMB]
-
-        for queue in self.queues:
-            queue.append((0, 0))
-
-        # A dictionary to match mtypes to queues (see _process_recv_message)
-        self.queue_dict = {
-            ServerInfo.LC1_SEND: self.Q_LC1,
-            ServerInfo.LC2_SEND: self.Q_LC2,
-            ServerInfo.LC3_SEND: self.Q_LC3,
-            ServerInfo.LC_MAIN_SEND: self.Q_LC_MAIN,
-            ServerInfo.TC1_SEND: self.Q_TC1,
-            ServerInfo.TC2_SEND: self.Q_TC2,
-            ServerInfo.TC3_SEND: self.Q_TC3,
-            ServerInfo.PT_FEED_SEND: self.Q_FEED,
-            ServerInfo.PT_COMB_SEND: self.Q_COMB,
-            ServerInfo.PT_INJE_SEND: self.Q_INJE
+        # Rates, queue depths and lag for the instrumentation panel (see metrics.py)
+        self.metrics = Metrics()
+        self.ticks_per_second = float(self.config.get("Server", "Timestamp Ticks Per Second", fallback=1000000))
+        # The smallest difference seen between the wall clock and each channel's newest
+        # timestamp, which lag is measured from, as the two clocks aren't synchronized
+        self.clock_offsets = {}
+        # Gaps in the samples while the connection was down, as (start, end) sample times,
+        # measured from the newest sample before the gap (see _track_outages)
+        self.outages = []
+        self.last_sample_time = None
+        self.last_sample_arrival = None
+        self.seen_connections = 0
+
+        self.nw = Networker(nw_logger, self.config, queue=self.nw_queue, metrics=self.metrics)
+
+        # Commands are sent from their own thread, so sending never blocks the caller
+        commands_logger = Logger(name='commands',
+                                 display_func=self.back2front_adapter.display_msg,
+                                 level=LogLevel.INFO,
+                                 outfile='commands.log',
+                                 display_log=True)
+        self.commands = CommandSender(commands_logger, self.nw, self.metrics,
+                                      alert_func=self.back2front_adapter.display_alert)
+
+        # Ring buffers and rolling statistics per mtype (see _process_recv_message)
+        self.queue_dict, self.stats, self.ingest_latency = create_channel_stores(self.config, allocate)
+        self.queues = list(self.queue_dict.values())
+        self.statistics_windows = get_statistics_windows(self.config)
+
+        # Pre-aggregated history of each channel for browsing the whole session. This is
+        # kept in raw units, so changing a calibration doesn't invalidate it.
+        self.pyramids = {
+            mtype: DownsamplePyramid(capacity=int(self.config.get("History", "Buckets Per Level", fallback=16384)),
+                                     factor=int(self.config.get("History", "Factor", fallback=16)),
+                                     levels=int(self.config.get("History", "Levels", fallback=4)))
+            for mtype in ServerInfo.filenames
         }
 
+        # Time from a message arriving at the socket to its samples being in a
+        # ring buffer, accumulated between reports (see _record_latency)
+        self.latency_sum = 0.0
+        self.latency_count = 0
+        self.latency_max = 0.0
+
+        # The handler of each message type, indexed by its integer code (see _process_recv_message)
+        self.handlers = self._make_handlers()
+        self.last_bad_frame_report = 0.0
+        self.unreported_bad_frames = 0
+        self.last_latency_report = time.perf_counter()
+
+        # Calibration curves per mtype. The lock keeps a calibration from changing
+        # while a message is being calibrated and stored.
+        self.calibrations = load_calibrations(self.config)
+        self.calibration_lock = threading.Lock()
+
+        self.replay = None
         self.calib_points = []
+        self.log_dir = self.config.get("Logging", "Directory", fallback="logs/")
         self.init_log_dir()
+        self.log_writer = SensorLogWriter(self.logger,
+                                          log_dir=self.log_dir,
+                                          log_format=self.config.get("Logging", "Format", fallback='text'),
+                                          flush_interval=float(self.config.get("Logging", "Flush Interval",
+                                                                               fallback=1.0)),
+                                          flush_bytes=int(self.config.get("Logging", "Flush Bytes",
+                                                                          fallback=1 << 20)))
+        self.metrics.start(os.path.join(self.log_dir, 'metrics-ingest.jsonl'),
+                           float(self.config.get("Metrics", "Dump Interval", fallback=5.0)))
 
     def send_text(self, s):
         """
         Sends unicode text across the network.
         @param s: The string to send.
         """
-        self.nw.send(str.encode(s))
+        self.commands.send(str.encode(s), expect_ack=False)
 
     def send_num(self, i):
         """
         Sends a number across the network.
         @param i: The number to send.
         """
-        self.nw.send(int.to_bytes(i, byteorder='big', length=4))
+        self.commands.send(int.to_bytes(i, byteorder='big', length=4), expect_ack=False)
 
     def send(self, b):
         """
-        Sends a byte across the network.
+        Queues a command to be sent across the network. Abort commands are
+        sent ahead of others (see CommandSender).
         @param b: The byte to send.
         """
-        self.nw.send(b)
+        self.commands.send(b)
 
     def connect(self, address, port):
         """
@@ -108,69 +214,254 @@ class GUIBackend:
         @param address: The address to connect to.
         @param port: The port.
         """
-        self.nw.update_server_info(addr=address)
         self.nw.connect(addr=address, port=port)
+        # The server's clock may have been reset
+        self.clock_offsets = {}
 
     def disconnect(self):
         """
-        Disconnects the current network connection.
+        Disconnects the current network connection and flushes
+        the sensor logs to disk.
         """
         self.nw.disconnect()
+        self.commands.clear()
+        self.log_writer.flush()
+
+    def close(self):
+        """
+        Disconnects and closes the sensor logs. Called when mission control exits.
+        """
+        self.nw.disconnect()
+        self.log_writer.close()
+
+    def start_replay(self, path, speed):
+        """
+        Replays recorded logs through the network queue as if they were
+        arriving from the Pi (see replay.py).
+        @param path: A directory of logs or a single log.
+        @param speed: The multiple of real time to replay at, or None for as fast as possible.
+        """
+        replay_logger = Logger(name='replay',
+                               display_func=self.back2front_adapter.display_msg,
+                               level=LogLevel.INFO,
+                               outfile='replay.log',
+                               display_log=True)
+        try:
+            channels = load_recording(path)
+        except (OSError, ValueError) as e:
+            replay_logger.error("Couldn't load " + path + ": " + str(e))
+            return
+
+        self.replay = Replay(replay_logger, self.nw_queue, channels, payload_dtype(self.nw.server_info.info),
+                             self.ticks_per_second, speed)
+        self.replay.start()
 
     def get_all_queues(self):
         """
-        Returns all queues that are being used to store data.
-        @return: A list of queues containing data.
+        Returns all ring buffers that are being used to store data.
+        @return: A list of RingBuffers containing data.
         """
         return self.queues
 
     def get_queue(self, name):
         """
-        Gets a particular queue by its name, e.g. "LC1"
-        @param name: The name of the queue to return.
-        @return: The queue corresponding to the given name.
+        Gets a particular ring buffer by its mtype, e.g. ServerInfo.LC1_SEND
+        @param name: The mtype of the buffer to return.
+        @return: The RingBuffer corresponding to the given mtype.
         """
         return self.queue_dict[name]
 
+    def get_stats(self, name):
+        """
+        Gets the rolling statistics of a channel.
+        @param name: The mtype of the channel, e.g. ServerInfo.LC1_SEND
+        @return: The newest (value, time) pair or None, and a list with a dict of
+                 statistics for each configured window (see RollingWindow.get).
+        """
+        return self.stats[name].get()
+
+    def get_statistics_windows(self):
+        """
+        Gets the window sizes the rolling statistics are kept over. Channels
+        whose buffers are smaller than a window use the whole buffer instead.
+        @return: A list of window sizes in samples.
+        """
+        return self.statistics_windows
+
+    def get_history(self, name, start, end, width):
+        """
+        Gets the history of a channel between two timestamps, reduced to a
+        fixed number of buckets.
+        @param name: The mtype of the channel, e.g. ServerInfo.LC1_SEND
+        @param start: The first timestamp to include, or None for the oldest one kept.
+        @param end: The last timestamp to include, or None for the newest one.
+        @param width: The number of buckets to return, e.g. the plot width in pixels.
+        @return: A dict of 'min', 'max', 'mean' and 'time' arrays, or None if there's no data.
+        """
+        pyramid = self.pyramids[name]
+        span = pyramid.time_span()
+        if span is None:
+            return None
+
+        start = span[0] if start is None else start
+        end = span[1] if end is None else end
+        series = pyramid.series(start, end, width)
+
+        # Calibrate the raw history. Assumes the curve is monotonic over the
+        # bucket, and means are only exact for linear calibrations.
+        calibration = self.calibrations[name]
+        low = calibration.evaluate(series['min'])
+        high = calibration.evaluate(series['max'])
+        return {'min': np.minimum(low, high), 'max': np.maximum(low, high),
+                'mean': calibration.evaluate(series['mean']), 'time': series['time']}
+
+    def get_metrics(self):
+        """
+        Gets the current value of every metric (see metrics.py).
+        @return: A dict from metric name to a dict of values.
+        """
+        return self.metrics.snapshot()
+
+    def get_outages(self):
+        """
+        Gets the gaps in the samples from connections that were lost, and the
+        current one while reconnecting.
+        @return: A list of (start, end) sample times. The end of the current gap
+                 is estimated from the time since the last sample arrived.
+        """
+        outages = list(self.outages)
+        if self.nw.wanted and not self.nw.connected and self.last_sample_time is not None:
+            elapsed = time.perf_counter() - self.last_sample_arrival
+            outages.append((self.last_sample_time, self.last_sample_time + int(elapsed * self.ticks_per_second)))
+
+        return outages
+
+    def get_ingest_latency(self):
+        """
+        Gets the latency between a message arriving at the socket and its
+        samples being stored, as of the last report.
+        @return: The mean and maximum latency in seconds.
+        """
+        return float(self.ingest_latency[0]), float(self.ingest_latency[1])
+
     @run_async
     def start(self):
         """
-        Starts the model by defining a coroutine that continuously
-        processes items in the network queue.
+        Starts the model by defining a coroutine that processes items in the
+        network queue as soon as they arrive. Blocks while the queue is empty.
         """
         while True:
-            time.sleep(0.1)
-            if not self.nw.connected:
-                continue
-
-            self._process_recv_message()
-
-    def _process_recv_message(self):
-        """
-        Processes new messages from the network queue and checks that they
-        are valid before placing data in the appropriate queue. In theory also
-        processes other types of messages, but those cases aren't used right now.
-        """
-        if self.nw_queue.qsize() > 0:
-            self.logger.debug("Processing Messages")
-
-        while self.nw_queue.qsize() > 0:
-            mtype, nbytes, message = self.nw_queue.get()
-            self.logger.debug("Processing message: Type:" + str(mtype) + " Nbytes:" + str(nbytes))
-
-            # If the data size isn't what we expect, do nothing
-            if nbytes % self.nw.server_info.info.payload_bytes != 0:
-                self.logger.error("Received PAYLOAD message with improper number of bytes:" + str(nbytes))
-                return
-            else:  # Check mtype to determine what to do
-                if mtype == ServerInfo.ACK_VALUE:
-                    pass
-                elif mtype in ServerInfo.filenames.keys():
-                    self.read_payload(message, nbytes, mtype)
-                elif mtype == ServerInfo.TEXT:
-                    print(message.decode('utf-8'))
-                else:
-                    self.logger.error("Received incorrect message header type" + str(mtype))
+            # Wait for a message, then take whatever else is already queued
+            batch = [self.nw_queue.get()]
+            while len(batch) < GUIBackend.MAX_BATCH:
+                try:
+                    batch.append(self.nw_queue.get_nowait())
+                except Empty:
+                    break
+
+            self.metrics.gauge('backend.queue_depth').set(len(batch) + self.nw_queue.qsize())
+            started = time.perf_counter()
+            self._process_recv_message(batch)
+            self.metrics.histogram('backend.decode_seconds').record(time.perf_counter() - started)
+
+    def _make_handlers(self):
+        """
+        Builds the table of message handlers, with an entry for every possible
+        message type code. Each handler takes (mtype, nbytes, message, recv_time).
+        @return: A list of 256 handlers.
+        """
+        handlers = [self._handle_unknown] * 256
+        handlers[ServerInfo.ACK_VALUE[0]] = self._handle_ack
+        handlers[ServerInfo.TEXT[0]] = self._handle_text
+        for mtype in ServerInfo.filenames:
+            handlers[mtype[0]] = self._handle_payload
+
+        return handlers
+
+    def _process_recv_message(self, batch):
+        """
+        Processes a batch of messages from the network queue, handing each to
+        the handler of its type. Bad messages are counted and skipped.
+        @param batch: A list of (mtype, nbytes, message, recv_time) tuples.
+        """
+        handlers = self.handlers
+        if self.logger.is_enabled(LogLevel.DEBUG):
+            self.logger.debug("Processing {0} messages".format(len(batch)))
+
+        for mtype, nbytes, message, recv_time in batch:
+            handlers[mtype[0]](mtype, nbytes, message, recv_time)
+
+    def _handle_payload(self, mtype, nbytes, message, recv_time):
+        """
+        Stores the samples of a sensor data message.
+        """
+        # If the data size isn't what we expect, skip the message
+        if nbytes == 0 or nbytes % self.nw.server_info.info.payload_bytes != 0:
+            self._bad_frame('size', "Received PAYLOAD message with improper number of bytes:" + str(nbytes))
+            return
+
+        self.read_payload(message, nbytes, mtype)
+        self._record_latency(recv_time)
+
+    def _handle_ack(self, mtype, nbytes, message, recv_time):
+        """
+        Matches an ACK to the command it acknowledges (see CommandSender).
+        ACKs skip _handle_payload's size check, as their payload needn't be
+        whole records.
+        """
+        self.commands.acknowledge(message, recv_time)
+
+    def _handle_text(self, mtype, nbytes, message, recv_time):
+        """
+        Prints a text message from the server.
+        """
+        if message is not None:
+            print(message.decode('utf-8', errors='replace'))
+
+    def _handle_unknown(self, mtype, nbytes, message, recv_time):
+        self._bad_frame('type', "Received incorrect message header type" + str(mtype))
+
+    def _bad_frame(self, reason, description):
+        """
+        Counts a bad message, and logs it unless one was logged in the last
+        BAD_FRAME_REPORT_INTERVAL seconds.
+        @param reason: What was wrong, for the metric name, e.g. 'size'.
+        @param description: The message to log.
+        """
+        self.metrics.counter('backend.bad_frames').add()
+        self.metrics.counter('backend.bad_frames.' + reason).add()
+        self.unreported_bad_frames += 1
+
+        now = time.perf_counter()
+        if now - self.last_bad_frame_report >= GUIBackend.BAD_FRAME_REPORT_INTERVAL:
+            if self.unreported_bad_frames > 1:
+                description += " ({0} bad messages since the last report)".format(self.unreported_bad_frames)
+            self.logger.error(description)
+            self.last_bad_frame_report = now
+            self.unreported_bad_frames = 0
+
+    def _record_latency(self, recv_time):
+        """
+        Records the ingest latency of a message that was just stored in the
+        metrics, which the metrics panel shows, and publishes the mean and
+        maximum for get_ingest_latency every LATENCY_REPORT_INTERVAL seconds.
+        @param recv_time: The time.perf_counter() at which the message's bytes were received.
+        """
+        now = time.perf_counter()
+        latency = now - recv_time
+        self.metrics.histogram('backend.ingest_latency_seconds').record(latency)
+        self.latency_sum += latency
+        self.latency_count += 1
+        self.latency_max = max(self.latency_max, latency)
+
+        if now - self.last_latency_report >= GUIBackend.LATENCY_REPORT_INTERVAL:
+            self.ingest_latency[:] = (self.latency_sum / self.latency_count, self.latency_max)
+            self.logger.info("Ingest latency: mean {0:.3f} ms, max {1:.3f} ms over {2} messages".format(
+                1000 * self.ingest_latency[0], 1000 * self.ingest_latency[1], self.latency_count))
+            self.latency_sum = 0.0
+            self.latency_count = 0
+            self.latency_max = 0.0
+            self.last_latency_report = now
 
     def add_point(self, p):
         """
@@ -191,6 +482,39 @@ class GUIBackend:
 
         return stats.linregress(x, y)[:2]
 
+    def set_calibration(self, name, calibration):
+        """
+        Changes the calibration of a channel and recalibrates the samples
+        stored for it from their raw values.
+        @param name: The mtype of the channel, e.g. ServerInfo.LC1_SEND
+        @param calibration: The new Calibration.
+        """
+        with self.calibration_lock:
+            self.calibrations[name] = calibration
+            self.queue_dict[name].recalibrate(calibration)
+            self.stats[name].recompute()
+
+        self.logger.info("Calibration of " + ServerInfo.filenames[name] + " set to " + str(calibration))
+
+    def set_linear_calibration(self, name, slope, y_int):
+        """
+        Changes the calibration of a channel to a line, e.g. one
+        calculated by get_calibration.
+        @param name: The mtype of the channel, e.g. ServerInfo.LC1_SEND
+        @param slope: The slope.
+        @param y_int: The y-intercept.
+        """
+        self.set_calibration(name, Calibration.linear(slope, y_int))
+
+    def reload_calibrations(self):
+        """
+        Reloads every channel's calibration from config.ini and recalibrates
+        the stored samples.
+        """
+        self.config.read('config.ini')
+        for name, calibration in load_calibrations(self.config).items():
+            self.set_calibration(name, calibration)
+
     def clear_calibration(self):
         """
         Removes any currently stored calibration points.
@@ -200,7 +524,7 @@ class GUIBackend:
     def read_payload(self, b, num_bytes, msg_type=None):
         """
         Reads a message corresponding to payload data, logging it to a log
-        file and placing the data in the queue. Calibration happens here.
+        file and placing the data in the channel's ring buffer. Calibration happens here.
         @param b: The byte array containing the message.
         @param num_bytes: The number of bytes in the message.
         @param msg_type: The type of message, i.e. which payload.
@@ -214,42 +538,69 @@ class GUIBackend:
 
         assert num_bytes % payload_bytes == 0
 
-        if msg_type is not None and msg_type in ServerInfo.filenames.keys():
-            save_file = open('logs/' + ServerInfo.filenames[msg_type] + '.log', 'a+')
-            writer = csv.writer(save_file, delimiter=" ")
-        else:
-            save_file = None
-            writer = None
-
-        bcount = 0
-        while bcount < num_bytes:
-            d, t = struct.unpack("2Q", b[bcount: bcount + info.payload_bytes])
+        # View the whole message as an array of records and calibrate it in one go
+        records = np.frombuffer(b, dtype=payload_dtype(info), count=num_bytes // payload_bytes)
+        raw = records['data']
+        times = records['time']
 
-            bcount += info.payload_bytes
-
-            if msg_type in ServerInfo.calibrations.keys():
-                calibration = ServerInfo.calibrations[msg_type]
-                cal = d * calibration[0] + calibration[1]
+        with self.calibration_lock:
+            calibration = self.calibrations.get(msg_type)
+            if calibration is not None:
+                cal = calibration.apply(raw)
             else:
-                cal = 0
+                cal = np.zeros(len(raw))
 
-            if not save_file:
-                writer.writerow([str(t), str(d), str(cal)])
+            if msg_type in ServerInfo.filenames:
+                self.log_writer.write(ServerInfo.filenames[msg_type], times, raw, cal)
             if self.queue_dict[msg_type] is not None:
-                self.queue_dict[msg_type].append((cal, t))
+                self.queue_dict[msg_type].append_block(cal, times, raw)
+                self.stats[msg_type].update(len(cal))
+                self.pyramids[msg_type].append_block(raw.astype(np.float64), times)
+
+        if msg_type in ServerInfo.filenames and len(times) > 0:
+            self._track_outages(int(times[0]), int(times[-1]))
+            self._record_arrival(ServerInfo.filenames[msg_type], len(times), int(times[-1]))
+
+    def _track_outages(self, first_time, newest_time):
+        """
+        Records the gap before the first samples after a reconnect, and
+        remembers the newest sample so the next gap can be measured from it.
+        @param first_time: The timestamp of the first of the samples that arrived.
+        @param newest_time: The timestamp of the newest of them.
+        """
+        if self.nw.connections != self.seen_connections:
+            self.seen_connections = self.nw.connections
+            if self.last_sample_time is not None and first_time > self.last_sample_time:
+                self.outages.append((self.last_sample_time, first_time))
+
+        if self.last_sample_time is None or newest_time > self.last_sample_time:
+            self.last_sample_time = newest_time
+        self.last_sample_arrival = time.perf_counter()
+
+    def _record_arrival(self, name, count, newest_time):
+        """
+        Counts a channel's samples and updates how far its newest sample lags
+        behind the wall clock, relative to the smallest lag seen so far.
+        @param name: The name of the channel.
+        @param count: The number of samples that arrived.
+        @param newest_time: The timestamp of the newest sample.
+        """
+        offset = time.perf_counter() - newest_time / self.ticks_per_second
+        smallest = min(self.clock_offsets.get(name, offset), offset)
+        self.clock_offsets[name] = smallest
 
-        if save_file:
-            save_file.close()
+        self.metrics.counter('samples.' + name).add(count)
+        self.metrics.gauge('lag.' + name).set(offset - smallest)
 
     def init_log_dir(self):
         """
-        Creates the logs/ directory if it doesn't already exist.
+        Creates the log directory (logs/ by default) if it doesn't already exist.
         This is used to store log files.
         @return: Nothing.
         """
-        if not os.path.isdir("logs/"):
+        if not os.path.isdir(self.log_dir):
             try:
-                os.mkdir("logs/")
+                os.makedirs(self.log_dir)
             except OSError:
                 self.logger.error("Error creating logs directory!")
         else:
@@ -0,0 +1,219 @@
+"""
+This file defines CommandSender, which sends the GUI's commands to the
+Pi from its own thread, abort commands first, and times each command's
+round trip from the moment it is sent to the moment its ACK arrives.
+"""
+
+import itertools
+import threading
+import time
+
+from queue import Empty, PriorityQueue
+
+from networking.networker import message_type_name
+from networking.server_info import ServerInfo
+
+
+class CommandSender:
+    """
+    Sends commands to the Pi from its own thread, so that a slow or dead
+    socket never blocks the GUI, and matches the Pi's ACK_VALUE replies to
+    the commands they acknowledge to measure each command's round trip.
+
+    Abort commands jump ahead of any other queued commands, and while the
+    connection is down they're held until it's back, for up to HOLD_TIMEOUT.
+    Other commands are only sent on the connection they were queued on, as
+    e.g. an ignition sent late is never what was asked for. The Pi's ACKs
+    carry the command they acknowledge in their first record's data field;
+    an ACK without one acknowledges the oldest command still waiting.
+    """
+
+    # Commands that make the engine safe, which are sent before anything else queued
+    ABORT_COMMANDS = {ServerInfo.UNSET_IGNITION, ServerInfo.UNSET_VALVE, ServerInfo.DEFAULT}
+
+    ABORT_PRIORITY = 0
+    NORMAL_PRIORITY = 1
+
+    # Seconds after which a command that hasn't been acknowledged is reported
+    ACK_TIMEOUT = 2.0
+
+    # Seconds an abort command is held for while the Networker reconnects, from
+    # when it was queued, after which it's dropped
+    HOLD_TIMEOUT = 5.0
+    # Seconds between checks of whether a held command is still wanted
+    HOLD_POLL_INTERVAL = 0.1
+
+    def __init__(self, logger, nw, metrics=None, alert_func=lambda msg: None):
+        """
+        :param logger: The logger that sends, ACKs and round trips are reported to.
+        :param nw: The Networker to send with.
+        :param metrics: Where round trips, unacknowledged and dropped commands are counted, if anywhere.
+        :param alert_func: A function that shows the operator a command that was dropped.
+        """
+        self.logger = logger
+        self.nw = nw
+        self.metrics = metrics
+        self.alert_func = alert_func
+
+        # (priority, order, message, expect_ack, queued time, connection) entries. The
+        # order keeps commands of the same priority first in, first out. The connection
+        # is the Networker's connection count when it was queued, or None if it wasn't
+        # connected.
+        self.queue = PriorityQueue()
+        self.order = itertools.count()
+
+        # (command byte, sent time) of each command waiting for an ACK, oldest first
+        self.pending = []
+        self.pending_lock = threading.Lock()
+
+        self.thread = threading.Thread(target=self._run, name='CommandSender')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send(self, message, expect_ack=True):
+        """
+        Queues a message to be sent, without waiting for it.
+        :param message: The bytes to send. One byte messages are commands.
+        :param expect_ack: Whether the Pi acknowledges the message.
+        :return: None
+        """
+        priority = CommandSender.ABORT_PRIORITY if message in CommandSender.ABORT_COMMANDS \
+            else CommandSender.NORMAL_PRIORITY
+        connection = self.nw.connections if self.nw.connected else None
+        self.queue.put((priority, next(self.order), message, expect_ack, time.perf_counter(), connection))
+
+    def acknowledge(self, message, recv_time):
+        """
+        Matches an ACK to the command it acknowledges and reports the round trip.
+        :param message: The ACK's payload, or None if it has none.
+        :param recv_time: The time.perf_counter() time the ACK arrived.
+        :return: The round trip in seconds, or None if no command was waiting for an ACK.
+        """
+        code = bytes(message[0:1]) if message else None
+
+        with self.pending_lock:
+            matches = [i for i, (command, _) in enumerate(self.pending) if command == code]
+            if matches:
+                command, sent_time = self.pending.pop(matches[0])
+            elif self.pending:
+                command, sent_time = self.pending.pop(0)
+            else:
+                command = None
+
+        if command is None:
+            self.logger.warn("Received an ACK for no command")
+            return None
+
+        round_trip = recv_time - sent_time
+        self.logger.info("ACK {0} in {1:.1f} ms".format(CommandSender.command_name(command), 1000 * round_trip))
+        if self.metrics is not None:
+            self.metrics.histogram('command.round_trip_seconds').record(round_trip)
+            self.metrics.gauge('command.last_round_trip.' + CommandSender.command_name(command)).set(round_trip)
+
+        return round_trip
+
+    def clear(self):
+        """
+        Forgets the commands waiting for an ACK, e.g. when the connection is lost.
+        :return: None
+        """
+        with self.pending_lock:
+            self.pending = []
+
+    @staticmethod
+    def command_name(command):
+        """
+        Names a command for display, e.g. SET_VALVE.
+        :param command: The command byte.
+        :return: The name.
+        """
+        names = [name for name, value in vars(ServerInfo).items() if value == command and not name.endswith('_SEND')]
+        return names[0] if names else message_type_name(command)
+
+    def _run(self):
+        """
+        The sender thread, which sends queued messages and reports commands
+        that go unacknowledged.
+        """
+        while True:
+            self._expire_pending()
+
+            try:
+                priority, _, message, expect_ack, queued_time, connection = \
+                    self.queue.get(timeout=CommandSender.ACK_TIMEOUT / 2)
+            except Empty:
+                continue
+
+            if priority == CommandSender.ABORT_PRIORITY:
+                if not self._hold(queued_time):
+                    self._drop(message, "no connection within {0:.0f} s".format(CommandSender.HOLD_TIMEOUT)
+                               if self.nw.wanted else "not connected")
+                    continue
+            elif not self.nw.connected:
+                self._drop(message, "not connected")
+                continue
+            elif connection != self.nw.connections:
+                self._drop(message, "the connection it was sent on was lost")
+                continue
+
+            # Wait for the ACK before sending, as it may be processed before send returns
+            sent_time = time.perf_counter()
+            if expect_ack:
+                with self.pending_lock:
+                    self.pending.append((message, sent_time))
+
+            if not self.nw.send(message):
+                self.clear()
+                if priority == CommandSender.ABORT_PRIORITY:
+                    # Hold it for the next connection
+                    self.queue.put((priority, next(self.order), message, expect_ack, queued_time, None))
+                else:
+                    self._drop(message, "the send failed")
+                continue
+
+            if sent_time - queued_time > 0.1:
+                self.logger.warn("{0} waited {1:.0f} ms to be sent".format(CommandSender.command_name(message),
+                                                                           1000 * (sent_time - queued_time)))
+
+    def _hold(self, queued_time):
+        """
+        Waits for the Networker to be connected, while it's trying to be, until
+        HOLD_TIMEOUT after queued_time.
+        :param queued_time: The time.perf_counter() time the command was queued.
+        :return: Whether the Networker is connected.
+        """
+        while not self.nw.connected and self.nw.wanted:
+            remaining = queued_time + CommandSender.HOLD_TIMEOUT - time.perf_counter()
+            if remaining <= 0:
+                break
+            # In slices, to notice a disconnect, which doesn't set conn_event
+            self.nw.conn_event.wait(min(remaining, CommandSender.HOLD_POLL_INTERVAL))
+
+        return self.nw.connected
+
+    def _drop(self, message, reason):
+        """
+        Reports a message that won't be sent, in the log and to the operator.
+        :param message: The message.
+        :param reason: Why it won't be sent.
+        """
+        msg = "Dropped {0}: {1}".format(CommandSender.command_name(message), reason)
+        self.logger.error(msg)
+        self.alert_func(msg)
+        if self.metrics is not None:
+            self.metrics.counter('command.dropped').add()
+
+    def _expire_pending(self):
+        """
+        Reports and forgets commands that weren't acknowledged in time.
+        """
+        now = time.perf_counter()
+        with self.pending_lock:
+            expired = [command for command, sent_time in self.pending if now - sent_time > CommandSender.ACK_TIMEOUT]
+            self.pending = [(command, sent_time) for command, sent_time in self.pending
+                            if now - sent_time <= CommandSender.ACK_TIMEOUT]
+
+        for command in expired:
+            self.logger.error("No ACK for " + CommandSender.command_name(command))
+            if self.metrics is not None:
+                self.metrics.counter('command.unacknowledged').add()
@@ -1,5 +1,4 @@
 import socket
-import struct
 import threading
 
 from queue import Queue
@@ -12,7 +11,19 @@ import time
 from logger import LogLevel, Logger
 from networking.server_info import*
 
-# MAJOR TODO move this networker to processing requests on its own thread and then let it attempt reconnection.
+# MAJOR TODO move this networker to processing requests on its own thread.
+
+
+def message_type_name(htype):
+    """
+    Names a message type for display, e.g. LC1 for ServerInfo.LC1_SEND.
+    :param htype: The header type byte.
+    :return: The name.
+    """
+    if htype in ServerInfo.filenames:
+        return ServerInfo.filenames[htype]
+
+    return {ServerInfo.ACK_VALUE: 'ACK', ServerInfo.TEXT: 'TEXT'}.get(htype, 'TYPE_' + htype.hex())
 
 
 class Networker:
@@ -22,6 +33,8 @@ class Networker:
             assert(isinstance(nw, Networker))
 
             threading.Thread.__init__(self)
+            # Don't keep the program alive once mission control or the recorder exits
+            self.daemon = True
             self.threadID = threadID
             self.name = name
             self.counter = counter
@@ -29,56 +42,119 @@ class Networker:
 
         def run(self):
             while True:
-                # Ensure we are connected:
+                # Ensure we are connected. While the connection is down, _reconnect
+                # brings it back.
                 self.nw.conn_event.wait()
 
-                # Try to receive a message:
-                t, nb, m = self.nw.read_message()
-                # print(t)
-                if (t is not None):
-                    self.nw.out_queue.put((t, nb, m))
+                # Receive as many complete messages as one read gives us, stamped
+                # with when their bytes arrived so that the backend can track latency:
+                messages = self.nw.read_messages()
+                recv_time = self.nw.recv_time
+                for t, nb, m in messages:
+                    self.nw.out_queue.put((t, nb, m, recv_time))
+
+                if messages:
+                    # The connection works, so the next one lost is retried quickly again
+                    self.nw.reconnect_delay = Networker.RECONNECT_MIN_DELAY
+
+                if self.nw.metrics is not None:
+                    self.nw.count_messages(messages)
 
     @staticmethod
-    def make_socket():
+    def make_socket(timeout=5.0):
         tcp_sock = socket.socket()
         udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
-        # 50ms timeout, with the intent of giving just a bit of time if receiving.
-        tcp_sock.settimeout(5)
-        udp_sock.settimeout(5)
+        # Commands are single bytes, so send each at once instead of waiting on the previous one's ACK
+        tcp_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        # The Pi streams continuously, so this long without data means the connection is gone.
+        tcp_sock.settimeout(timeout)
+        udp_sock.settimeout(timeout)
 
         return tcp_sock, udp_sock
 
-    def __init__(self, logger, config, queue=None):
+    # Initial size of the reusable receive buffer. Big enough to pull in many frames per system call.
+    RECV_BUFFER_SIZE = 1 << 16
+    # The most bytes a UDP datagram can hold, which the receive buffer keeps free when receiving on UDP
+    MAX_DATAGRAM_BYTES = 65535
+
+    # Seconds to wait before the first attempt to reconnect, doubling after each attempt up to the max
+    # until a connection delivers frames.
+    RECONNECT_MIN_DELAY = 0.1
+    RECONNECT_MAX_DELAY = 2.0
+
+    def __init__(self, logger, config, queue=None, metrics=None):
         self.logger = logger
         self.config = config
-        self.tcp_sock, self.udp_sock = self.make_socket()
+        # Where the bytes and frames received of each message type are counted, if anywhere
+        self.metrics = metrics
+        # The (frames, bytes) counters of each message type, by its integer code
+        self.type_counters = [None] * 256
+        self.timeout = float(self.config.get("Server", "Timeout", fallback=5.0))
+        self.tcp_sock, self.udp_sock = self.make_socket(self.timeout)
         self.recv_sock = None
         self.addr = None
         self.port = None
         self.connected = False
-        self.trying_connect = False
+        # Whether we should be connected, i.e. connect was called and disconnect wasn't since.
+        # While it is, a lost connection is brought back by _reconnect.
+        self.wanted = False
+        self.reconnecting = False
+        # Seconds _reconnect waits before its next attempt. It's kept across reconnects, so a server
+        # that accepts and then drops every connection isn't retried ever faster.
+        self.reconnect_delay = Networker.RECONNECT_MIN_DELAY
+        # Set to make _reconnect try at once instead of waiting out the delay, or stop if no longer wanted
+        self.reconnect_wake = threading.Event()
+        # How many connections have been made, so others can tell a reconnect happened
+        self.connections = 0
+        # Serializes opening and closing the sockets between the caller, the NWThread and _reconnect
+        self.conn_lock = threading.RLock()
         # TODO for now we only have the data receiving on a separate thread because that was straightforward:
         self.out_queue = queue if queue is not None else Queue()
         self.conn_event = threading.Event()
 
-        self.thr = Networker.NWThread(1, 'NWThread', 1, self)
-        self.thr.start()
+        # Receive buffer and the region [recv_start, recv_end) that holds bytes not yet parsed into frames.
+        self.recv_buffer = bytearray(Networker.RECV_BUFFER_SIZE)
+        self.recv_view = memoryview(self.recv_buffer)
+        self.recv_start = 0
+        self.recv_end = 0
+        # The number of unparsed bytes we need before the next frame can be parsed.
+        self.recv_needed = 0
+        # Whether the next frame header has to be found before parsing, e.g. after a corrupt header.
+        self.resyncing = False
+        # The time.perf_counter() time the last chunk was received, before it was parsed
+        self.recv_time = 0.0
 
         self.server_info = ServerInfo()
+        self.header_struct = self.server_info.info.header_struct
+        # The frame layout from [Server] Layout, or None to detect it from the first frames of each connection
+        layout = self.config.get("Server", "Layout", fallback="auto")
+        self.layout = None if layout == "auto" else ServerInfo.layouts[layout]
+        if self.layout is not None:
+            self.set_layout(self.layout)
+        # Whether the layout of the current connection is yet to be detected
+        self.detecting_layout = False
+
+        self.thr = Networker.NWThread(1, 'NWThread', 1, self)
+        self.thr.start()
 
         # self.logger.info("Initialized")
 
-    def update_server_info(self, addr):
-        host = socket.gethostbyaddr(addr)[0]
-        if host != 'raspberry' and host != 'Pi01':
-            self.server_info.info = ServerInfo.OtherInfo
-        else:
-            self.server_info.info = ServerInfo.PiInfo
+    def set_layout(self, layout):
+        """
+        Sets the layout frames are parsed with.
+        :param layout: A layout class from ServerInfo.layouts.
+        :return: None
+        """
+        self.server_info.info = layout
+        self.header_struct = layout.header_struct
 
     def connect(self, addr=None, port=None):
         """
         Connects to a given address and port or just tries to reconnect (if args are none or same).
+        Returns at once: the connection is made by _reconnect in the background, and if it can't be
+        made, or is lost later, it keeps being retried until disconnect is called.
         :param addr: The address to connect
         :param port: The port to connect to.
         :return: None
@@ -95,51 +171,150 @@ class Networker:
         if self.connected:
             return
 
-        self.trying_connect = True
-        while self.trying_connect:
-            try:
-                self.tcp_sock.connect((self.addr, int(self.port)))
-                if (self.config.get("Server", "Protocol") == "UDP"):
-                    self.udp_sock.bind(('', int(self.port)))
-                    self.recv_sock = self.udp_sock
-                    self.logger.error("Receiving on UDP")
-                else:
-                    self.recv_sock = self.tcp_sock
-                    self.logger.error("Receiving on TCP")
-            except socket.timeout:
-                self.logger.error("Connect timed out.")
-                sys.exit(0)
-            except OSError as e:
-                self.logger.error("Connection failed. OSError:" + e.strerror)
-                self.trying_connect = False
-            except:
-                self.logger.error("Connect: Unexpected error:" + str(sys.exc_info()[0]))
-                self.trying_connect = False
-            else:
-                self.update_server_info(self.addr)
-                self.logger.error("Successfully connected. Using info " + self.server_info.info.__name__)
-                self.trying_connect = False
+        self.wanted = True
+        self._start_reconnecting()
+        # Try now rather than after the backoff delay
+        self.reconnect_wake.set()
+
+    def _open(self):
+        """
+        Makes one attempt to connect to self.addr and self.port. The lock isn't held while
+        connecting, so disconnect never waits for an attempt to time out.
+        :return: True if we're connected.
+        """
+        with self.conn_lock:
+            if self.connected or not self.wanted:
+                return self.connected
+            tcp_sock, udp_sock = self.tcp_sock, self.udp_sock
+            addr, port = self.addr, self.port
+
+        udp = self.config.get("Server", "Protocol") == "UDP"
+        try:
+            tcp_sock.connect((addr, int(port)))
+            if udp:
+                udp_sock.bind(('', int(port)))
+        except socket.timeout:
+            self.logger.error("Connect timed out.")
+        except OSError as e:
+            self.logger.error("Connection failed. OSError:" + str(e.strerror))
+        except:
+            self.logger.error("Connect: Unexpected error:" + str(sys.exc_info()[0]))
+        else:
+            with self.conn_lock:
+                # Unless disconnect or connect to another server was called meanwhile
+                if not self.wanted or tcp_sock is not self.tcp_sock or (addr, port) != (self.addr, self.port):
+                    self.logger.warn("Connected to a server no longer wanted. Closing")
+                    return self._abandon(tcp_sock)
+
+                self.recv_sock = udp_sock if udp else tcp_sock
+                self.logger.error("Receiving on UDP" if udp else "Receiving on TCP")
+                self.detecting_layout = self.layout is None
+                self.logger.error("Successfully connected. Using info " +
+                                  ("detected from the first frames" if self.detecting_layout
+                                   else self.server_info.info.__name__))
+                self.reset_recv_buffer()
+                # Whatever arrives first, find a frame header before parsing it
+                self.resyncing = True
+                self.connections += 1
                 self.connected = True
                 # TODO make this variable not some hacky global.
                 self.conn_event.set()
+                return True
+
+        return self._abandon(tcp_sock)
+
+    def _abandon(self, tcp_sock):
+        """
+        Closes the sockets of a connection attempt that failed or is no longer wanted,
+        as a socket that tried to connect can't be used again.
+        :param tcp_sock: The TCP socket of the attempt.
+        :return: False
+        """
+        with self.conn_lock:
+            if tcp_sock is self.tcp_sock:
+                self._close()
+
+        return False
+
+    def _close(self):
+        """
+        Closes the sockets and makes new ones for the next connection.
+        :return: None
+        """
+        with self.conn_lock:
+            self.conn_event.clear()
+            self.connected = False
+            self.tcp_sock.close()
+            self.udp_sock.close()
+            self.recv_sock = None
+
+            # Recreate the socket so that we aren't screwed.
+            self.tcp_sock, self.udp_sock = self.make_socket(self.timeout)
 
     def disconnect(self):
         """
-        Disconnects and resets and connection information.
+        Disconnects and resets and connection information, and stops reconnecting.
         :return: None
         """
+        self.wanted = False
+        # Stop _reconnect waiting for its next attempt
+        self.reconnect_wake.set()
         if not self.connected:
             return
 
-        self.conn_event.clear()
-        self.connected = False
         self.logger.warn("Socket disconnecting:")
-        self.tcp_sock.close()
-        self.udp_sock.close()
-        self.recv_sock = None
+        self._close()
+
+    def connection_lost(self, sock, reason):
+        """
+        Closes a connection that failed and starts reconnecting, unless the
+        connection was closed on purpose or has already been replaced.
+        :param sock: The socket that failed.
+        :param reason: Why the connection was lost, for the log.
+        :return: None
+        """
+        with self.conn_lock:
+            if not self.connected or sock not in (self.tcp_sock, self.recv_sock):
+                return
+
+            self.logger.error(reason + ". Reconnecting")
+            self._close()
 
-        # Recreate the socket so that we aren't screwed.
-        self.tcp_sock, self.udp_sock = self.make_socket()
+        self._start_reconnecting()
+
+    def _start_reconnecting(self):
+        """
+        Starts _reconnect unless it's already running.
+        :return: None
+        """
+        with self.conn_lock:
+            if self.reconnecting or not self.wanted:
+                return
+            self.reconnecting = True
+            self.reconnect_wake.clear()
+
+        thread = threading.Thread(target=self._reconnect, name='Reconnect')
+        thread.daemon = True
+        thread.start()
+
+    def _reconnect(self):
+        """
+        Tries to connect again and again, with exponential backoff between
+        attempts, until connected or disconnect is called.
+        :return: None
+        """
+        while True:
+            self.reconnect_wake.wait(self.reconnect_delay)
+            self.reconnect_wake.clear()
+            self._open()
+            self.reconnect_delay = min(2 * self.reconnect_delay, Networker.RECONNECT_MAX_DELAY)
+
+            # Stop only while the connection holds. If it was already lost again,
+            # connection_lost saw reconnecting set and left retrying to us.
+            with self.conn_lock:
+                if self.connected or not self.wanted:
+                    self.reconnecting = False
+                    break
 
     def send(self, message):
         """
@@ -149,98 +324,240 @@ class Networker:
         """
         # TODO logging levels?
         self.logger.debug("Sending message:")
-        # TODO proper error handling?
+        sock = self.tcp_sock
         try:
-            self.tcp_sock.send(message)
+            sock.send(message)
         except socket.timeout:
-            self.logger.error("Socket timed out while sending")
-            self.disconnect()
+            self.connection_lost(sock, "Socket timed out while sending")
         except OSError as e:
-            self.logger.error("Connection failed. OSError:" + e.strerror)
-            self.disconnect()
+            self.connection_lost(sock, "Send failed. OSError:" + str(e.strerror))
         except:
-            self.logger.error("Unexpected error:" + str(sys.exc_info()[0]))
-            self.disconnect()
+            self.connection_lost(sock, "Send: Unexpected error:" + str(sys.exc_info()[0]))
         else:
             self.logger.info("Message sent")
             return True
 
         return False
 
-    def read_message(self):
+    def count_messages(self, messages):
         """
-        Reads a full message including header from the PI server.
-        :return: The header type, the number of bytes, the message.
+        Counts received messages and their bytes, in total and per message type.
+        :param messages: A list of (header type, number of bytes, message) tuples.
+        :return: None
         """
-        if not self.connected:
-            self.logger.error("Trying to read while not connected")
-            raise Exception("Not connected. Cannot read.")
+        counters = self.type_counters
+        header_size = self.header_struct.size
+        for htype, nbytes, _ in messages:
+            frames, nbytes_counter = counters[htype[0]] or self._make_type_counters(htype)
+            frames.total += 1
+            nbytes_counter.total += nbytes + header_size
 
-        htype, nbytes = self.read_header()
-        # print(htype)
+        metrics = self.metrics
 
-        if nbytes is None or nbytes == 0:
-            message = None
-        else:
-            message = self._recv(nbytes)
-
-        # if (message is not None):
-        #     if (nbytes <= 64):
-        #         self.logger.debug("Received Full Message: Type:" + str(htype) +
-        #                    " Nbytes:" + str(nbytes) + " message" + str(message))
-        #     else:
-        #         self.logger.debug("Received Full Message: Type:" + str(htype) +
-        #                           " Nbytes:" + str(nbytes))
+        metrics.counter('network.frames').add(len(messages))
+        metrics.counter('network.bytes').add(sum(nbytes for _, nbytes, _ in messages) +
+                                             len(messages) * self.header_struct.size)
 
-        time.sleep(0.01)
+    def _make_type_counters(self, htype):
+        """
+        Gets the frame and byte counters of a message type, so count_messages
+        only looks them up once.
+        :param htype: The header type byte.
+        :return: The (frames, bytes) counters.
+        """
+        name = message_type_name(htype)
+        counters = (self.metrics.counter('network.frames.' + name), self.metrics.counter('network.bytes.' + name))
+        self.type_counters[htype[0]] = counters
+        return counters
 
-        return htype, nbytes, message
+    def reset_recv_buffer(self):
+        """
+        Drops any partially received frame, e.g. when a new connection is made.
+        :return: None
+        """
+        self.recv_start = 0
+        self.recv_end = 0
+        self.recv_needed = self.header_struct.size
 
-    def read_header(self):
+    def read_messages(self):
         """
-        Reads a data header from PI server.
-        :return: The header type, The number of bytes
+        Receives one chunk from the PI server into the receive buffer, stamping recv_time,
+        and parses every complete message (header and payload) in it. Bytes belonging to a partial message
+        are kept and completed by later calls.
+        :return: A list of (header type, number of bytes, message) tuples.
         """
-        b = self._recv(self.server_info.info.header_size)
-        if (len(b) == 0):
-            return None, None
+        if not self.connected:
+            # The connection was closed since the NWThread checked
+            return []
 
-        htype, nbytes = struct.unpack(self.server_info.info.header_format_string, b)
+        if not self._recv_chunk():
+            return []
 
-        self.logger.debugv("Received message header: Type:" + str(htype) + " Nbytes:" + str(nbytes))
+        if self.detecting_layout and not self._detect_layout():
+            return []
 
-        return htype, nbytes
+        messages = []
+        while not self.resyncing or self._resync():
+            messages.extend(self._parse_messages())
+            if not self.resyncing:
+                break
 
-    def _recv(self, nbytes):
+        return messages
+
+    def _resync(self):
+        """
+        Drops received bytes up to the next point where frames parse (see
+        ServerInfo.frames_fit), e.g. after a corrupt header.
+        :return: True if a frame header was found, False if more bytes are needed.
+        """
+        layout = self.server_info.info
+        data = self.recv_view[self.recv_start:self.recv_end]
+        datagrams = self.recv_sock is self.udp_sock
+
+        skipped = 0
+        found = False
+        while skipped + layout.header_size <= len(data):
+            fits = ServerInfo.frames_fit(layout, data, skipped, datagrams)
+            if fits is None:
+                break
+            if fits:
+                found = True
+                break
+            skipped += 1
+        data.release()
+
+        if skipped:
+            self.logger.warn("Skipped {0} bytes to find the next frame".format(skipped))
+            if self.metrics is not None:
+                self.metrics.counter('network.skipped_bytes').add(skipped)
+        self.recv_start += skipped
+        self.recv_needed = self.header_struct.size if found else self.recv_end - self.recv_start + 1
+        self.resyncing = not found
+
+        return found
+
+    def _detect_layout(self):
         """
-        Receives a message of length nbytes from the socket. Will retry until all bytes have been received.
-        :param nbytes: The number of bytes to receive.
-        :return: The bytes.
+        Works out the frame layout from the bytes received so far on this
+        connection (see ServerInfo.detect_layout).
+        :return: True once the layout is known.
         """
-        #print("Attempting to read " + str(nbytes) + " bytes")
-        outb = bytes([])
-        bcount = 0
         try:
-            while nbytes > 0:
-                b = self.recv_sock.recv(nbytes)
-                nbytes -= len(b)
-                bcount += len(b)
-                outb += b
-        except socket.timeout:
-            if bcount > 0:
-                # TODO fix this.
-                self.logger.error("Socket timed out during partial read. Major problem.")
+            layout = ServerInfo.detect_layout(self.recv_view[self.recv_start:self.recv_end],
+                                              self.recv_sock is self.udp_sock)
+        except ValueError as e:
+            self.logger.error(str(e) + ". Using info " + self.server_info.info.__name__)
+            layout = self.server_info.info
+
+        if layout is None:
+            # Wait for more bytes, making room for them if frames are bigger than the buffer
+            self.recv_needed = self.recv_end - self.recv_start + 1
+            return False
+
+        self.set_layout(layout)
+        self.detecting_layout = False
+        self.recv_needed = self.header_struct.size
+        self.logger.info("Detected info " + layout.__name__)
+        return True
+
+    def _parse_messages(self):
+        """
+        Parses all complete messages in the receive buffer.
+        :return: A list of (header type, number of bytes, message) tuples.
+        """
+        header_struct = self.header_struct
+        header_size = header_struct.size
+        buf = self.recv_buffer
+        view = self.recv_view
+        start = self.recv_start
+        end = self.recv_end
+
+        # Frames larger than a datagram can't arrive on UDP
+        max_frame_bytes = ServerInfo.MAX_DATAGRAM_FRAME_BYTES if self.recv_sock is self.udp_sock \
+            else ServerInfo.MAX_STREAM_FRAME_BYTES
+
+        messages = []
+        needed = header_size
+        while end - start >= header_size:
+            htype, nbytes = header_struct.unpack_from(buf, start)
+            if nbytes < 0 or header_size + nbytes > max_frame_bytes or \
+                    not 0 < htype[0] <= ServerInfo.MAX_MESSAGE_TYPE:
+                self.logger.error("Received an invalid message header. Looking for the next one.")
+                self.resyncing = True
+                break
+
+            frame_end = start + header_size + nbytes
+            if frame_end > end:
+                needed = header_size + nbytes
+                break
+
+            message = bytes(view[start + header_size:frame_end]) if nbytes > 0 else None
+            messages.append((htype, nbytes, message))
+            start = frame_end
+
+        self.recv_start = start
+        self.recv_needed = needed
+
+        return messages
+
+    def _make_room(self):
+        """
+        Makes sure the receive buffer has room after recv_end for the rest of the pending
+        message and, when receiving on UDP, for a whole datagram, which recv_into would
+        otherwise truncate. Moves the unparsed bytes to the front or grows the buffer as needed.
+        :return: None
+        """
+        if self.recv_start == self.recv_end:
+            # Everything received was parsed, so start again at the front without copying.
+            self.recv_start = 0
+            self.recv_end = 0
+
+        pending = self.recv_end - self.recv_start
+        size = len(self.recv_buffer)
+        needed = self.recv_needed
+        if self.recv_sock is self.udp_sock:
+            needed = max(needed, pending + Networker.MAX_DATAGRAM_BYTES)
+
+        if needed > size:
+            # A single message is bigger than the buffer, so grow it.
+            new_buffer = bytearray(max(needed, 2 * size))
+            new_buffer[:pending] = self.recv_view[self.recv_start:self.recv_end]
+            self.recv_view.release()
+            self.recv_buffer = new_buffer
+            self.recv_view = memoryview(new_buffer)
+        elif self.recv_start > 0 and (self.recv_end == size or self.recv_start + needed > size):
+            # Only the tail of a partial message is left, so this copy is small.
+            self.recv_buffer[:pending] = bytes(self.recv_view[self.recv_start:self.recv_end])
+        else:
+            return
 
-            self.logger.error("Socket timed out. Trying to disconnect")
-            self.disconnect()
+        self.recv_start = 0
+        self.recv_end = pending
+
+    def _recv_chunk(self):
+        """
+        Receives as many bytes as are available (up to the free space in the receive buffer)
+        with a single recv_into call.
+        :return: True if any bytes were received.
+        """
+        self._make_room()
 
+        sock = self.recv_sock
+        try:
+            nbytes = sock.recv_into(self.recv_view[self.recv_end:])
+        except socket.timeout:
+            self.connection_lost(sock, "No data for {0} s".format(self.timeout))
         except OSError as e:
-            self.logger.error("Read failed. OSError:" + e.strerror)
-            self.disconnect()
+            self.connection_lost(sock, "Read failed. OSError:" + str(e.strerror))
         except:
-            self.logger.error("Read: Unexpected error:" + str(sys.exc_info()[0]))
-            self.disconnect()
+            self.connection_lost(sock, "Read: Unexpected error:" + str(sys.exc_info()[0]))
         else:
-            return outb
+            if nbytes == 0:
+                self.connection_lost(sock, "Server closed the connection")
+                return False
 
-        return bytes([])
+            self.recv_time = time.perf_counter()
+            self.recv_end += nbytes
+            return True
+
+        return False
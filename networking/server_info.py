@@ -3,6 +3,12 @@ A file used to store information about the
 information sent by the server on the PI
 """
 
+import struct
+
+from functools import lru_cache
+
+import numpy as np
+
 
 class ServerInfo:
     """
@@ -88,6 +94,8 @@ class ServerInfo:
         payload_bytes = 16
 
         header_format_string = "c3xi"
+        # In byteorder without native alignment, like payload_dtype
+        header_struct = struct.Struct(('<' if byteorder == 'little' else '>') + header_format_string)
 
     class OtherInfo:
         """
@@ -110,3 +118,122 @@ class ServerInfo:
         payload_bytes = 16
 
         header_format_string = "c7xi4x"
+        # In byteorder without native alignment, like payload_dtype
+        header_struct = struct.Struct(('<' if byteorder == 'little' else '>') + header_format_string)
+
+    # The frame layouts by name, as chosen by [Server] Layout
+    layouts = {'PiInfo': PiInfo, 'OtherInfo': OtherInfo}
+
+    # The highest message type the Pi sends or understands
+    MAX_MESSAGE_TYPE = DEFAULT[0]
+
+    # The largest frame, header included, received on UDP, which is the most a datagram can carry.
+    # Headers claiming more are corrupt, e.g. payload bytes mistaken for a header while resyncing.
+    MAX_DATAGRAM_FRAME_BYTES = 65507
+    # The largest frame received on TCP. It's only a sanity bound: it still rejects the false headers
+    # inside PiInfo records, whose size has a timestamp byte as its top byte and so is at least 16 MiB.
+    MAX_STREAM_FRAME_BYTES = 1 << 22
+
+    # How many whole sensor data frames have to parse before detect_layout decides on a layout,
+    # or a resync on a frame header (see frames_fit)
+    DETECT_FRAMES = 2
+
+    @staticmethod
+    def header_fits(layout, data, offset, max_frame_bytes=MAX_STREAM_FRAME_BYTES):
+        """
+        Checks whether the bytes at an offset look like a frame header in a layout:
+        a known message type, zero padding, and a size that suits the type and
+        keeps the frame within max_frame_bytes.
+        @param layout: A layout class, e.g. ServerInfo.PiInfo.
+        @param data: The received bytes.
+        @param offset: Where the header starts. There must be a whole header there.
+        @param max_frame_bytes: The largest frame, header included, e.g. MAX_DATAGRAM_FRAME_BYTES on UDP.
+        @return: The size of the frame's payload, or None if it isn't a header.
+        """
+        htype, nbytes = layout.header_struct.unpack_from(data, offset)
+        nbytes_end = layout.header_nbytes_offset + layout.header_nbytes_info
+        padding = bytes(data[offset + layout.header_type_bytes:offset + layout.header_nbytes_offset]) + \
+            bytes(data[offset + nbytes_end:offset + layout.header_size])
+        if not 0 < htype[0] <= ServerInfo.MAX_MESSAGE_TYPE or any(padding) or nbytes < 0 or \
+                layout.header_size + nbytes > max_frame_bytes:
+            return None
+
+        # Sensor data always comes in whole, non-empty records
+        if htype in ServerInfo.filenames and (nbytes == 0 or nbytes % layout.payload_bytes != 0):
+            return None
+
+        return nbytes
+
+    @staticmethod
+    def frames_fit(layout, data, offset=0, datagrams=False):
+        """
+        Checks whether the data at an offset starts with a run of whole frames
+        in a layout holding DETECT_FRAMES sensor data frames or, if it was
+        received as UDP datagrams, is exactly a run of whole frames, such as a
+        single datagram. ACK and text frames may have any size, so payload
+        bytes can look like them and they don't count. On TCP a run that
+        merely ends where the data does may be such bytes too, so more bytes
+        are needed to tell.
+        @param layout: A layout class, e.g. ServerInfo.PiInfo.
+        @param data: The received bytes.
+        @param offset: Where the first frame would start.
+        @param datagrams: Whether the data was received as UDP datagrams, which also
+                          bounds frames to MAX_DATAGRAM_FRAME_BYTES.
+        @return: True or False, or None if more bytes are needed to tell.
+        """
+        max_frame_bytes = ServerInfo.MAX_DATAGRAM_FRAME_BYTES if datagrams else ServerInfo.MAX_STREAM_FRAME_BYTES
+        frames = 0
+        data_frames = 0
+        while data_frames < ServerInfo.DETECT_FRAMES and offset + layout.header_size <= len(data):
+            nbytes = ServerInfo.header_fits(layout, data, offset, max_frame_bytes)
+            if nbytes is None:
+                return False
+            if bytes(data[offset:offset + layout.header_type_bytes]) in ServerInfo.filenames:
+                data_frames += 1
+            offset += layout.header_size + nbytes
+            frames += 1
+
+        if data_frames == ServerInfo.DETECT_FRAMES and offset <= len(data) or \
+                datagrams and frames > 0 and offset == len(data):
+            return True
+
+        return None
+
+    @staticmethod
+    def detect_layout(data, datagrams=False):
+        """
+        Works out the layout of the first frames a server sends (see frames_fit).
+        @param data: The first bytes received on a connection.
+        @param datagrams: Whether the data was received as UDP datagrams.
+        @return: The layout class, or None if more bytes are needed to tell.
+        @raise ValueError: If the data doesn't fit any layout.
+        """
+        undecided = False
+        for layout in ServerInfo.layouts.values():
+            fits = ServerInfo.frames_fit(layout, data, datagrams=datagrams)
+            if fits:
+                return layout
+            undecided = undecided or fits is None
+
+        if undecided:
+            return None
+
+        raise ValueError("Received data doesn't fit any known frame layout")
+
+
+@lru_cache(maxsize=None)
+def payload_dtype(info):
+    """
+    Builds a NumPy structured dtype matching one payload record as described
+    by a ServerInfo layout class (e.g. ServerInfo.PiInfo), so that a whole
+    message can be viewed as an array of records without copying.
+    @param info: The layout class describing the payload.
+    @return: A dtype with a 'data' and a 'time' field.
+    """
+    order = '<' if info.byteorder == 'little' else '>'
+    return np.dtype({
+        'names': ['data', 'time'],
+        'formats': [order + 'u' + str(info.payload_data_bytes), order + 'u' + str(info.payload_time_bytes)],
+        'offsets': [0, info.payload_time_offset],
+        'itemsize': info.payload_bytes
+    })
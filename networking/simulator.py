@@ -0,0 +1,337 @@
+"""
+A stand-in for the Pi that speaks the real protocol, for load testing
+mission control without hardware. It streams all ten sensor channels as
+<header><16 byte records> payload frames at configurable rates, over TCP
+or, when [Server] Protocol=UDP, as UDP datagrams to the client's port.
+Every command byte it receives is answered with an ACK frame whose one
+record holds the command code and the time it arrived. Igniting (SET_IGNITION
+or NORM_IGNITE) plays a burn on the load cells, pressures and temperatures.
+Run it from the repository root:
+
+    python -m networking.simulator [--port 1234] [--rate 1000] [--rate LC_MAIN=20000]
+"""
+
+import argparse
+import configparser
+import socket
+import threading
+import time
+
+import numpy as np
+
+from calibration import load_calibrations
+from logger import LogLevel, Logger
+from networking.server_info import ServerInfo, payload_dtype
+
+# Raw values are 12 bit ADC readings
+RAW_MAX = 4095
+
+# The length of a simulated burn, in seconds
+BURN_TIME = 5.0
+
+
+class Waveform:
+    """
+    The signal of one simulated sensor in physical units: a baseline with
+    noise and a periodic ripple, plus a response to the burn.
+    """
+
+    def __init__(self, base, burn, noise, ripple=0.0, ripple_hz=0.0, lag=0.0):
+        """
+        @param base: The value when nothing is happening.
+        @param burn: How much the value rises during a burn.
+        @param noise: The standard deviation of the noise.
+        @param ripple: The amplitude of the ripple.
+        @param ripple_hz: The frequency of the ripple.
+        @param lag: The time constant (seconds) the sensor follows the burn with, e.g. for thermocouples.
+        """
+        self.base = base
+        self.burn = burn
+        self.noise = noise
+        self.ripple = ripple
+        self.ripple_hz = ripple_hz
+        self.lag = lag
+
+    def sample(self, t, since_ignition):
+        """
+        Samples the waveform.
+        @param t: An array of times in seconds.
+        @param since_ignition: An array of times since ignition in seconds (negative before it).
+        @return: An array of values.
+        """
+        values = self.base + self.noise * np.random.standard_normal(len(t))
+        if self.ripple:
+            values += self.ripple * np.sin(2 * np.pi * self.ripple_hz * t)
+        if self.burn:
+            values += self.burn * Waveform.burn_profile(since_ignition, self.lag)
+
+        return values
+
+    @staticmethod
+    def burn_profile(since_ignition, lag):
+        """
+        The shape of a burn: a quick rise, a plateau and a tail-off, followed
+        by a sensor with time constant lag.
+        @param since_ignition: An array of times since ignition in seconds.
+        @param lag: The sensor's time constant in seconds.
+        @return: An array between 0 and 1.
+        """
+        rise = np.clip(since_ignition / 0.2, 0, 1)
+        tail = np.clip((BURN_TIME - since_ignition) / 0.5, 0, 1)
+        profile = rise * tail
+        if lag:
+            # The step response of a first order sensor, cooling off after the burn
+            heating = 1 - np.exp(-np.clip(since_ignition, 0, BURN_TIME) / lag)
+            cooling = np.exp(-np.clip(since_ignition - BURN_TIME, 0, None) / (4 * lag))
+            profile = np.where(since_ignition > 0, heating * cooling, 0)
+
+        return profile
+
+
+# Waveforms in the units config.ini calibrates to (N, PSI and C)
+WAVEFORMS = {
+    ServerInfo.LC_MAIN_SEND: Waveform(base=0, burn=40, noise=0.3, ripple=1.5, ripple_hz=120),
+    ServerInfo.LC1_SEND: Waveform(base=0, burn=8, noise=0.05),
+    ServerInfo.LC2_SEND: Waveform(base=0, burn=8, noise=0.05),
+    ServerInfo.LC3_SEND: Waveform(base=0, burn=8, noise=0.05),
+    ServerInfo.PT_FEED_SEND: Waveform(base=750, burn=-150, noise=4, ripple=6, ripple_hz=40),
+    ServerInfo.PT_COMB_SEND: Waveform(base=14.7, burn=400, noise=3, ripple=10, ripple_hz=300),
+    ServerInfo.PT_INJE_SEND: Waveform(base=20, burn=450, noise=3, ripple=5, ripple_hz=150),
+    ServerInfo.TC1_SEND: Waveform(base=22, burn=180, noise=0.3, lag=2.0),
+    ServerInfo.TC2_SEND: Waveform(base=22, burn=120, noise=0.3, lag=3.0),
+    ServerInfo.TC3_SEND: Waveform(base=22, burn=60, noise=0.3, lag=5.0),
+}
+
+
+class Simulator:
+    """
+    Serves one client at a time. A streaming thread sends every channel's
+    due samples every interval seconds while the connection's thread answers
+    commands.
+    """
+
+    # The most records put in one UDP datagram, within ServerInfo.MAX_DATAGRAM_FRAME_BYTES
+    MAX_DATAGRAM_RECORDS = 4000
+
+    def __init__(self, logger, host, port, rates, calibrations, protocol='TCP', layout=ServerInfo.PiInfo,
+                 interval=0.005, ticks_per_second=1000000):
+        """
+        @param logger: The logger to report to.
+        @param host: The address to listen on.
+        @param port: The TCP port to listen on. In UDP mode, data is sent to this port on the client.
+        @param rates: A dict from mtype to samples per second.
+        @param calibrations: A dict from mtype to the Calibration the GUI applies (see load_calibrations).
+        @param protocol: 'TCP' or 'UDP'.
+        @param layout: The ServerInfo layout class to frame messages with.
+        @param interval: How often to send, in seconds.
+        @param ticks_per_second: How many timestamp units make up a second.
+        """
+        self.logger = logger
+        self.host = host
+        self.port = port
+        self.rates = rates
+        self.protocol = protocol
+        self.layout = layout
+        self.interval = interval
+        self.ticks_per_second = ticks_per_second
+
+        self.header_struct = layout.header_struct
+        self.dtype = payload_dtype(layout)
+
+        # Each channel's calibrated value of every raw value, sorted by the calibrated value,
+        # to turn waveforms back into raw values by interpolation
+        raw = np.arange(RAW_MAX + 1)
+        self.inverse = {}
+        for mtype, calibration in calibrations.items():
+            values = calibration.evaluate(raw)
+            order = np.argsort(values)
+            self.inverse[mtype] = (values[order], raw[order])
+
+        self.started = time.perf_counter()
+        self.ignition = None
+        self.send_lock = threading.Lock()
+
+    def serve_forever(self):
+        """
+        Accepts clients one after another.
+        """
+        server = socket.socket()
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((self.host, self.port))
+        server.listen(1)
+        self.logger.info("Listening on {0}:{1} ({2}, {3})".format(self.host, self.port, self.protocol,
+                                                                  self.layout.__name__))
+
+        while True:
+            conn, addr = server.accept()
+            # Send ACKs at once rather than holding them back while earlier frames go unacknowledged
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.logger.info("Client connected: " + str(addr))
+            self._serve(conn, addr)
+            self.logger.info("Client disconnected")
+
+    def now(self):
+        """
+        @return: The current timestamp in ticks since the simulator started.
+        """
+        return int((time.perf_counter() - self.started) * self.ticks_per_second)
+
+    def frame(self, mtype, records):
+        """
+        Frames records as a message.
+        @param mtype: The message type.
+        @param records: An array of self.dtype records.
+        @return: The bytes of the header and records.
+        """
+        return self.header_struct.pack(mtype, records.nbytes) + records.tobytes()
+
+    def _serve(self, conn, addr):
+        """
+        Streams to a client and answers its commands until it disconnects.
+        """
+        udp = None
+        if self.protocol == 'UDP':
+            udp = socket.socket(type=socket.SOCK_DGRAM)
+            udp.connect((addr[0], self.port))
+
+        def send(frames):
+            with self.send_lock:
+                if udp is not None:
+                    for frame in frames:
+                        udp.send(frame)
+                else:
+                    conn.sendall(b''.join(frames))
+
+        stopped = threading.Event()
+        streamer = threading.Thread(target=self._stream, args=(send, stopped), name='SimulatorStream')
+        streamer.daemon = True
+        streamer.start()
+
+        try:
+            while True:
+                commands = conn.recv(1024)
+                if not commands:
+                    break
+                for code in commands:
+                    self._command(code, send)
+        except OSError as e:
+            self.logger.warn("Connection lost: " + str(e))
+        finally:
+            stopped.set()
+            streamer.join()
+            conn.close()
+            if udp is not None:
+                udp.close()
+
+    def _command(self, code, send):
+        """
+        Acknowledges a command, and starts a burn if it's an ignition.
+        @param code: The command byte as an int.
+        @param send: The function that sends a list of frames to the client.
+        """
+        command = bytes([code])
+        names = [name for name, value in vars(ServerInfo).items() if value == command]
+        self.logger.info("Received command " + (names[0] if names else str(code)))
+
+        if command in (ServerInfo.SET_IGNITION, ServerInfo.NORM_IGNITE):
+            self.ignition = time.perf_counter() - self.started
+
+        ack = np.zeros(1, dtype=self.dtype)
+        ack['data'] = code
+        ack['time'] = self.now()
+        try:
+            send([self.frame(ServerInfo.ACK_VALUE, ack)])
+        except OSError as e:
+            self.logger.warn("Couldn't send ACK: " + str(e))
+
+    def _stream(self, send, stopped):
+        """
+        Sends the samples that have come due on every channel every interval,
+        until stopped. Samples are timed from the wall clock, so if sending
+        falls behind, the next frames are bigger rather than late.
+        """
+        sent = {mtype: int((time.perf_counter() - self.started) * rate) for mtype, rate in self.rates.items()}
+
+        while not stopped.wait(self.interval):
+            elapsed = time.perf_counter() - self.started
+            frames = []
+            for mtype, rate in self.rates.items():
+                due = int(elapsed * rate)
+                indices = np.arange(sent[mtype], due)
+                sent[mtype] = due
+                if len(indices) == 0:
+                    continue
+
+                t = indices / rate
+                since_ignition = t - self.ignition if self.ignition is not None else np.full(len(t), -1.0)
+                values, raw_values = self.inverse[mtype]
+                raw = np.interp(WAVEFORMS[mtype].sample(t, since_ignition), values, raw_values)
+
+                records = np.zeros(len(indices), dtype=self.dtype)
+                records['data'] = np.clip(np.rint(raw), 0, RAW_MAX)
+                records['time'] = (t * self.ticks_per_second).astype(np.uint64)
+
+                if self.protocol == 'UDP':
+                    for start in range(0, len(records), Simulator.MAX_DATAGRAM_RECORDS):
+                        frames.append(self.frame(mtype, records[start:start + Simulator.MAX_DATAGRAM_RECORDS]))
+                else:
+                    frames.append(self.frame(mtype, records))
+
+            try:
+                send(frames)
+            except OSError as e:
+                self.logger.warn("Send failed: " + str(e))
+                return
+
+
+def parse_rates(rate_args):
+    """
+    Parses the --rate arguments.
+    @param rate_args: A list of strings, each a rate in Hz for every channel or NAME=rate for one.
+    @return: A dict from mtype to samples per second.
+    """
+    rates = {mtype: 1000.0 for mtype in ServerInfo.filenames}
+    mtypes = {name: mtype for mtype, name in ServerInfo.filenames.items()}
+
+    for arg in rate_args:
+        if '=' in arg:
+            name, rate = arg.split('=', 1)
+            if name.upper() not in mtypes:
+                raise argparse.ArgumentTypeError("Unknown channel: " + name)
+            rates[mtypes[name.upper()]] = float(rate)
+        else:
+            rates = {mtype: float(arg) for mtype in rates}
+
+    return {mtype: rate for mtype, rate in rates.items() if rate > 0}
+
+
+def main():
+    """
+    Starts a Simulator configured from the command line and config.ini.
+    """
+    config = configparser.RawConfigParser()
+    config.read('config.ini')
+
+    parser = argparse.ArgumentParser(description="Simulates the Pi for load testing.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=int(config.get("UI Defaults", "Port", fallback=1234)))
+    parser.add_argument('--rate', action='append', default=[],
+                        help="samples per second for every channel, or NAME=rate for one (default 1000)")
+    parser.add_argument('--protocol', choices=['TCP', 'UDP'],
+                        default=config.get("Server", "Protocol", fallback='TCP'))
+    parser.add_argument('--layout', choices=list(ServerInfo.layouts), default='PiInfo',
+                        help="the message layout to send (default PiInfo)")
+    parser.add_argument('--interval', type=float, default=0.005, help="seconds between sends")
+    args = parser.parse_args()
+
+    logger = Logger(name='simulator', level=LogLevel.INFO, display_log=True)
+    simulator = Simulator(logger, args.host, args.port, parse_rates(args.rate), load_calibrations(config),
+                          protocol=args.protocol,
+                          layout=ServerInfo.layouts[args.layout], interval=args.interval,
+                          ticks_per_second=float(config.get("Server", "Timestamp Ticks Per Second",
+                                                            fallback=1000000)))
+    simulator.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
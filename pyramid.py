@@ -0,0 +1,208 @@
+"""
+This file defines DownsamplePyramid, which keeps pre-aggregated history
+of a channel at several resolutions so that any time range of a session
+can be plotted at any width without touching every sample in it.
+"""
+
+import threading
+
+import numpy as np
+
+COLUMNS = ('min', 'max', 'mean', 'time')
+
+
+class PyramidLevel:
+    """
+    One resolution of a pyramid: a fixed-capacity ring of buckets, each with
+    the min, max and mean of the samples it covers and the timestamp of its
+    first sample. Like RingBuffer, columns are mirrored so that the newest
+    buckets are always contiguous.
+    """
+
+    def __init__(self, capacity, bucket_size):
+        """
+        Initializes an empty level.
+        @param capacity: The maximum number of buckets to keep.
+        @param bucket_size: The number of samples each bucket covers.
+        """
+        self.capacity = capacity
+        self.bucket_size = bucket_size
+        self.columns = {name: np.zeros(2 * capacity, dtype=np.uint64 if name == 'time' else np.float64)
+                        for name in COLUMNS}
+        self.total = 0
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def append_block(self, block):
+        """
+        Appends buckets.
+        @param block: A dict of equally long arrays, one per column.
+        """
+        count = len(block['time'])
+        if count == 0:
+            return
+
+        capacity = self.capacity
+        total = self.total
+        if count > capacity:
+            total += count - capacity
+            block = {name: column[-capacity:] for name, column in block.items()}
+            count = capacity
+
+        head = total % capacity
+        end = head + count
+        low_end = min(end, capacity)
+        for name, column in self.columns.items():
+            column[head:end] = block[name]
+            column[head + capacity:low_end + capacity] = column[head:low_end]
+            if end > capacity:
+                column[0:end - capacity] = column[capacity:end]
+
+        self.total = total + count
+
+    def stored(self):
+        """
+        Gets all stored buckets, oldest first, as views.
+        @return: A dict of arrays, one per column.
+        """
+        end = self.total % self.capacity + self.capacity
+        start = end - len(self)
+        return {name: column[start:end] for name, column in self.columns.items()}
+
+
+class DownsamplePyramid:
+    """
+    A stack of PyramidLevels for one channel. Level 0 stores samples as they
+    are and every following level aggregates factor buckets of the level
+    below it, e.g. 1x, 16x, 256x and 4096x. Levels are updated incrementally
+    as samples are appended; buckets that are not complete yet wait in a
+    small pending block per level. All levels have the same capacity, so
+    memory stays fixed while coarse levels cover a whole test session.
+    """
+
+    def __init__(self, capacity=16384, factor=16, levels=4):
+        """
+        Initializes an empty pyramid.
+        @param capacity: The number of buckets kept by each level.
+        @param factor: How many buckets of one level make a bucket of the next.
+        @param levels: The number of levels, including level 0.
+        """
+        self.factor = factor
+        self.levels = [PyramidLevel(capacity, factor ** i) for i in range(levels)]
+        # pending[i] holds buckets of level i - 1 that don't fill a bucket of level i yet
+        self.pending = [None] + [self._empty_block() for _ in range(1, levels)]
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _empty_block():
+        return {name: np.zeros(0, dtype=np.uint64 if name == 'time' else np.float64) for name in COLUMNS}
+
+    def append_block(self, values, times):
+        """
+        Appends a block of samples, updating every level.
+        @param values: An array of sample values.
+        @param times: An array of timestamps.
+        """
+        if len(values) == 0:
+            return
+
+        block = {'min': values, 'max': values, 'mean': values, 'time': times}
+        with self.lock:
+            self.levels[0].append_block(block)
+            for i in range(1, len(self.levels)):
+                children = {name: np.concatenate((self.pending[i][name], block[name])) for name in COLUMNS}
+                full = len(children['time']) // self.factor * self.factor
+                self.pending[i] = {name: column[full:].copy() for name, column in children.items()}
+                if full == 0:
+                    break
+
+                block = {
+                    'min': children['min'][:full].reshape(-1, self.factor).min(axis=1),
+                    'max': children['max'][:full].reshape(-1, self.factor).max(axis=1),
+                    'mean': children['mean'][:full].reshape(-1, self.factor).mean(axis=1),
+                    'time': children['time'][:full:self.factor]
+                }
+                self.levels[i].append_block(block)
+
+    def time_span(self):
+        """
+        Gets the range of timestamps the pyramid covers.
+        @return: The (oldest, newest) timestamps, or None if it's empty.
+        """
+        with self.lock:
+            if self.levels[0].total == 0:
+                return None
+
+            for level in reversed(self.levels):
+                if len(level) > 0:
+                    oldest = level.stored()['time'][0]
+                    break
+            return int(oldest), int(self.levels[0].stored()['time'][-1])
+
+    def series(self, start, end, width):
+        """
+        Gets the samples with start <= timestamp <= end reduced to at most
+        width buckets. Uses the finest level that still covers start and has
+        at most factor buckets per output bucket, so the work done doesn't
+        depend on how long the range is.
+        @param start: The first timestamp to include.
+        @param end: The last timestamp to include.
+        @param width: The number of buckets to return, e.g. the plot width in pixels.
+        @return: A dict of 'min', 'max', 'mean' and 'time' arrays.
+        """
+        with self.lock:
+            for i, level in enumerate(self.levels):
+                buckets = self._in_range(i, start, end)
+                times = level.stored()['time']
+                covers_start = len(level) < level.capacity or (len(times) > 0 and times[0] <= start)
+                if (covers_start and len(buckets['time']) <= width * self.factor) or i == len(self.levels) - 1:
+                    break
+
+            return self._reduce(buckets, width)
+
+    def _in_range(self, i, start, end):
+        """
+        Gets the buckets of level i with start <= timestamp <= end, followed by
+        the pending buckets of finer levels in that range, which cover the
+        newest samples not aggregated into level i yet.
+        @param i: The index of the level.
+        @param start: The first timestamp to include.
+        @param end: The last timestamp to include.
+        @return: A dict of arrays, one per column, plus a 'weight' array with
+                 the number of samples behind each bucket.
+        """
+        parts = [self.levels[i].stored()] + [self.pending[j] for j in range(i, 0, -1)]
+        sizes = [self.levels[i].bucket_size] + [self.levels[j - 1].bucket_size for j in range(i, 0, -1)]
+
+        selected = []
+        for part in parts:
+            first = int(np.searchsorted(part['time'], start, side='left'))
+            last = int(np.searchsorted(part['time'], end, side='right'))
+            selected.append({name: column[first:last] for name, column in part.items()})
+
+        buckets = {name: np.concatenate([part[name] for part in selected]) for name in COLUMNS}
+        buckets['weight'] = np.concatenate([np.full(len(part['time']), size, dtype=np.float64)
+                                            for part, size in zip(selected, sizes)])
+        return buckets
+
+    @staticmethod
+    def _reduce(buckets, width):
+        """
+        Reduces buckets to at most width buckets.
+        @param buckets: A dict of arrays, one per column, plus 'weight'.
+        @param width: The number of buckets to return.
+        @return: A dict of arrays, one per column.
+        """
+        count = len(buckets['time'])
+        if count <= width:
+            return {name: buckets[name] for name in COLUMNS}
+
+        edges = np.linspace(0, count, width + 1).astype(np.intp)[:-1]
+        weight = buckets['weight']
+        return {
+            'min': np.minimum.reduceat(buckets['min'], edges),
+            'max': np.maximum.reduceat(buckets['max'], edges),
+            'mean': np.add.reduceat(buckets['mean'] * weight, edges) / np.add.reduceat(weight, edges),
+            'time': buckets['time'][edges]
+        }
@@ -0,0 +1,216 @@
+"""
+This file defines Recorder, a headless mission control that records
+every channel to disk without the GUI. It's meant for the data logging
+laptop, next to or instead of the operator's GUI, and doesn't import
+tkinter, Pmw or matplotlib. Run it with
+
+    python controller.py --headless [--address A] [--port P] [--log-dir D]
+
+It understands these commands, one per line, from stdin and from
+clients of its local command socket ([Recorder] Command Port), and
+stops on quit or Ctrl-C:
+
+    connect [address [port]]
+    disconnect
+    send <command>      e.g. send SET_VALVE, or send 5
+    replay <path> [speed]
+    status
+    quit
+"""
+
+import socketserver
+import sys
+import threading
+import time
+
+from concurrency import run_async
+from logger import LogLevel, Logger
+from model import GUIBackend
+from networking.server_info import ServerInfo
+from replay import parse_speed
+
+
+class Recorder:
+    """
+    Runs a GUIBackend on its own, reporting throughput and ingest latency
+    every summary_interval seconds and taking commands as text.
+    """
+
+    def __init__(self, config):
+        """
+        @param config: The parsed config.ini.
+        """
+        self.config = config
+        self.logger = Logger(name='recorder',
+                             level=LogLevel.INFO,
+                             outfile='recorder.log',
+                             display_log=True)
+
+        class Back2ConsoleAdapter:
+            """
+            Drops messages meant for the frontend, which the backend's
+            loggers print to the console already.
+            """
+
+            @staticmethod
+            def display_msg(msg):
+                pass
+
+            @staticmethod
+            def display_alert(msg):
+                pass
+
+        self.backend = GUIBackend(Back2ConsoleAdapter(), config)
+        self.address = config.get("UI Defaults", "Address")
+        self.port = config.get("UI Defaults", "Port")
+        self.summary_interval = float(config.get("Recorder", "Summary Interval", fallback=5.0))
+        self.command_port = int(config.get("Recorder", "Command Port", fallback=0))
+        self.stopped = threading.Event()
+
+    def start(self, replay=None):
+        """
+        Starts recording, reading commands and reporting, then blocks until a
+        quit command. Connects to the configured address right away unless
+        replaying.
+        @param replay: A (path, speed) pair to replay recorded logs instead (see replay.py).
+        """
+        self.backend.start()
+        self._read_stdin()
+        if self.command_port:
+            self._serve_commands()
+        self._report()
+
+        if replay is not None:
+            self.backend.start_replay(*replay)
+        else:
+            self.execute("connect")
+        try:
+            self.stopped.wait()
+        except KeyboardInterrupt:
+            pass
+
+        self.logger.info("Stopping")
+        self.backend.close()
+
+    def execute(self, line):
+        """
+        Runs a command.
+        @param line: The command (see the top of this file).
+        @return: The text to answer with.
+        """
+        words = line.split()
+        if not words:
+            return ""
+
+        command, args = words[0].lower(), words[1:]
+        if command == "connect":
+            self.address = args[0] if len(args) > 0 else self.address
+            self.port = args[1] if len(args) > 1 else self.port
+            self.backend.connect(self.address, self.port)
+            return "connecting to {0}:{1}".format(self.address, self.port)
+        elif command == "disconnect":
+            self.backend.disconnect()
+            return "disconnected"
+        elif command == "send" and len(args) == 1:
+            code = Recorder.parse_command_code(args[0])
+            if code is None:
+                return "unknown command " + args[0]
+            self.backend.send(code)
+            return "queued " + args[0]
+        elif command == "replay" and len(args) in (1, 2):
+            try:
+                speed = parse_speed(args[1]) if len(args) > 1 else 1.0
+            except ValueError as e:
+                return str(e)
+            self.backend.start_replay(args[0], speed)
+            return "replaying " + args[0]
+        elif command == "status":
+            return self.summary()
+        elif command == "quit":
+            self.stopped.set()
+            return "quitting"
+
+        return "unknown command: " + line.strip()
+
+    @staticmethod
+    def parse_command_code(text):
+        """
+        Gets the byte to send for a command given by name (e.g. SET_VALVE) or number.
+        @param text: The name or number.
+        @return: The byte, or None if there's no such command.
+        """
+        if text.isdigit():
+            return bytes([int(text)]) if int(text) < 256 else None
+
+        code = getattr(ServerInfo, text.upper(), None)
+        return code if isinstance(code, bytes) else None
+
+    def summary(self):
+        """
+        Describes how much has been recorded.
+        @return: A line with the total samples per channel and the ingest latency.
+        """
+        counts = ' '.join("{0}={1}".format(ServerInfo.filenames[mtype], buffer.total)
+                          for mtype, buffer in self.backend.queue_dict.items())
+        mean, maximum = self.backend.get_ingest_latency()
+        return "samples: {0} latency: mean {1:.3f} ms, max {2:.3f} ms".format(counts, 1000 * mean, 1000 * maximum)
+
+    @run_async
+    def _report(self):
+        """
+        Logs the sample rate of each channel every summary_interval seconds.
+        """
+        last_totals = {mtype: buffer.total for mtype, buffer in self.backend.queue_dict.items()}
+        last_time = time.perf_counter()
+
+        while not self.stopped.wait(self.summary_interval):
+            now = time.perf_counter()
+            totals = {mtype: buffer.total for mtype, buffer in self.backend.queue_dict.items()}
+            elapsed = now - last_time
+            rates = {mtype: (totals[mtype] - last_totals[mtype]) / elapsed for mtype in totals}
+
+            mean, maximum = self.backend.get_ingest_latency()
+            self.logger.info("{0:.0f} samples/s ({1}), latency mean {2:.3f} ms, max {3:.3f} ms".format(
+                sum(rates.values()),
+                ' '.join("{0} {1:.0f}".format(ServerInfo.filenames[mtype], rate) for mtype, rate in rates.items()),
+                1000 * mean, 1000 * maximum))
+
+            last_totals = totals
+            last_time = now
+
+    @run_async
+    def _read_stdin(self):
+        """
+        Runs commands typed on stdin. Keeps recording if stdin is closed,
+        e.g. when running in the background.
+        """
+        for line in sys.stdin:
+            print(self.execute(line))
+
+    @run_async
+    def _serve_commands(self):
+        """
+        Runs commands sent by clients of the command socket, which only
+        listens on localhost. Each line gets a line back.
+        """
+        recorder = self
+
+        class CommandHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    answer = recorder.execute(line.decode('utf-8', errors='replace'))
+                    self.wfile.write(answer.encode('utf-8') + b'\n')
+
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', self.command_port), CommandHandler)
+        server.daemon_threads = True
+        self.logger.info("Listening for commands on port " + str(self.command_port))
+        server.serve_forever()
+
+
+def main(config, replay=None):
+    """
+    Starts a Recorder and blocks until it quits.
+    @param config: The parsed config.ini.
+    @param replay: A (path, speed) pair to replay recorded logs instead of connecting.
+    """
+    Recorder(config).start(replay)
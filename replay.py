@@ -0,0 +1,183 @@
+"""
+This file defines Replay, which plays recorded sensor logs back through
+the live pipeline by putting them on the queue Networker normally feeds.
+Start it with
+
+    python controller.py --replay logs/ [--speed 1 | 10 | max]
+
+where the path is a directory of text logs (<channel>.log) or a capture
+directory (<channel>.cap, see capture.py), or a single log. Channels are
+merged by timestamp and sent as payload frames in the layout of the
+current ServerInfo, so the backend can't tell them from the Pi's.
+Replayed samples are logged again like live ones, to logs/replay/ unless
+--log-dir says otherwise.
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from capture import CaptureReader
+from concurrency import run_async
+from networking.server_info import ServerInfo
+
+# The value of --speed that replays as fast as the backend keeps up
+MAX_SPEED = 'max'
+
+
+def parse_speed(text):
+    """
+    Parses a replay speed.
+    @param text: A multiple of real time such as "1" or "10", or "max".
+    @return: The multiple, or None for as fast as possible.
+    """
+    if text == MAX_SPEED:
+        return None
+
+    speed = float(text)
+    if speed <= 0:
+        raise ValueError("Replay speed must be positive: " + text)
+
+    return speed
+
+
+def load_log(path):
+    """
+    Loads one channel log, either a text log or a capture.
+    @param path: The path of a .log or .cap file.
+    @return: The (times, raw) arrays of the log.
+    """
+    if path.endswith('.cap'):
+        records = CaptureReader(path).records
+        return np.array(records['time'], dtype=np.uint64), np.array(records['raw'], dtype=np.uint64)
+
+    with open(path) as f:
+        columns = np.array(f.read().split()).reshape(-1, 3)
+
+    return columns[:, 0].astype(np.uint64), columns[:, 1].astype(np.uint64)
+
+
+def load_recording(path):
+    """
+    Loads the channel logs at a path. Files that aren't named after a
+    channel (e.g. backend.log) are skipped.
+    @param path: A directory of logs or a single log.
+    @return: A dict from channel name to (times, raw) arrays.
+    """
+    if os.path.isdir(path):
+        paths = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+    else:
+        paths = [path]
+
+    names = set(ServerInfo.filenames.values())
+    channels = {}
+    for log_path in paths:
+        name, extension = os.path.splitext(os.path.basename(log_path))
+        if name in names and extension in ('.log', '.cap'):
+            channels[name] = load_log(log_path)
+
+    return channels
+
+
+class Replay:
+    """
+    Merges the samples of several channels by timestamp and puts them on a
+    network queue as payload frames. Each frame holds one channel's samples
+    from a frame_interval long slice of the recording, and slices are sent
+    at speed times real time. At maximum speed the queue is kept from
+    growing beyond MAX_QUEUED frames, so the replay runs as fast as the
+    backend processes it.
+    """
+
+    MAX_QUEUED = 4096
+
+    def __init__(self, logger, out_queue, channels, dtype, ticks_per_second, speed=1.0, frame_interval=0.01):
+        """
+        @param logger: The logger to report progress to.
+        @param out_queue: The queue to put (mtype, nbytes, message, recv_time) tuples on.
+        @param channels: A dict from channel name to (times, raw) arrays (see load_recording).
+        @param dtype: The payload record dtype to encode frames with (see server_info.payload_dtype).
+        @param ticks_per_second: How many timestamp units make up a second.
+        @param speed: The multiple of real time to replay at, or None for as fast as possible.
+        @param frame_interval: The length of recording put in each frame, in seconds.
+        """
+        self.logger = logger
+        self.out_queue = out_queue
+        self.dtype = dtype
+        self.ticks_per_second = ticks_per_second
+        self.speed = speed
+        self.interval_ticks = max(1, int(frame_interval * ticks_per_second))
+        self.stopped = threading.Event()
+
+        mtypes = {name: mtype for mtype, name in ServerInfo.filenames.items()}
+        self.mtypes = [mtypes[name] for name in channels]
+
+        # Merge the channels, remembering which one each sample came from
+        times = np.concatenate([times for times, _ in channels.values()] + [np.zeros(0, dtype=np.uint64)])
+        raw = np.concatenate([raw for _, raw in channels.values()] + [np.zeros(0, dtype=np.uint64)])
+        channel = np.concatenate([np.full(len(channel_times), i, dtype=np.intp)
+                                  for i, (channel_times, _) in enumerate(channels.values())] +
+                                 [np.zeros(0, dtype=np.intp)])
+        order = np.argsort(times, kind='stable')
+        self.times = times[order]
+        self.raw = raw[order]
+        self.channel = channel[order]
+
+    def __len__(self):
+        return len(self.times)
+
+    def stop(self):
+        """
+        Stops the replay after the current frame.
+        """
+        self.stopped.set()
+
+    @run_async
+    def start(self):
+        """
+        Replays the recording, then reports how long it took once the backend
+        has caught up.
+        """
+        if len(self) == 0:
+            self.logger.error("Nothing to replay")
+            return
+
+        first_time = int(self.times[0])
+        slots = (self.times - first_time) // self.interval_ticks
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(slots)) + 1, [len(self)]))
+
+        self.logger.info("Replaying {0} samples of {1} channels at {2}".format(
+            len(self), len(self.mtypes), "maximum speed" if self.speed is None else str(self.speed) + "x"))
+        started = time.perf_counter()
+
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if self.stopped.is_set():
+                self.logger.info("Replay stopped")
+                return
+
+            if self.speed is not None:
+                due = started + (int(self.times[start]) - first_time) / self.ticks_per_second / self.speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    self.stopped.wait(delay)
+            else:
+                while self.out_queue.qsize() > Replay.MAX_QUEUED:
+                    time.sleep(0.001)
+
+            channel = self.channel[start:end]
+            for i in np.unique(channel):
+                selected = np.flatnonzero(channel == i) + start
+                records = np.zeros(len(selected), dtype=self.dtype)
+                records['data'] = self.raw[selected]
+                records['time'] = self.times[selected]
+                message = records.tobytes()
+                self.out_queue.put((self.mtypes[i], len(message), message, time.perf_counter()))
+
+        while not self.out_queue.empty():
+            time.sleep(0.001)
+
+        elapsed = time.perf_counter() - started
+        self.logger.info("Replayed {0} samples in {1:.3f} s ({2:.0f} samples/s)".format(
+            len(self), elapsed, len(self) / elapsed))
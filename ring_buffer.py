@@ -0,0 +1,179 @@
+"""
+This file defines RingBuffer, the fixed-capacity store that GUIBackend
+keeps for the samples of each sensor channel.
+"""
+
+import time
+
+import numpy as np
+
+
+class RingBuffer:
+    """
+    A fixed-capacity buffer of samples with a float64 value column, a uint64
+    timestamp column and a uint64 column of the raw values the calibrated
+    values were computed from. Every sample is stored twice, at index i and
+    i + capacity, so the newest n samples are always contiguous and can be
+    handed out as views without copying. Once the buffer is full the oldest
+    samples are overwritten, so memory stays flat however long we record.
+    """
+
+    # Indices into meta
+    SEQUENCE = 0
+    TOTAL = 1
+
+    # How many times snapshot tries to copy without a write getting in the way
+    SNAPSHOT_ATTEMPTS = 100
+
+    def __init__(self, capacity, allocate=np.zeros):
+        """
+        Initializes an empty ring buffer.
+        @param capacity: The maximum number of samples to keep.
+        @param allocate: The function used to allocate zeroed arrays, called
+                         like np.zeros. See SharedArena for sharing a buffer
+                         between processes.
+        """
+        assert capacity > 0
+
+        self.capacity = capacity
+        self.values = allocate(2 * capacity, dtype=np.float64)
+        self.times = allocate(2 * capacity, dtype=np.uint64)
+        self.raws = allocate(2 * capacity, dtype=np.uint64)
+
+        # The write sequence number and the total number of samples ever
+        # appended. The sequence is odd while a write is in progress and even
+        # otherwise, so a reader in another process can tell whether what it
+        # read may be torn (see SharedArena).
+        self.meta = allocate(2, dtype=np.int64)
+
+    def __len__(self):
+        return int(min(self.meta[RingBuffer.TOTAL], self.capacity))
+
+    @property
+    def sequence(self):
+        """
+        The write sequence number, which changes every time samples are appended.
+        It's odd while a write is in progress.
+        """
+        return int(self.meta[RingBuffer.SEQUENCE])
+
+    @property
+    def total(self):
+        """
+        The total number of samples appended since the buffer was created.
+        """
+        return int(self.meta[RingBuffer.TOTAL])
+
+    def append_block(self, values, times, raws=None):
+        """
+        Appends a block of samples. Takes time proportional to the block,
+        not to the number of samples already stored.
+        @param values: An array of sample values.
+        @param times: An array of timestamps, the same length as values.
+        @param raws: An array of raw values, or None to store zeros.
+        """
+        count = len(values)
+        if count == 0:
+            return
+
+        if raws is None:
+            raws = np.zeros(count, dtype=np.uint64)
+
+        capacity = self.capacity
+        total = int(self.meta[RingBuffer.TOTAL])
+
+        # Samples that would be overwritten within this block are never written.
+        if count > capacity:
+            total += count - capacity
+            values = values[-capacity:]
+            times = times[-capacity:]
+            raws = raws[-capacity:]
+            count = capacity
+
+        head = total % capacity
+        end = head + count
+        low_end = min(end, capacity)
+
+        self.meta[RingBuffer.SEQUENCE] += 1
+        for column, block in ((self.values, values), (self.times, times), (self.raws, raws)):
+            column[head:end] = block
+            # Mirror the block into the other half of the column.
+            column[head + capacity:low_end + capacity] = column[head:low_end]
+            if end > capacity:
+                column[0:end - capacity] = column[capacity:end]
+
+        self.meta[RingBuffer.TOTAL] = total + count
+        self.meta[RingBuffer.SEQUENCE] += 1
+
+    def last(self, n=None):
+        """
+        Returns the newest n samples, oldest first, as read-only views into the buffer.
+        @param n: The number of samples to return. Returns all stored samples if None.
+        @return: A (values, times) pair of arrays.
+        """
+        stored = len(self)
+        n = stored if n is None else max(0, min(n, stored))
+
+        end = int(self.meta[RingBuffer.TOTAL]) % self.capacity + self.capacity
+        values = self.values[end - n:end]
+        times = self.times[end - n:end]
+        values.flags.writeable = False
+        times.flags.writeable = False
+
+        return values, times
+
+    def snapshot(self, n=None):
+        """
+        Copies the newest n samples, retrying if samples were appended while
+        copying, so that the copy is consistent even though the backend keeps
+        writing. The sequence number identifies the version copied.
+        @param n: The number of samples to copy. Copies all stored samples if None.
+        @return: A (values, times, sequence) triple.
+        """
+        for _ in range(RingBuffer.SNAPSHOT_ATTEMPTS):
+            sequence = self.sequence
+            if sequence % 2 == 0:
+                values, times = self.last(n)
+                values, times = values.copy(), times.copy()
+                if self.sequence == sequence:
+                    return values, times, sequence
+            time.sleep(0)
+
+        # The writer never paused long enough, so settle for a copy that may be torn
+        values, times = self.last(n)
+        return values.copy(), times.copy(), self.sequence
+
+    def last_raw(self, n=None):
+        """
+        Returns the raw values of the newest n samples, oldest first, as a read-only view.
+        @param n: The number of samples to return. Returns all stored samples if None.
+        @return: An array of raw values.
+        """
+        stored = len(self)
+        n = stored if n is None else max(0, min(n, stored))
+
+        end = int(self.meta[RingBuffer.TOTAL]) % self.capacity + self.capacity
+        raws = self.raws[end - n:end]
+        raws.flags.writeable = False
+
+        return raws
+
+    def recalibrate(self, calibration):
+        """
+        Recomputes every stored value from its raw value.
+        @param calibration: The Calibration to apply.
+        """
+        self.meta[RingBuffer.SEQUENCE] += 1
+        self.values[:] = calibration.apply(self.raws)
+        self.meta[RingBuffer.SEQUENCE] += 1
+
+    def last_value(self):
+        """
+        Returns the newest sample.
+        @return: A (value, time) pair, or None if the buffer is empty.
+        """
+        if len(self) == 0:
+            return None
+
+        index = (int(self.meta[RingBuffer.TOTAL]) - 1) % self.capacity
+        return self.values[index], self.times[index]
@@ -0,0 +1,151 @@
+"""
+This file defines RollingStats, which keeps statistics over the newest
+samples of a channel up to date as samples arrive.
+"""
+
+import numpy as np
+
+
+class RollingWindow:
+    """
+    Statistics over the newest `size` samples of a RingBuffer. The sum and
+    sum of squares are updated incrementally from the samples entering and
+    leaving the window (and recomputed exactly every so often so rounding
+    errors can't build up). The sums are of each sample's difference from the
+    window's mean at the last recompute, as the variance of samples with a
+    large offset would otherwise cancel out in sum_squares / count - mean ** 2.
+    Min and max are computed from the buffer at most once per write. The count,
+    sums and offset are kept in an array, so a window can be shared between
+    processes along with its buffer.
+    """
+
+    # Recompute the sums exactly after at least this many samples
+    RECOMPUTE_INTERVAL = 1 << 14
+
+    # Indices into state
+    COUNT = 0
+    SUM = 1
+    SUM_SQUARES = 2
+    SHIFT = 3
+
+    def __init__(self, buffer, size, allocate=np.zeros):
+        """
+        @param buffer: The RingBuffer to keep statistics of.
+        @param size: The number of samples in the window. Must fit in the buffer.
+        @param allocate: The function used to allocate zeroed arrays, called like np.zeros.
+        """
+        self.buffer = buffer
+        self.size = min(size, buffer.capacity)
+        self.state = allocate(4, dtype=np.float64)
+        self.since_recompute = 0
+
+        self.extrema_sequence = -1
+        self.extrema = (np.nan, np.nan)
+
+    def update(self, appended):
+        """
+        Updates the statistics after samples were appended to the buffer.
+        @param appended: The number of samples that were appended.
+        """
+        if appended == 0:
+            return
+
+        state = self.state
+        old_count = int(state[RollingWindow.COUNT])
+        count = min(old_count + appended, self.size)
+        evicted = old_count + appended - count
+        state[RollingWindow.COUNT] = count
+        self.since_recompute += appended
+
+        # Samples that enter and leave the window are only in the buffer if it's big
+        # enough. The first samples set the offset the sums are taken from.
+        if old_count == 0 or appended >= self.size or self.since_recompute >= RollingWindow.RECOMPUTE_INTERVAL or \
+                evicted + count > len(self.buffer):
+            self.recompute()
+            return
+
+        values, _ = self.buffer.last(evicted + count)
+        shift = state[RollingWindow.SHIFT]
+        leaving = values[:evicted] - shift
+        entering = values[-appended:] - shift
+        state[RollingWindow.SUM] += entering.sum() - leaving.sum()
+        state[RollingWindow.SUM_SQUARES] += np.dot(entering, entering) - np.dot(leaving, leaving)
+
+    def recompute(self):
+        """
+        Computes the sums exactly from the samples in the window.
+        """
+        values, _ = self.buffer.last(int(self.state[RollingWindow.COUNT]))
+        shift = values.mean() if len(values) else 0.0
+        values = values - shift
+        self.state[RollingWindow.SHIFT] = shift
+        self.state[RollingWindow.SUM] = values.sum()
+        self.state[RollingWindow.SUM_SQUARES] = np.dot(values, values)
+        self.since_recompute = 0
+
+    def get(self, ticks_per_second):
+        """
+        Gets the statistics of the window.
+        @param ticks_per_second: How many timestamp units make up a second.
+        @return: A dict with the window's 'count', 'mean', 'min', 'max', 'std' and
+                 'rate' (samples per second), all NaN if the window is empty.
+        """
+        count, total, sum_squares, shift = (float(x) for x in self.state)
+        count = int(count)
+        if count == 0:
+            return {'count': 0, 'mean': np.nan, 'min': np.nan, 'max': np.nan, 'std': np.nan, 'rate': np.nan}
+
+        values, times = self.buffer.last(count)
+        sequence = self.buffer.sequence
+        if sequence != self.extrema_sequence:
+            self.extrema = (values.min(), values.max())
+            self.extrema_sequence = sequence
+
+        offset = total / count
+        mean = shift + offset
+        variance = max(sum_squares / count - offset * offset, 0.0)
+        duration = float(times[-1]) - float(times[0])
+        rate = (count - 1) * ticks_per_second / duration if duration > 0 else np.nan
+
+        return {'count': count, 'mean': mean, 'min': self.extrema[0], 'max': self.extrema[1],
+                'std': np.sqrt(variance), 'rate': rate}
+
+
+class RollingStats:
+    """
+    The statistics of one channel over each of a set of window sizes.
+    """
+
+    def __init__(self, buffer, windows, ticks_per_second, allocate=np.zeros):
+        """
+        @param buffer: The channel's RingBuffer.
+        @param windows: A list of window sizes in samples.
+        @param ticks_per_second: How many timestamp units make up a second.
+        @param allocate: The function used to allocate zeroed arrays, called like np.zeros.
+        """
+        self.buffer = buffer
+        self.windows = [RollingWindow(buffer, size, allocate) for size in windows]
+        self.ticks_per_second = ticks_per_second
+
+    def update(self, appended):
+        """
+        Updates every window after samples were appended to the buffer.
+        @param appended: The number of samples that were appended.
+        """
+        for window in self.windows:
+            window.update(appended)
+
+    def recompute(self):
+        """
+        Recomputes every window from scratch, e.g. after the buffer was recalibrated.
+        """
+        for window in self.windows:
+            window.recompute()
+
+    def get(self):
+        """
+        Gets the statistics of every window.
+        @return: The newest (value, time) pair or None, and a list with a dict of
+                 statistics per window (see RollingWindow.get).
+        """
+        return self.buffer.last_value(), [window.get(self.ticks_per_second) for window in self.windows]
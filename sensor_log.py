@@ -0,0 +1,190 @@
+"""
+This file defines SensorLogWriter, which writes sensor samples to the
+per-channel log files in logs/ from its own thread, so that disk I/O
+never happens on the thread decoding network messages.
+"""
+
+import os
+import threading
+import time
+
+from queue import Queue, Empty
+
+from capture import CaptureWriter
+
+
+class TextLog:
+    """
+    A channel log in the "time raw calibrated" text format.
+    """
+
+    def __init__(self, path, buffering):
+        self.file = open(path, 'a', buffering=buffering)
+
+    def write(self, times, raw, cal):
+        """
+        Appends a block of samples.
+        @return: The number of characters written.
+        """
+        lines = ''.join(['{0} {1} {2}\n'.format(t, d, c)
+                         for t, d, c in zip(times.tolist(), raw.tolist(), cal.tolist())])
+        return self.file.write(lines)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class SensorLogWriter:
+    """
+    Keeps the log files for each channel open and heavily buffered, and writes
+    every sample handed to it. Depending on log_format, samples go to the text
+    log logs/<channel>.log, to a binary capture (see capture.py) in a
+    logs/capture-<date>-<time>/ directory created for this session, or both.
+    Buffered data is flushed to disk every flush_interval seconds, once
+    flush_bytes have been written since the last flush, and whenever flush()
+    or close() is called.
+    """
+
+    FORMATS = ('text', 'binary', 'both')
+
+    # Markers that can be put on the queue instead of samples
+    _FLUSH = 'flush'
+    _CLOSE = 'close'
+
+    def __init__(self, logger, log_dir='logs/', log_format='text', flush_interval=1.0, flush_bytes=1 << 20):
+        """
+        Initializes the writer and starts its thread.
+        @param logger: The logger to report errors to.
+        @param log_dir: The directory to write logs to.
+        @param log_format: One of 'text', 'binary' or 'both'.
+        @param flush_interval: The maximum number of seconds to keep samples buffered.
+        @param flush_bytes: The number of buffered bytes that triggers a flush.
+        """
+        assert log_format in SensorLogWriter.FORMATS
+
+        self.logger = logger
+        self.log_dir = log_dir
+        self.log_format = log_format
+        self.capture_dir = os.path.join(log_dir, 'capture-' + time.strftime('%Y%m%d-%H%M%S'))
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+
+        self.queue = Queue()
+        self.files = {}
+        self.unflushed_bytes = 0
+        self.last_flush = time.monotonic()
+
+        self.thread = threading.Thread(target=self._run, name='SensorLogWriter')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, name, times, raw, cal):
+        """
+        Queues a block of samples to be written to a channel's log. The arrays
+        must not be modified afterwards.
+        @param name: The name of the channel, e.g. "LC1".
+        @param times: An array of timestamps.
+        @param raw: An array of raw sensor values.
+        @param cal: An array of calibrated values.
+        """
+        self.queue.put((name, times, raw, cal))
+
+    def flush(self, wait=False):
+        """
+        Asks the writer thread to flush everything written so far to disk.
+        @param wait: Whether to block until the flush has happened.
+        """
+        done = threading.Event()
+        self.queue.put((SensorLogWriter._FLUSH, done))
+        if wait:
+            done.wait()
+
+    def close(self):
+        """
+        Flushes and closes all log files and stops the writer thread.
+        """
+        done = threading.Event()
+        self.queue.put((SensorLogWriter._CLOSE, done))
+        done.wait()
+
+    def _run(self):
+        """
+        The writer thread. Writes queued samples and flushes according to the policy.
+        """
+        while True:
+            timeout = max(0.0, self.last_flush + self.flush_interval - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except Empty:
+                self._flush_files()
+                continue
+
+            if item[0] == SensorLogWriter._FLUSH:
+                self._flush_files()
+                item[1].set()
+            elif item[0] == SensorLogWriter._CLOSE:
+                self._close_files()
+                item[1].set()
+                return
+            else:
+                self._write_samples(*item)
+                if self.unflushed_bytes >= self.flush_bytes or \
+                        time.monotonic() - self.last_flush >= self.flush_interval:
+                    self._flush_files()
+
+    def _get_files(self, name, raw):
+        """
+        Gets the open logs for a channel, opening them if needed.
+        @param name: The name of the channel.
+        @param raw: An array of raw values, used to size binary records.
+        @return: A list of TextLogs and CaptureWriters.
+        """
+        files = self.files.get(name)
+        if files is None:
+            files = []
+            if self.log_format != 'binary':
+                files.append(TextLog(os.path.join(self.log_dir, name + '.log'), self.flush_bytes))
+            if self.log_format != 'text':
+                os.makedirs(self.capture_dir, exist_ok=True)
+                files.append(CaptureWriter(os.path.join(self.capture_dir, name + '.cap'), raw.dtype.itemsize,
+                                           buffering=self.flush_bytes))
+            self.files[name] = files
+
+        return files
+
+    def _write_samples(self, name, times, raw, cal):
+        """
+        Writes a block of samples to the channel's logs.
+        """
+        try:
+            for f in self._get_files(name, raw):
+                self.unflushed_bytes += f.write(times, raw, cal)
+        except OSError as e:
+            self.logger.error("Failed to write " + name + " log. OSError:" + str(e.strerror))
+
+    def _flush_files(self):
+        """
+        Flushes all open log files.
+        """
+        for name, files in self.files.items():
+            try:
+                for f in files:
+                    f.flush()
+            except OSError as e:
+                self.logger.error("Failed to flush " + name + " log. OSError:" + str(e.strerror))
+
+        self.unflushed_bytes = 0
+        self.last_flush = time.monotonic()
+
+    def _close_files(self):
+        """
+        Flushes and closes all open log files.
+        """
+        self._flush_files()
+        for files in self.files.values():
+            for f in files:
+                f.close()
+        self.files = {}
@@ -0,0 +1,9 @@
+"""
+Makes the repository's modules importable from the tests, which import
+them by their top level names like the GUI does.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,45 @@
+"""
+Tests for AxisLimits.
+"""
+
+from axis_limits import AxisLimits
+
+
+def test_first_update_leaves_a_margin():
+    limits = AxisLimits(margin=0.1)
+    assert limits.update(0.0, 10.0) == (-1.0, 11.0)
+
+
+def test_limits_hold_while_data_fits():
+    limits = AxisLimits(margin=0.1, shrink=0.5)
+    first = limits.update(0.0, 10.0)
+    assert limits.update(-0.5, 10.5) is first
+    assert limits.update(2.0, 9.0) is first
+
+
+def test_limits_move_when_data_leaves_them():
+    limits = AxisLimits(margin=0.1)
+    limits.update(0.0, 10.0)
+    assert limits.update(0.0, 20.0) == (-2.0, 22.0)
+    assert limits.update(-5.0, 15.0) == (-7.0, 17.0)
+
+
+def test_limits_close_in_when_data_shrinks():
+    limits = AxisLimits(margin=0.1, shrink=0.5)
+    limits.update(0.0, 10.0)
+    assert limits.update(4.0, 6.0) == (3.8, 6.2)
+
+
+def test_lead_leaves_room_above():
+    limits = AxisLimits(margin=0.0, lead=0.5)
+    assert limits.update(0.0, 10.0) == (0.0, 15.0)
+    # Growing data stays inside the lead, so the limits don't move
+    assert limits.update(2.0, 14.0) == (0.0, 15.0)
+
+
+def test_flat_data_gets_a_range():
+    limits = AxisLimits(margin=0.1)
+    low, high = limits.update(5.0, 5.0)
+    assert low < 5.0 < high
+    low, high = AxisLimits(margin=0.1).update(0.0, 0.0)
+    assert low < 0.0 < high
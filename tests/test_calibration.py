@@ -0,0 +1,69 @@
+"""
+Tests for Calibration and load_calibrations.
+"""
+
+import configparser
+
+import numpy as np
+import pytest
+
+from calibration import Calibration, load_calibrations
+from networking.server_info import ServerInfo
+from ring_buffer import RingBuffer
+
+
+def test_parse_linear_and_polynomial():
+    linear = Calibration.parse('(-0.275787487, 1069)')
+    assert linear.coefficients.tolist() == [1069, -0.275787487]
+    assert str(linear) == '(-0.275787487, 1069.0)'
+
+    poly = Calibration.parse(' poly(-250, 0.1611, 1.2e-7) ')
+    assert poly.coefficients.tolist() == [-250, 0.1611, 1.2e-7]
+    assert Calibration.parse(str(poly)).coefficients.tolist() == poly.coefficients.tolist()
+
+
+@pytest.mark.parametrize('text', ['1, 2', '(1, 2, 3)', 'poly()', '(a, b)'])
+def test_parse_rejects(text):
+    with pytest.raises(ValueError):
+        Calibration.parse(text)
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16])
+def test_lookup_table_matches_evaluation(dtype):
+    calibration = Calibration([-250, 0.1611, 1.2e-7, -3e-12])
+    raw = np.arange(np.iinfo(dtype).max + 1, dtype=dtype)
+    assert np.array_equal(calibration.apply(raw), calibration.evaluate(raw))
+    assert list(calibration.tables) == [np.dtype(dtype).itemsize]
+
+
+def test_wide_values_are_evaluated_directly():
+    calibration = Calibration.linear(2, 1)
+    raw = np.array([0, 1 << 40], dtype=np.uint64)
+    assert calibration.apply(raw).tolist() == [1, 2 * (1 << 40) + 1]
+    assert calibration.tables == {}
+
+
+def test_load_overrides_defaults():
+    config = configparser.ConfigParser()
+    config.read_string("[Calibration]\nTC1_SEND=poly(1, 2, 3)\n")
+    calibrations = load_calibrations(config)
+    assert set(calibrations) == set(ServerInfo.calibrations)
+    assert calibrations[ServerInfo.TC1_SEND].coefficients.tolist() == [1, 2, 3]
+    slope, intercept = ServerInfo.calibrations[ServerInfo.TC2_SEND]
+    assert calibrations[ServerInfo.TC2_SEND].coefficients.tolist() == [intercept, slope]
+
+
+def test_load_rejects_unknown_channel():
+    config = configparser.ConfigParser()
+    config.read_string("[Calibration]\nNOT_A_SENSOR=(1, 0)\n")
+    with pytest.raises(ValueError):
+        load_calibrations(config)
+
+
+def test_recalibrate_ring_buffer_from_raw_values():
+    buf = RingBuffer(4)
+    raws = np.arange(6, dtype=np.uint64)
+    buf.append_block(raws.astype(np.float64), raws * 10, raws)
+    buf.recalibrate(Calibration.parse('poly(1, 0, 2)'))
+    values, _ = buf.last()
+    assert values.tolist() == [1 + 2 * r * r for r in range(2, 6)]
@@ -0,0 +1,60 @@
+"""
+Tests for writing and reading captures.
+"""
+
+import os
+
+import numpy as np
+
+from capture import CaptureReader, CaptureWriter
+
+
+def write_capture(path, count, block=1000, index_stride=64):
+    writer = CaptureWriter(path, 2, index_stride=index_stride)
+    times = np.arange(count, dtype=np.uint64) * 100
+    raw = (np.arange(count) % 4096).astype(np.uint16)
+    cal = raw * 0.5 - 3
+    for i in range(0, count, block):
+        writer.write(times[i:i + block], raw[i:i + block], cal[i:i + block])
+    writer.close()
+    return times, raw, cal
+
+
+def test_round_trip(tmpdir):
+    path = str(tmpdir.join('LC1.cap'))
+    times, raw, cal = write_capture(path, 5000, block=777)
+    reader = CaptureReader(path)
+    assert len(reader) == 5000
+    assert reader.records['time'].tolist() == times.tolist()
+    assert reader.records['raw'].tolist() == raw.tolist()
+    assert np.array_equal(reader.records['cal'], cal)
+    # Every 64th record is indexed, whatever the block boundaries
+    assert reader.index['record'].tolist() == list(range(0, 5000, 64))
+
+
+def test_time_range(tmpdir):
+    path = str(tmpdir.join('LC1.cap'))
+    times, _, _ = write_capture(path, 5000)
+    reader = CaptureReader(path)
+    records = reader.time_range(123450, 234500)
+    expected = times[(times >= 123450) & (times < 234500)]
+    assert records['time'].tolist() == expected.tolist()
+    assert len(reader.time_range(10 ** 9, 10 ** 9 + 1)) == 0
+
+
+def test_partial_record_is_ignored(tmpdir):
+    path = str(tmpdir.join('LC1.cap'))
+    write_capture(path, 10)
+    with open(path, 'ab') as f:
+        f.write(b'\0' * 5)
+    assert len(CaptureReader(path)) == 10
+
+
+def test_to_text(tmpdir):
+    path = str(tmpdir.join('LC1.cap'))
+    write_capture(path, 3)
+    log_path = str(tmpdir.join('LC1.log'))
+    CaptureReader(path).to_text(log_path)
+    with open(log_path) as f:
+        assert f.read() == "0 0 -3.0\n100 1 -2.5\n200 2 -2.0\n"
+    assert os.path.exists(str(tmpdir.join('LC1.idx')))
@@ -0,0 +1,141 @@
+"""
+Tests for CommandSender: abort commands first, ACK matching, and holding
+abort commands while the connection is down.
+"""
+
+import threading
+import time
+
+import pytest
+
+from logger import LogLevel, Logger
+from metrics import Metrics
+from networking.command_sender import CommandSender
+from networking.server_info import ServerInfo
+
+
+class FakeNetworker:
+    """
+    Records what's sent instead of sending it, and connects and disconnects on request.
+    """
+
+    def __init__(self, connected=True):
+        self.connected = connected
+        self.wanted = True
+        self.connections = 1 if connected else 0
+        self.conn_event = threading.Event()
+        if connected:
+            self.conn_event.set()
+        self.sent = []
+        # Sending blocks until this is set, so that commands can be queued behind one
+        self.sending = threading.Event()
+        self.sending.set()
+
+    def send(self, message):
+        self.sending.wait()
+        self.sent.append(message)
+        return True
+
+    def connect(self):
+        self.connections += 1
+        self.connected = True
+        self.conn_event.set()
+
+    def lose_connection(self):
+        self.conn_event.clear()
+        self.connected = False
+
+
+def make_sender(nw):
+    alerts = []
+    metrics = Metrics()
+    sender = CommandSender(Logger(name='test', level=LogLevel.ERROR), nw, metrics, alert_func=alerts.append)
+    return sender, alerts, metrics
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < deadline
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def short_hold(monkeypatch):
+    monkeypatch.setattr(CommandSender, 'HOLD_TIMEOUT', 0.3)
+
+
+def test_abort_commands_jump_the_queue():
+    nw = FakeNetworker()
+    nw.sending.clear()
+    sender, _, _ = make_sender(nw)
+    sender.send(ServerInfo.SET_VALVE)
+    wait_for(lambda: sender.queue.empty())
+    sender.send(ServerInfo.SET_IGNITION)
+    sender.send(ServerInfo.UNSET_VALVE)
+    nw.sending.set()
+    wait_for(lambda: len(nw.sent) == 3)
+    assert nw.sent == [ServerInfo.SET_VALVE, ServerInfo.UNSET_VALVE, ServerInfo.SET_IGNITION]
+
+
+def test_ack_matches_the_command_it_names():
+    nw = FakeNetworker()
+    sender, _, metrics = make_sender(nw)
+    sender.send(ServerInfo.SET_VALVE)
+    sender.send(ServerInfo.SET_IGNITION)
+    wait_for(lambda: len(sender.pending) == 2)
+
+    assert sender.acknowledge(ServerInfo.SET_IGNITION, time.perf_counter()) is not None
+    assert [command for command, _ in sender.pending] == [ServerInfo.SET_VALVE]
+    # An ACK without a command acknowledges the oldest one waiting
+    assert sender.acknowledge(None, time.perf_counter()) is not None
+    assert sender.pending == []
+    assert sender.acknowledge(None, time.perf_counter()) is None
+    assert 'command.last_round_trip.SET_IGNITION' in metrics.snapshot()
+
+
+def test_abort_held_until_reconnected(short_hold):
+    nw = FakeNetworker(connected=False)
+    sender, alerts, _ = make_sender(nw)
+    sender.send(ServerInfo.UNSET_VALVE)
+    time.sleep(0.1)
+    assert nw.sent == []
+    nw.connect()
+    wait_for(lambda: nw.sent == [ServerInfo.UNSET_VALVE])
+    assert alerts == []
+
+
+def test_abort_dropped_and_alerted_after_the_deadline(short_hold):
+    nw = FakeNetworker(connected=False)
+    sender, alerts, metrics = make_sender(nw)
+    sender.send(ServerInfo.UNSET_IGNITION)
+    wait_for(lambda: alerts)
+    assert 'UNSET_IGNITION' in alerts[0]
+    nw.connect()
+    time.sleep(0.1)
+    assert nw.sent == []
+    assert metrics.snapshot()['command.dropped']['total'] == 1
+
+
+def test_abort_dropped_at_once_when_disconnected_on_purpose():
+    nw = FakeNetworker(connected=False)
+    nw.wanted = False
+    sender, alerts, _ = make_sender(nw)
+    sender.send(ServerInfo.DEFAULT)
+    wait_for(lambda: alerts, timeout=CommandSender.HOLD_TIMEOUT / 2)
+    assert nw.sent == []
+
+
+def test_command_not_sent_on_a_later_connection(short_hold):
+    # An ignition queued while the connection is down isn't sent when it's back,
+    # even if an abort command held the queue up until then
+    nw = FakeNetworker()
+    nw.lose_connection()
+    sender, alerts, _ = make_sender(nw)
+    sender.send(ServerInfo.UNSET_VALVE)
+    sender.send(ServerInfo.SET_IGNITION)
+    time.sleep(0.1)
+    nw.connect()
+    wait_for(lambda: len(alerts) == 1)
+    assert nw.sent == [ServerInfo.UNSET_VALVE]
+    assert 'SET_IGNITION' in alerts[0]
@@ -0,0 +1,52 @@
+"""
+Tests for the decimation modes.
+"""
+
+import numpy as np
+
+from decimation import min_max, stride
+
+
+def test_min_max_returns_short_input_unchanged():
+    values = np.array([3.0, 1.0, 2.0])
+    times = np.arange(3, dtype=np.uint64)
+    out_values, out_times = min_max(values, times, 4)
+    assert out_values is values and out_times is times
+
+
+def test_min_max_keeps_extremes_in_order():
+    values = np.array([0, 5, -1, 2, 7, 3, 1, -4], dtype=np.float64)
+    times = np.arange(8, dtype=np.uint64) * 10
+    out_values, out_times = min_max(values, times, 4)
+    # Two buckets of four: [0, 5, -1, 2] and [7, 3, 1, -4]
+    assert out_values.tolist() == [5, -1, 7, -4]
+    assert out_times.tolist() == [10, 20, 40, 70]
+
+
+def test_min_max_keeps_a_one_sample_spike():
+    values = np.zeros(10000)
+    values[4321] = 100.0
+    values[7777] = -50.0
+    times = np.arange(10000, dtype=np.uint64)
+    out_values, out_times = min_max(values, times, 100)
+    assert len(out_values) <= 102
+    assert out_values.max() == 100.0 and out_values.min() == -50.0
+    assert 4321 in out_times.tolist() and 7777 in out_times.tolist()
+    assert np.all(np.diff(out_times.astype(np.int64)) >= 0)
+
+
+def test_min_max_puts_the_remainder_in_an_oldest_bucket():
+    values = np.array([9, 0, 1, 2, 3, 4, 5], dtype=np.float64)
+    times = np.arange(7, dtype=np.uint64)
+    out_values, out_times = min_max(values, times, 4)
+    # Buckets of three aligned to the newest sample, leaving [9] at the oldest end
+    assert out_values.tolist() == [9, 9, 0, 2, 3, 5]
+    assert out_times.tolist() == [0, 0, 1, 3, 4, 6]
+
+
+def test_stride():
+    values = np.arange(10.0)
+    times = np.arange(10, dtype=np.uint64)
+    out_values, out_times = stride(values, times, 3)
+    assert out_values.tolist() == [0, 3, 6, 9]
+    assert out_times.tolist() == [0, 3, 6, 9]
@@ -0,0 +1,200 @@
+"""
+Tests for receiving and parsing frames through Networker.read_messages,
+fed from a socket pair in chunks of random sizes.
+"""
+
+import configparser
+import random
+import socket
+
+import numpy as np
+import pytest
+
+from logger import LogLevel, Logger
+from networking.networker import Networker
+from networking.server_info import ServerInfo, payload_dtype
+
+PI = ServerInfo.PiInfo
+SENSORS = sorted(ServerInfo.filenames)
+
+
+def make_networker(datagrams=False, layout='PiInfo'):
+    """
+    Makes a Networker that reads from one end of a socket pair, as if it had
+    just connected. Returns it and the other end to send from.
+    """
+    config = configparser.ConfigParser()
+    config.read_string("[Server]\nTimeout = 2\nLayout = " + layout + "\n")
+    nw = Networker(Logger(name='test', level=LogLevel.ERROR), config)
+    if datagrams:
+        sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        nw.udp_sock.close()
+        nw.udp_sock = receiver
+    else:
+        sender, receiver = socket.socketpair()
+    nw.recv_sock = receiver
+    nw.recv_sock.settimeout(2)
+    nw.connected = True
+    nw.reset_recv_buffer()
+    nw.resyncing = True
+    nw.detecting_layout = nw.layout is None
+    return nw, sender
+
+
+def frame(mtype, count, first_time, rng):
+    """
+    Builds a sensor data frame of count records with 12-bit ADC style values.
+    """
+    records = np.zeros(count, dtype=payload_dtype(PI))
+    records['data'] = rng.randint(0x0A00, 0x0CFF)
+    records['time'] = first_time + np.arange(count, dtype=np.uint64) * 1000
+    return PI.header_struct.pack(mtype, records.nbytes) + records.tobytes()
+
+
+def make_stream(rng, count, low_byte=None, first_time=1000000):
+    """
+    Builds count frames of sensor data, ACKs and text.
+    @return: The frames and the (type, payload) each should be parsed into.
+    """
+    frames = []
+    expected = []
+    time = first_time
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.8:
+            mtype = rng.choice(SENSORS)
+            time += 1000000
+            first_time = time - time % 256 + (low_byte if low_byte is not None else rng.randint(0, 255))
+            data = frame(mtype, rng.randint(1, 40), first_time, rng)
+        elif kind < 0.9:
+            mtype = ServerInfo.ACK_VALUE
+            data = PI.header_struct.pack(mtype, 1) + ServerInfo.SET_VALVE
+        else:
+            mtype = ServerInfo.TEXT
+            text = "status {0}".format(rng.randint(0, 1000)).encode()
+            data = PI.header_struct.pack(mtype, len(text)) + text
+        frames.append(data)
+        expected.append((mtype, data[PI.header_size:]))
+
+    return frames, expected
+
+
+def receive(nw, sender, stream, rng, max_chunk):
+    """
+    Sends a stream in chunks of random sizes and parses whatever each read gets.
+    @return: The (type, payload) of every message parsed.
+    """
+    messages = []
+    offset = 0
+    while offset < len(stream):
+        size = rng.randint(1, max_chunk)
+        sender.sendall(stream[offset:offset + size])
+        offset += size
+        messages.extend(nw.read_messages())
+    sender.shutdown(socket.SHUT_WR)
+
+    while nw.connected:
+        messages.extend(nw.read_messages())
+
+    return [(mtype, message or b'') for mtype, _, message in messages]
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('max_chunk', [7, 300, 5000])
+def test_chunked_stream_parses_whole(seed, max_chunk):
+    rng = random.Random(seed)
+    nw, sender = make_networker()
+    frames, expected = make_stream(rng, 200)
+    assert receive(nw, sender, b''.join(frames), rng, max_chunk) == expected
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('low_byte', [None, 0x00, 0x01, 0x38])
+def test_stream_starting_mid_payload_resyncs(seed, low_byte):
+    rng = random.Random(seed)
+    nw, sender = make_networker()
+    frames, expected = make_stream(rng, 100, low_byte)
+    # Start somewhere inside the first frame, as after connecting mid-stream
+    cut = rng.randint(1, len(frames[0]) - 1)
+    stream = b''.join(frames)[cut:]
+    assert receive(nw, sender, stream, rng, 500) == expected[1:]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_resync_with_timestamps_past_32_bits(seed):
+    # From 2 ** 32 ticks on, bytes 12 to 15 of every record read as a control
+    # frame header, which can take the place of the frames it seems to hold.
+    # Resync still finds the frames again and never delivers bad sensor data.
+    rng = random.Random(seed)
+    nw, sender = make_networker()
+    frames, expected = make_stream(rng, 100, first_time=5000000000)
+    cut = rng.randint(1, len(frames[0]) - 1)
+    messages = receive(nw, sender, b''.join(frames)[cut:], rng, 500)
+    assert messages[-90:] == expected[-90:]
+    assert all(message in expected for message in messages if message[0] in ServerInfo.filenames)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_leading_garbage_is_skipped(seed):
+    rng = random.Random(seed)
+    nw, sender = make_networker()
+    frames, expected = make_stream(rng, 50)
+    garbage = bytes(rng.randint(0x20, 0xff) for _ in range(rng.randint(1, 3000)))
+    assert receive(nw, sender, garbage + b''.join(frames), rng, 1000) == expected
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_datagrams_are_never_truncated(seed):
+    rng = random.Random(seed)
+    nw, sender = make_networker(datagrams=True)
+    frames, expected = make_stream(rng, 100)
+    big = frame(ServerInfo.PT_FEED_SEND, (ServerInfo.MAX_DATAGRAM_FRAME_BYTES - PI.header_size) // 16, 1000000, rng)
+    # Garbage first, so that resyncing leaves unparsed bytes in the receive buffer,
+    # then full size datagrams between datagrams of a few frames each
+    datagrams = [bytes(rng.randint(0x20, 0xff) for _ in range(100))]
+    expected_messages = []
+    for start in range(0, len(frames), 10):
+        datagrams += [big, b''.join(frames[start:start + 10])]
+        expected_messages += [(ServerInfo.PT_FEED_SEND, big[PI.header_size:])] + expected[start:start + 10]
+
+    messages = []
+    for datagram in datagrams:
+        sender.send(datagram)
+        messages.extend(nw.read_messages())
+
+    assert [(mtype, message or b'') for mtype, _, message in messages] == expected_messages
+
+
+def test_frame_larger_than_a_datagram_over_tcp():
+
+    rng = random.Random(0)
+    nw, sender = make_networker()
+    big = frame(ServerInfo.PT_FEED_SEND, 5000, 1000000, rng)
+    frames, expected = make_stream(rng, 20)
+    stream = frames[0] + big + b''.join(frames[1:])
+    expected.insert(1, (ServerInfo.PT_FEED_SEND, big[PI.header_size:]))
+    assert receive(nw, sender, stream, rng, 20000) == expected
+
+
+def test_datagram_limit():
+    rng = random.Random(0)
+    big = frame(ServerInfo.PT_FEED_SEND, 5000, 1000000, rng)
+    assert ServerInfo.header_fits(PI, big, 0) == len(big) - PI.header_size
+    assert ServerInfo.header_fits(PI, big, 0, ServerInfo.MAX_DATAGRAM_FRAME_BYTES) is None
+
+
+def test_payload_that_looks_like_a_header_is_rejected():
+    # A record's ADC high byte, zero padding and timestamp low byte read as a
+    # header whose size is at least 16 MiB.
+    data = frame(ServerInfo.LC1_SEND, 5, 1000000 - 1000000 % 256 + 0x38, random.Random(0))
+    assert ServerInfo.header_fits(PI, data, PI.header_size + 1) is None
+
+
+def test_layout_detected_from_frames_bigger_than_the_buffer():
+    rng = random.Random(0)
+    nw, sender = make_networker(layout='auto')
+    records = 2 * Networker.RECV_BUFFER_SIZE // PI.payload_bytes
+    frames = [frame(mtype, records, 1000000, rng) for mtype in SENSORS[:3]]
+    expected = [(mtype, data[PI.header_size:]) for mtype, data in zip(SENSORS, frames)]
+    assert receive(nw, sender, b''.join(frames), rng, 50000) == expected
+    assert nw.server_info.info is PI
@@ -0,0 +1,86 @@
+"""
+Tests for DownsamplePyramid against aggregates computed directly from the samples.
+"""
+
+import numpy as np
+import pytest
+
+from pyramid import DownsamplePyramid
+
+
+def fill(pyramid, count, seed=0):
+    """
+    Appends count samples, 10 ticks apart, in blocks of random sizes.
+    @return: The values and times appended.
+    """
+    rng = np.random.default_rng(seed)
+    values = rng.normal(0, 1, count)
+    times = np.arange(count, dtype=np.uint64) * 10
+    start = 0
+    while start < count:
+        end = min(start + int(rng.integers(1, 100)), count)
+        pyramid.append_block(values[start:end], times[start:end])
+        start = end
+
+    return values, times
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_levels_aggregate_the_level_below(seed):
+    pyramid = DownsamplePyramid(capacity=100000, factor=4, levels=4)
+    values, times = fill(pyramid, 5000, seed)
+    for i, level in enumerate(pyramid.levels):
+        size = 4 ** i
+        full = len(values) // size * size
+        stored = level.stored()
+        assert len(level) == full // size
+        assert np.array_equal(stored['min'], values[:full].reshape(-1, size).min(axis=1))
+        assert np.array_equal(stored['max'], values[:full].reshape(-1, size).max(axis=1))
+        assert np.allclose(stored['mean'], values[:full].reshape(-1, size).mean(axis=1))
+        assert np.array_equal(stored['time'], times[:full:size])
+
+
+def test_levels_keep_the_newest_buckets():
+    pyramid = DownsamplePyramid(capacity=64, factor=4, levels=3)
+    values, times = fill(pyramid, 1000)
+    assert np.array_equal(pyramid.levels[0].stored()['time'], times[-64:])
+    # Level 2 still holds every one of its 62 buckets of 16 samples
+    assert np.array_equal(pyramid.levels[2].stored()['time'], times[:992:16])
+    assert pyramid.time_span() == (int(times[0]), int(times[-1]))
+
+
+def test_time_span_of_empty_pyramid():
+    assert DownsamplePyramid().time_span() is None
+
+
+def test_whole_range_reduces_to_its_aggregates():
+    # The pending buckets of every level are included, so nothing is left out
+    pyramid = DownsamplePyramid(capacity=100000, factor=4, levels=4)
+    values, times = fill(pyramid, 5003)
+    series = pyramid.series(int(times[0]), int(times[-1]), 1)
+    assert series['min'].tolist() == [values.min()]
+    assert series['max'].tolist() == [values.max()]
+    assert series['mean'][0] == pytest.approx(values.mean())
+    assert series['time'].tolist() == [times[0]]
+
+
+@pytest.mark.parametrize('width', [10, 100, 1000])
+def test_series_fits_in_width(width):
+    pyramid = DownsamplePyramid(capacity=100000, factor=4, levels=4)
+    values, times = fill(pyramid, 20000)
+    start, end = int(times[3000]), int(times[12000])
+    series = pyramid.series(start, end, width)
+    assert 0 < len(series['time']) <= width
+    assert np.all(np.diff(series['time'].astype(np.int64)) > 0)
+    # Buckets are whole, so they may reach a coarse bucket beyond the range
+    inside = values[3000:12001]
+    assert series['min'].min() <= inside.min() and series['max'].max() >= inside.max()
+
+
+def test_range_older_than_fine_levels_uses_a_coarse_one():
+    pyramid = DownsamplePyramid(capacity=64, factor=4, levels=3)
+    values, times = fill(pyramid, 1000)
+    series = pyramid.series(int(times[100]), int(times[200]), 1000)
+    # Level 0 only holds the newest 64 samples, level 2 has buckets of 16 from sample 8 on
+    assert series['time'].tolist() == times[112:201:16].tolist()
+    assert series['max'][0] == values[112:128].max()
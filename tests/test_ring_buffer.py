@@ -0,0 +1,81 @@
+"""
+Tests for RingBuffer.
+"""
+
+import numpy as np
+
+from ring_buffer import RingBuffer
+
+
+def append_range(buf, start, stop):
+    values = np.arange(start, stop, dtype=np.float64)
+    buf.append_block(values, values.astype(np.uint64) * 10, values.astype(np.uint64))
+
+
+def test_empty():
+    buf = RingBuffer(4)
+    values, times = buf.last()
+    assert len(buf) == 0
+    assert len(values) == 0 and len(times) == 0
+    assert buf.last_value() is None
+
+
+def test_partial_fill():
+    buf = RingBuffer(8)
+    append_range(buf, 0, 5)
+    values, times = buf.last()
+    assert len(buf) == 5
+    assert values.tolist() == [0, 1, 2, 3, 4]
+    assert times.tolist() == [0, 10, 20, 30, 40]
+
+
+def test_wraparound_keeps_newest_in_order():
+    buf = RingBuffer(4)
+    append_range(buf, 0, 3)
+    append_range(buf, 3, 6)
+    append_range(buf, 6, 7)
+    values, times = buf.last()
+    assert len(buf) == 4
+    assert buf.total == 7
+    assert values.tolist() == [3, 4, 5, 6]
+    assert times.tolist() == [30, 40, 50, 60]
+    assert buf.last_raw().tolist() == [3, 4, 5, 6]
+    assert buf.last_value() == (6, 60)
+
+
+def test_block_larger_than_capacity():
+    buf = RingBuffer(4)
+    append_range(buf, 0, 2)
+    append_range(buf, 2, 12)
+    assert buf.total == 12
+    assert buf.last()[0].tolist() == [8, 9, 10, 11]
+
+
+def test_last_n_is_a_read_only_view():
+    buf = RingBuffer(4)
+    append_range(buf, 0, 6)
+    values, times = buf.last(2)
+    assert values.tolist() == [4, 5]
+    assert not values.flags.writeable
+    assert np.shares_memory(values, buf.values)
+
+
+def test_snapshot_copies_and_tracks_sequence():
+    buf = RingBuffer(4)
+    append_range(buf, 0, 6)
+    values, times, sequence = buf.snapshot(3)
+    assert values.tolist() == [3, 4, 5]
+    assert times.tolist() == [30, 40, 50]
+    assert sequence % 2 == 0
+    assert not np.shares_memory(values, buf.values)
+
+    append_range(buf, 6, 8)
+    assert values.tolist() == [3, 4, 5]
+    assert buf.snapshot()[2] != sequence
+    assert buf.snapshot()[0].tolist() == [4, 5, 6, 7]
+
+
+def test_snapshot_more_than_stored():
+    buf = RingBuffer(4)
+    append_range(buf, 0, 2)
+    assert buf.snapshot(10)[0].tolist() == [0, 1]
@@ -0,0 +1,82 @@
+"""
+Tests for RollingWindow and RollingStats against statistics computed
+directly from the newest samples.
+"""
+
+import numpy as np
+import pytest
+
+from calibration import Calibration
+from ring_buffer import RingBuffer
+from rolling_stats import RollingStats, RollingWindow
+
+
+def append(buf, stats, values, first_time):
+    times = first_time + np.arange(len(values), dtype=np.uint64) * 1000
+    buf.append_block(values, times, values.astype(np.uint64))
+    stats.update(len(values))
+
+
+def assert_matches(result, values, ticks_per_second=1000000):
+    assert result['count'] == len(values)
+    assert result['mean'] == pytest.approx(values.mean())
+    assert result['std'] == pytest.approx(values.std(), rel=1e-6, abs=1e-9)
+    assert result['min'] == values.min()
+    assert result['max'] == values.max()
+    # Samples are 1000 ticks apart
+    assert result['rate'] == pytest.approx(ticks_per_second / 1000)
+
+
+def test_empty_window():
+    stats = RollingStats(RingBuffer(16), [4], 1000000)
+    last, (result,) = stats.get()
+    assert last is None
+    assert result['count'] == 0 and np.isnan(result['mean'])
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_windows_follow_blocks_of_every_size(seed):
+    rng = np.random.default_rng(seed)
+    buf = RingBuffer(256)
+    stats = RollingStats(buf, [1, 10, 100, 1000], 1000000)
+    history = np.array([])
+    time = 0
+    for _ in range(200):
+        values = rng.normal(1000, 50, rng.integers(1, 120))
+        append(buf, stats, values, time)
+        time += 1000 * len(values)
+        history = np.concatenate([history, values])
+
+        _, results = stats.get()
+        # The 1000 sample window is cut down to the buffer's capacity
+        for size, result in zip([1, 10, 100, 256], results):
+            expected = history[-size:]
+            if len(expected) > 1:
+                assert_matches(result, expected)
+
+
+@pytest.mark.parametrize('recompute_interval', [1000, RollingWindow.RECOMPUTE_INTERVAL])
+def test_small_spread_on_a_large_offset(monkeypatch, recompute_interval):
+    # Where sum_squares / count - mean ** 2 would cancel out all of the variance
+    monkeypatch.setattr(RollingWindow, 'RECOMPUTE_INTERVAL', recompute_interval)
+    rng = np.random.default_rng(0)
+    buf = RingBuffer(64)
+    stats = RollingStats(buf, [50], 1000000)
+    values = 1e6 + rng.normal(0, 0.01, 10000)
+    for i in range(0, len(values), 7):
+        append(buf, stats, values[i:i + 7], 1000 * i)
+        if i % 700 == 0 and i >= 50:
+            _, (result,) = stats.get()
+            assert result['std'] == pytest.approx(values[i + 7 - 50:i + 7].std(), rel=1e-3)
+
+
+def test_recompute_after_recalibration():
+    buf = RingBuffer(32)
+    stats = RollingStats(buf, [8], 1000000)
+    append(buf, stats, np.arange(20, dtype=np.float64), 0)
+    stats.get()
+    buf.recalibrate(Calibration.linear(2, 0))
+    stats.recompute()
+    last, (result,) = stats.get()
+    assert last[0] == 38
+    assert_matches(result, 2 * np.arange(12, 20, dtype=np.float64))
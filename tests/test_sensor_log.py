@@ -0,0 +1,116 @@
+"""
+Tests for SensorLogWriter's log formats and flush policy.
+"""
+
+import os
+import time
+
+import numpy as np
+import pytest
+
+from capture import CaptureReader
+from sensor_log import SensorLogWriter
+
+
+class ListLogger:
+    def __init__(self):
+        self.errors = []
+
+    def error(self, msg):
+        self.errors.append(msg)
+
+
+def block(start, count):
+    times = np.arange(start, start + count, dtype=np.uint64) * 1000
+    raw = (np.arange(start, start + count) % 4096).astype(np.uint16)
+    return times, raw, raw * 0.25 - 10
+
+
+def text_lines(times, raw, cal):
+    return ['{0} {1} {2}'.format(t, d, c) for t, d, c in zip(times.tolist(), raw.tolist(), cal.tolist())]
+
+
+def read_lines(path):
+    # The writer thread may not have opened the file yet
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_text_logs_per_channel(tmpdir):
+    writer = SensorLogWriter(ListLogger(), str(tmpdir), 'text', flush_interval=60)
+    blocks = [block(0, 100), block(100, 37), block(137, 500)]
+    for times, raw, cal in blocks:
+        writer.write('LC1', times, raw, cal)
+        writer.write('TC1', times[:3], raw[:3], cal[:3])
+    writer.close()
+
+    assert read_lines(str(tmpdir.join('LC1.log'))) == sum((text_lines(*b) for b in blocks), [])
+    assert read_lines(str(tmpdir.join('TC1.log'))) == sum((text_lines(*(a[:3] for a in b)) for b in blocks), [])
+    assert not os.path.exists(writer.capture_dir)
+
+
+def test_text_logs_are_appended_to(tmpdir):
+    for start in (0, 10):
+        writer = SensorLogWriter(ListLogger(), str(tmpdir), 'text')
+        writer.write('LC1', *block(start, 10))
+        writer.close()
+
+    assert read_lines(str(tmpdir.join('LC1.log'))) == text_lines(*block(0, 20))
+
+
+@pytest.mark.parametrize('log_format', ['binary', 'both'])
+def test_binary_capture(tmpdir, log_format):
+    writer = SensorLogWriter(ListLogger(), str(tmpdir), log_format)
+    times, raw, cal = block(0, 3000)
+    for i in range(0, 3000, 700):
+        writer.write('PT_FEED', times[i:i + 700], raw[i:i + 700], cal[i:i + 700])
+    writer.close()
+
+    reader = CaptureReader(os.path.join(writer.capture_dir, 'PT_FEED.cap'))
+    assert reader.records['time'].tolist() == times.tolist()
+    assert reader.records['raw'].tolist() == raw.tolist()
+    assert np.array_equal(reader.records['cal'], cal)
+    assert os.path.exists(str(tmpdir.join('PT_FEED.log'))) == (log_format == 'both')
+
+
+def test_flush_on_request(tmpdir):
+    writer = SensorLogWriter(ListLogger(), str(tmpdir), 'text', flush_interval=60, flush_bytes=1 << 20)
+    writer.write('LC1', *block(0, 10))
+    writer.flush(wait=True)
+    assert read_lines(str(tmpdir.join('LC1.log'))) == text_lines(*block(0, 10))
+    writer.close()
+
+
+def test_flush_after_interval(tmpdir):
+    writer = SensorLogWriter(ListLogger(), str(tmpdir), 'text', flush_interval=0.05, flush_bytes=1 << 20)
+    writer.write('LC1', *block(0, 10))
+    wait_for(lambda: len(read_lines(str(tmpdir.join('LC1.log')))) == 10)
+    writer.close()
+
+
+def test_flush_after_bytes(tmpdir):
+    writer = SensorLogWriter(ListLogger(), str(tmpdir), 'text', flush_interval=60, flush_bytes=1000)
+    writer.write('LC1', *block(0, 10))
+    time.sleep(0.1)
+    # Less than flush_bytes stays buffered
+    assert read_lines(str(tmpdir.join('LC1.log'))) == []
+    writer.write('LC1', *block(10, 100))
+    wait_for(lambda: len(read_lines(str(tmpdir.join('LC1.log')))) == 110)
+    writer.close()
+
+
+def test_write_errors_are_reported(tmpdir):
+    logger = ListLogger()
+    writer = SensorLogWriter(logger, str(tmpdir.join('missing')), 'text')
+    writer.write('LC1', *block(0, 10))
+    writer.close()
+    assert len(logger.errors) == 1 and 'LC1' in logger.errors[0]
@@ -0,0 +1,63 @@
+"""
+Tests for the frame layouts and recognising them (see ServerInfo.detect_layout).
+"""
+
+import numpy as np
+import pytest
+
+from networking.server_info import ServerInfo, payload_dtype
+
+PI = ServerInfo.PiInfo
+OTHER = ServerInfo.OtherInfo
+
+
+def frame(layout, mtype, count, first_time):
+    """
+    Builds a sensor data frame of count records.
+    """
+    records = np.zeros(count, dtype=payload_dtype(layout))
+    records['data'] = np.arange(count) + 0x0A00
+    records['time'] = first_time + np.arange(count) * 256
+    return layout.header_struct.pack(mtype, records.nbytes) + records.tobytes()
+
+
+def test_whole_frames_fit():
+    stream = frame(PI, ServerInfo.LC1_SEND, 5, 0) + frame(PI, ServerInfo.TC1_SEND, 2, 0)
+    assert ServerInfo.frames_fit(PI, stream) is True
+    assert ServerInfo.frames_fit(OTHER, stream) is False
+
+
+def test_partial_frame_needs_more_bytes():
+    stream = frame(PI, ServerInfo.LC1_SEND, 5, 0)
+    assert ServerInfo.frames_fit(PI, stream[:-1]) is None
+    assert ServerInfo.frames_fit(PI, stream + stream[:-1]) is None
+    assert ServerInfo.frames_fit(PI, stream + stream) is True
+
+
+def test_single_datagram_fits():
+    datagram = frame(PI, ServerInfo.LC1_SEND, 5, 0)
+    assert ServerInfo.frames_fit(PI, datagram, datagrams=True) is True
+    # On TCP the stream may just happen to end after payload bytes that look like a frame
+    assert ServerInfo.frames_fit(PI, datagram) is None
+
+
+def test_control_frames_dont_count():
+    ack = PI.header_struct.pack(ServerInfo.ACK_VALUE, 1) + ServerInfo.SET_VALVE
+    data = frame(PI, ServerInfo.LC1_SEND, 5, 0)
+    assert ServerInfo.frames_fit(PI, ack * 3 + data) is None
+    assert ServerInfo.frames_fit(PI, ack * 3 + data + ack + data) is True
+
+
+def test_detect_layout():
+    assert ServerInfo.detect_layout(frame(OTHER, ServerInfo.PT_FEED_SEND, 3, 0) * 2) is OTHER
+    assert ServerInfo.detect_layout(frame(PI, ServerInfo.PT_FEED_SEND, 3, 0) * 2) is PI
+    with pytest.raises(ValueError):
+        ServerInfo.detect_layout(b'\xff' * 64)
+
+
+@pytest.mark.parametrize('layout', [PI, OTHER])
+def test_header_uses_the_layout_byte_order(layout):
+    header = layout.header_struct.pack(ServerInfo.LC1_SEND, 0x01020304)
+    assert len(header) == layout.header_size
+    nbytes = header[layout.header_nbytes_offset:layout.header_nbytes_offset + layout.header_nbytes_info]
+    assert int.from_bytes(nbytes, layout.byteorder) == 0x01020304
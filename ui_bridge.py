@@ -0,0 +1,47 @@
+"""
+This file defines UIBridge, which hands lines of text from background
+threads to the Tk thread. Tk widgets may only be touched from the thread
+running mainloop, so the networking and backend threads post lines here
+and the frontend drains them once per frame.
+"""
+
+from collections import deque
+
+
+class UIBridge:
+    """
+    A bounded queue of lines. Posting and draining don't take a lock:
+    appending to and popping from a deque are atomic. If the frontend falls
+    behind, e.g. during a flood of reconnect errors, the oldest lines are
+    dropped rather than building up.
+    """
+
+    # The most lines kept waiting to be drained
+    MAX_PENDING = 1000
+
+    def __init__(self, max_pending=MAX_PENDING):
+        """
+        @param max_pending: The most lines kept waiting to be drained.
+        """
+        self.lines = deque(maxlen=max_pending)
+
+    def post(self, line):
+        """
+        Queues a line. Safe to call from any thread.
+        @param line: The line of text.
+        """
+        self.lines.append(line)
+
+    def drain(self):
+        """
+        Takes every queued line.
+        @return: A list of lines, oldest first.
+        """
+        lines = []
+        try:
+            while True:
+                lines.append(self.lines.popleft())
+        except IndexError:
+            pass
+
+        return lines
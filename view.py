@@ -7,9 +7,14 @@ defined in GUIController.
 
 from tkinter import ttk
 
+import os
+import time
+
 import Pmw
 import tkinter as tk
 
+import numpy as np
+
 from sys import platform as sys_pf
 
 # Bugfix for Mac OSX
@@ -17,13 +22,17 @@ if sys_pf == 'darwin':
     import matplotlib
     matplotlib.use("TkAgg")
 
-from matplotlib import pyplot
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.ticker import AutoLocator
+from matplotlib.figure import Figure
 from matplotlib.transforms import Bbox
 
-from gui_constants import data_lengths, samples_to_keep, str_to_byte, labels
+from decimation import MIN_MAX, MODES
+from governor import FrameGovernor
+from graph_renderer import GraphRenderer, GraphSettings, create_figure
+from gui_constants import str_to_byte, labels
+from metrics import Metrics
 from networking.server_info import ServerInfo
+from ui_bridge import UIBridge
 
 class GUIFrontend:
     """
@@ -33,6 +42,19 @@ class GUIFrontend:
     priority.
     """
 
+    # Width in characters of each column in the data log
+    LOG_COLUMN_WIDTH = 10
+    # Total number of rows in the data log
+    LOG_ROWS = 20
+    # (label, key) of the statistics shown for each window in the data log
+    STAT_ROWS = [('Mean', 'mean'), ('Min', 'min'), ('Max', 'max'), ('Std', 'std'), ('Hz', 'rate')]
+    # Height in pixels of the metrics panel in the logging tab
+    METRICS_HEIGHT = 155
+    # Frames waiting for the backend beyond which it's falling behind
+    QUEUE_WARNING = 256
+    # How often (in milliseconds) to check for new data when the last frame had nothing to draw
+    IDLE_POLL_MS = 250
+
     def __init__(self, backend_adapter, config):
         self.backend_adapter = backend_adapter
         self.config = config
@@ -47,20 +69,55 @@ class GUIFrontend:
         self.frame_delay_ms = round(1000 / int(self.config.get("Display", "Target Framerate")))
 
         Pmw.initialise(self.root)
-        self.frame_count = 0
         self.frames_to_skip = int(self.config.get("Display", "Skip Frames for Axis Update"))
+
+        # Stretches the frame interval and draws fewer points when frames cost too much (see governor.py)
+        self.governor = FrameGovernor(self.frame_delay_ms, float(self.config.get("Display", "CPU Budget",
+                                                                                 fallback=0.5)),
+                                      self.frames_to_skip)
+        # The fraction of the usual number of points each graph draws
+        self.point_scale = 1.0
+
+        # Frame times and dropped frames for the metrics panel (see metrics.py)
+        self.metrics = Metrics()
+        self.metrics.start(os.path.join(self.config.get("Logging", "Directory", fallback="logs/"),
+                                        'metrics-render.jsonl'),
+                           float(self.config.get("Metrics", "Dump Interval", fallback=5.0)))
+        self.last_animate = None
+        self.last_metrics_update = 0.0
+        # Lines for the network log from other threads, shown once per frame (see flush_network_log)
+        self.log_bridge = UIBridge()
+        self.network_log_lines = int(self.config.get("Display", "Network Log Lines", fallback=500))
+        self.network_log_count = 0
+        # Alerts from other threads, e.g. dropped commands, shown once per frame (see flush_alerts)
+        self.alert_bridge = UIBridge()
+        self.alert_label = None
+
+        # Whether the next frame redraws every graph, even those without new data, and
+        # whether the graphs may have changed since the last frame (see wake)
+        self.redraw_graphs = True
+        self.woken = False
+        # The buffer sequence numbers the data log last showed
+        self.logged_versions = None
+        self.animate_job = None
+
         self.plot_selections = ["LC_MAIN", "LC1", "TC2", "PT_INJE"]
         self.choices = list(labels.keys())
 
         self.notebook = self.init_tabs_container()
         self.init_calibration_tab()
-        self.canvas, self.figure, self.plots, self.axes_list = self.init_graphs()
-        self.graph_variables, self.fine_control, self.set_limits = self.init_mission_control_tab()
-        self.data_logs, self.network_logs = self.init_logging_tab()
-        self.graph_area = self.init_refresh_settings()
+        self.canvas, self.graph_renderer = self.init_graphs()
+        self.graph_variables, self.decimation_variables, self.fine_control, self.set_limits = \
+            self.init_mission_control_tab()
+        self.data_logs, self.metrics_panel, self.network_logs = self.init_logging_tab()
+
+        # Redraw right away when the user changes what's shown, even while idle
+        for variable in self.graph_variables + self.decimation_variables + [self.fine_control, self.set_limits]:
+            variable.trace_add('write', lambda *args: self.wake())
+        self.notebook.bind('<<NotebookTabChanged>>', lambda event: self.wake(redraw=True))
 
         # Update as soon as mainloop starts
-        self.root.after(0, self.animate)
+        self.animate_job = self.root.after(0, self.animate)
 
     def init_tabs_container(self):
         """
@@ -91,39 +148,31 @@ class GUIFrontend:
 
     def init_graphs(self):
         """
-        Initializes the matplotlib graphs.
-        @return: A list of the canvas and figure containing the graphs,
-                 and a list of plots and axes of those plots.
+        Initializes the matplotlib graphs. They're drawn by a GraphRenderer
+        on its own thread, and the Tk canvas only shows the pixels it draws,
+        so its own figure stays blank.
+        @return: The canvas showing the graphs, and the GraphRenderer drawing them.
         """
-        figure, axes_list = pyplot.subplots(nrows=2, ncols=2)
-        axes_list = axes_list.flatten()
-        figure.subplots_adjust(top=.9, bottom=.1, left=.12, right=.95, wspace=.3, hspace=.5)
-        figure.set_size_inches(float(self.width) / self.dpi, float(self.height) / self.dpi)
-        figure.set_dpi(self.dpi)
+        graph_renderer = GraphRenderer(self.backend_adapter, *create_figure(self.width, self.height, self.dpi))
+        graph_renderer.start()
 
-        # Create a canvas to show this figure under the default tab
-        canvas = FigureCanvasTkAgg(figure, master=self.notebook.nametowidget("mission_control"))
+        # Create a canvas to show the graphs under the default tab
+        canvas = FigureCanvasTkAgg(Figure(figsize=(float(self.width) / self.dpi, float(self.height) / self.dpi),
+                                          dpi=self.dpi),
+                                   master=self.notebook.nametowidget("mission_control"))
         canvas.get_tk_widget().grid(row=1, column=1, sticky="NW")
+        # Tk draws the blank figure over the graphs when the canvas is first shown
+        canvas.mpl_connect('draw_event', lambda event: self.wake(redraw=True))
 
-        # time = float(str(datetime.now().time()).split(":")[2])
-        # print(time)
-        # self.last_update = [time, time, time, time]
-        plots = [axes_list[0].plot([0], [0])[0],
-                 axes_list[1].plot([0], [0])[0],
-                 axes_list[2].plot([0], [0])[0],
-                 axes_list[3].plot([0], [0])[0]]
-
-        # plt.setp(self.plots[0], aa=True)
-
-        return canvas, figure, plots, axes_list
+        return canvas, graph_renderer
 
     def init_mission_control_tab(self):
         """
         Initializes the mission control tab, which contains widgets
         for connecting to an address and port, selecting which graphs
         to display, and starting ignition, among others.
-        @return: Variables for graph selections, fine control, and data limits,
-                 which affect what is displayed on other frames.
+        @return: Variables for graph selections, decimation modes, fine control,
+                 and data limits, which affect what is displayed on other frames.
         """
         control_panel = tk.Frame(background="AliceBlue", width=350, height=625)
         control_panel.grid(row=1, column=2, sticky="NE")
@@ -150,6 +199,10 @@ class GUIFrontend:
         tk.ttk.Button(network_frame, text="Disconnect", command=lambda: self.backend_adapter.disconnect()) \
             .grid(row=3, column=2, pady=(15, 10), padx=15)
 
+        self.alert_label = tk.ttk.Label(network_frame, text="", foreground="red", background="AliceBlue",
+                                        wraplength=250)
+        self.alert_label.grid(row=4, column=1, columnspan=2, padx=15, sticky="w")
+
         network_frame.grid(row=1, column=1, pady=(7, 10))
 
         # Frame for selection of graphs
@@ -157,26 +210,35 @@ class GUIFrontend:
 
         graph_variables = [tk.StringVar(graph_frame), tk.StringVar(graph_frame),
                            tk.StringVar(graph_frame), tk.StringVar(graph_frame)]
+        decimation_variables = [tk.StringVar(graph_frame), tk.StringVar(graph_frame),
+                                tk.StringVar(graph_frame), tk.StringVar(graph_frame)]
         fine_control = tk.BooleanVar(graph_frame)
         set_limits = tk.BooleanVar(graph_frame)
         option_menus = []
+        decimation_menus = []
 
+        # Each plot gets a menu for its channel and, below it, one for how its data is decimated
         for i in range(4):
             option_menus.append(
                 tk.ttk.OptionMenu(graph_frame, graph_variables[i], self.plot_selections[i], *self.choices))
             option_menus[i].config(width=10)
-            option_menus[i].grid(row=2 + 2 * int(i > 1), column=i % 2 + 1, padx=10, pady=(0, 10))
+            option_menus[i].grid(row=2 + 3 * int(i > 1), column=i % 2 + 1, padx=10, pady=(0, 2))
+
+            decimation_menus.append(
+                tk.ttk.OptionMenu(graph_frame, decimation_variables[i], MIN_MAX, *MODES))
+            decimation_menus[i].config(width=10)
+            decimation_menus[i].grid(row=3 + 3 * int(i > 1), column=i % 2 + 1, padx=10, pady=(0, 10))
 
         tk.Label(graph_frame, text="Top Left", background="AliceBlue").grid(row=1, column=1, sticky="w", padx=10)
         tk.Label(graph_frame, text="Top Right", background="AliceBlue").grid(row=1, column=2, sticky="w", padx=10)
-        tk.Label(graph_frame, text="Bot Left", background="AliceBlue").grid(row=3, column=1, sticky="w", padx=10)
-        tk.Label(graph_frame, text="Bot Right", background="AliceBlue").grid(row=3, column=2, sticky="w", padx=10)
+        tk.Label(graph_frame, text="Bot Left", background="AliceBlue").grid(row=4, column=1, sticky="w", padx=10)
+        tk.Label(graph_frame, text="Bot Right", background="AliceBlue").grid(row=4, column=2, sticky="w", padx=10)
 
         tk.ttk.Checkbutton(graph_frame, text="Show All Data", variable=fine_control) \
-            .grid(row=5, column=1, sticky="w", padx=15, pady=(5, 15))
+            .grid(row=7, column=1, sticky="w", padx=15, pady=(5, 15))
 
         tk.ttk.Checkbutton(graph_frame, text="Data Limits", variable=set_limits) \
-            .grid(row=5, column=2, sticky="w", padx=15, pady=(5, 15))
+            .grid(row=7, column=2, sticky="w", padx=15, pady=(5, 15))
 
         graph_frame.grid(row=2, column=1, pady=10)
 
@@ -248,33 +310,17 @@ class GUIFrontend:
 
         ignition_frame.grid(row=4, column=1, pady=15)
 
-        return graph_variables, fine_control, set_limits
-
-    def init_refresh_settings(self):
-        """
-        Initializes refresh settings that are used when
-        blitting to relabel axes and other changes in the
-        graph.
-        @return: A graph_area for the graphs.
-        """
-        for i in range(4):
-            self.axes_list[i].set_yticks([])
-            self.axes_list[i].set_xticks([])
-        self.canvas.draw()
-        for i in range(4):
-            self.axes_list[i].xaxis.set_major_locator(AutoLocator())
-            self.axes_list[i].yaxis.set_major_locator(AutoLocator())
-        [width, height] = self.canvas.get_width_height()
-        graph_area = self.canvas.copy_from_bbox(Bbox.from_bounds(0, 0, width, height))
-
-        return graph_area
+        return graph_variables, decimation_variables, fine_control, set_limits
 
     def init_logging_tab(self):
         """
-        Initializes the logging (second) tab, which displays data values
-        for each sensor and network log output.
-        @return: The widgets that contain the log data.
+        Initializes the logging (second) tab, which displays recent values
+        and statistics for each sensor, pipeline metrics and network log output.
+        @return: The widgets that contain the log data, the metrics and the network log.
         """
+        width = GUIFrontend.LOG_COLUMN_WIDTH
+        row_labels = self.init_log_layout()
+
         data_logs = Pmw.ScrolledText(self.notebook.nametowidget("logging"),
                                      columnheader=1,
                                      usehullsize=1,
@@ -288,18 +334,31 @@ class GUIFrontend:
                                      )
         data_logs.tag_configure('yellow', background='yellow')
 
-        # Create the column headers
-        header_line = ''
+        # Create the column headers, and the rows with their labels and empty cells
+        header_line = ' ' * width
         for column in range(len(self.choices)):
-            header_line = header_line + self.choices[column] + ' ' * (10 - len(self.choices[column]))
+            header_line = header_line + self.choices[column] + ' ' * (width - len(self.choices[column]))
         data_logs.component('columnheader').insert('0.0', header_line)
+
+        for label, tags in zip(row_labels, self.log_row_tags):
+            data_logs.insert('end', label + ' ' * (width * (len(self.choices) + 1) - len(label)) + '\n', *tags)
         data_logs.grid(row=1, column=1)
 
+        metrics_panel = Pmw.ScrolledText(self.notebook.nametowidget("logging"),
+                                         usehullsize=1,
+                                         hull_width=self.width,
+                                         hull_height=GUIFrontend.METRICS_HEIGHT,
+                                         text_wrap='none',
+                                         hscrollmode='none',
+                                         vscrollmode='none'
+                                         )
+        metrics_panel.grid(row=2, column=1)
+
         network_logs = Pmw.ScrolledText(self.notebook.nametowidget("logging"),
                                         columnheader=1,
                                         usehullsize=1,
                                         hull_width=self.width,
-                                        hull_height=self.height - 350,
+                                        hull_height=self.height - 350 - GUIFrontend.METRICS_HEIGHT,
                                         text_wrap='none',
                                         Header_foreground='blue',
                                         Header_padx=4,
@@ -307,14 +366,36 @@ class GUIFrontend:
                                         vscrollmode='none'
                                         )
 
-        network_logs.grid(row=2, column=1)
+        network_logs.grid(row=3, column=1)
+
+        return data_logs, metrics_panel, network_logs
+
+    def init_log_layout(self):
+        """
+        Lays out the rows of the data log: rows of recent values followed
+        by rows of statistics for each window.
+        @return: The label of each row.
+        """
+        windows = self.backend_adapter.get_statistics_windows()
+
+        self.num_recent_rows = max(1, GUIFrontend.LOG_ROWS - len(GUIFrontend.STAT_ROWS) * len(windows))
+        row_labels = [''] * (self.num_recent_rows - 1) + ['Last']
+        self.log_row_tags = [()] * self.num_recent_rows
+        for window in windows:
+            for label, key in GUIFrontend.STAT_ROWS:
+                row_labels.append(label + ' ' + str(window))
+                self.log_row_tags.append(('yellow',) if key == 'mean' else ())
+
+        # What each cell currently shows, so that only cells that change are redrawn
+        self.log_cells = [[''] * len(self.choices) for _ in row_labels]
 
-        return data_logs, network_logs
+        return row_labels
 
     def init_calibration_tab(self):
         """
         Initializes the calibration tab, which is used to conveniently
-        store calibration data points and calculate the calibration curve.
+        store calibration data points, calculate the calibration curve,
+        and apply it to a channel.
         """
         calibration_frame = self.notebook.nametowidget('calibration')
 
@@ -367,6 +448,29 @@ class GUIFrontend:
             calib_display.insert('end', "Slope: {0}     Y intercept: {1}\n"
                                  .format(slope, y_int))
 
+        def apply_action():
+            """
+            Action for the apply button. Calculates the calibration and
+            uses it for the selected channel, recalibrating its data.
+            """
+            slope, y_int = self.backend_adapter.get_calibration()
+            self.backend_adapter.set_linear_calibration(str_to_byte[channel.get()], slope, y_int)
+            calib_display.insert('end', "Applied slope: {0}     Y intercept: {1}     to {2}\n"
+                                 .format(slope, y_int, channel.get()))
+
+        def reload_action():
+            """
+            Action for the reload button. Reloads all calibrations
+            from config.ini, recalibrating stored data.
+            """
+            self.backend_adapter.reload_calibrations()
+            calib_display.insert('end', "Reloaded calibrations from config.ini\n")
+
+        channel = tk.StringVar(calibration_frame)
+        channel_menu = tk.ttk.OptionMenu(calibration_frame, channel, self.choices[0], *self.choices)
+        channel_menu.config(width=10)
+        channel_menu.grid(row=1, column=4, padx=15, pady=10)
+
         calib_display.grid(row=0, column=0, columnspan=6)
         tk.ttk.Button(calibration_frame, text="Add", command=add_action) \
             .grid(row=1, column=3, padx=15, pady=10)
@@ -377,10 +481,19 @@ class GUIFrontend:
         tk.ttk.Button(calibration_frame, text="Get Calibration", command=get_action) \
             .grid(row=3, column=3, padx=15, pady=10)
 
+        tk.ttk.Button(calibration_frame, text="Apply to Channel", command=apply_action) \
+            .grid(row=2, column=4, padx=15, pady=10)
+
+        tk.ttk.Button(calibration_frame, text="Reload Config", command=reload_action) \
+            .grid(row=3, column=4, padx=15, pady=10)
+
     def animate(self):
         """
         The animation function for the GUI, which delegates
-        to updating either the graphs or the log displays.
+        to updating either the graphs or the log displays. When
+        there was nothing new to show, it checks again after
+        IDLE_POLL_MS rather than the frame delay. Frames are run
+        from after_idle, so pending input is always handled first.
         """
         # Generate some random data to test plotting
         # for queue in self.backend_adapter.get_all_queues():
@@ -388,91 +501,256 @@ class GUIFrontend:
         #     for j in range(1, 11):
         #         queue.append((random.randint(0, 1000), queue[length][1] + j))
 
+        # Count the frames we should have drawn since the last one but didn't
+        now = time.perf_counter()
+        if self.last_animate is not None:
+            dropped = int((now - self.last_animate) * 1000 // self.governor.interval_ms) - 1
+            if dropped > 0:
+                self.metrics.counter('render.dropped_frames').add(dropped)
+        self.last_animate = now
+
+        self.flush_network_log()
+        self.flush_alerts()
+
+        drawn = False
+        cost = None
         if self.notebook.index(self.notebook.select()) == 0:
-            self.draw_graphs()
+            drawn, cost = self.draw_graphs()
         elif self.notebook.index(self.notebook.select()) == 1:
-            self.update_log_displays()
+            drawn = self.update_log_displays()
+            self.update_metrics_panel()
+            if drawn:
+                cost = time.perf_counter() - now
+
+        if cost is not None and self.governor.record(cost):
+            self.point_scale = self.governor.point_scale
+            self.frames_to_skip = self.governor.frames_to_skip
+        if not drawn:
+            # Idle frames aren't dropped frames
+            self.last_animate = None
+        self.animate_job = self.root.after(self.governor.interval_ms if drawn else GUIFrontend.IDLE_POLL_MS,
+                                           self.request_frame)
+
+    def request_frame(self):
+        """
+        Runs the next frame once Tk has handled the events waiting, such as clicks.
+        """
+        self.animate_job = self.root.after_idle(self.animate)
+
+    def wake(self, redraw=False):
+        """
+        Animates right away instead of waiting for the next poll, e.g. when
+        the user changes which channel a graph shows.
+        @param redraw: Whether to redraw every graph and the data log even if nothing changed.
+        """
+        self.woken = True
+        if redraw:
+            self.redraw_graphs = True
+            self.logged_versions = None
 
-        self.root.after(self.frame_delay_ms, self.animate)
+        if self.animate_job is not None:
+            self.root.after_cancel(self.animate_job)
+        self.animate_job = self.root.after_idle(self.animate)
 
     def draw_graphs(self):
         """
-        Draws graphs using custom blitting and more fine-grain
-        control of the frame rate.
+        Shows the graphs. They're drawn by the GraphRenderer on its own
+        thread, so this only copies onto the canvas the parts of the last
+        frame it finished that changed, then asks it for the next one.
+        A slow frame never holds up the buttons.
+        @return: Whether the graphs changed or are still being drawn, and how many
+                 seconds the frame shown took to draw and copy, or None if none was.
         """
-        for i in range(4):
-            # Get which graph the user has selected and get the appropriate queue from the backend
-            graph_selection = self.graph_variables[i].get()
-            data_queue = self.backend_adapter.get_queue(str_to_byte[graph_selection])
-            data_length = data_lengths[graph_selection]
-
-            if self.fine_control.get():
-                data_ratio = 1
-            else:
-                data_ratio = int(data_lengths[graph_selection] / samples_to_keep[graph_selection])
-            # print (data_ratio)
-
-            y_data = [cal for cal, t in data_queue[-data_length::data_ratio]]
-            self.plots[i].set_xdata([t for cal, t in data_queue[-data_length::data_ratio]])
-            self.plots[i].set_ydata(y_data)
-
-            self.axes_list[i].relim()
-            self.axes_list[i].autoscale_view()
-
-        # Update auxiliary data in the graph.
-        # i.e. stuff other than the line.
-        self.canvas.restore_region(self.graph_area)
-        self.frame_count = self.frame_count + 1
-        if self.frame_count == self.frames_to_skip or self.frames_to_skip == 0:
-            self.frame_count = 0
-            update_axes = True
-        else:
-            update_axes = False
-        for i in range(4):
-            self.plots[i].axes.draw_artist(self.plots[i])
-            if update_axes:
-                self.plots[i].axes.draw_artist(self.axes_list[i].get_xaxis())
-                self.plots[i].axes.draw_artist(self.axes_list[i].get_yaxis())
-            else:
-                self.canvas.blit(self.plots[i].axes.bbox)
-        if update_axes:
-            self.canvas.blit(self.plots[0].axes.clipbox)
+        start = time.perf_counter()
+        busy = self.graph_renderer.busy or self.woken
+        self.woken = False
+
+        regions, render_seconds = self.graph_renderer.present(np.asarray(self.canvas.get_renderer().buffer_rgba()))
+        for region in regions:
+            self.canvas.blit(Bbox.from_bounds(*region))
+        present_seconds = time.perf_counter() - start
+
+        settings = GraphSettings([variable.get() for variable in self.graph_variables],
+                                 [variable.get() for variable in self.decimation_variables],
+                                 self.fine_control.get(), self.set_limits.get(), self.point_scale, self.frames_to_skip)
+        self.graph_renderer.request(settings, redraw=self.redraw_graphs)
+        self.redraw_graphs = False
+
+        if render_seconds is None:
+            return busy, None
+
+        self.metrics.histogram('render.frame_seconds').record(render_seconds)
+        self.metrics.histogram('render.present_seconds').record(present_seconds)
+        return True, render_seconds + present_seconds
 
     def update_log_displays(self):
         """
-        Updates the sensor data part of the log displays.
-        """
-        self.data_logs.clear()
-        # Create the data rows and the row headers
-        num_rows = 20
-        for row in range(1, num_rows):
-            data_line = ''
-            for column in range(len(self.choices)):
-                # print(self.choices)
-                data_queue = self.backend_adapter.get_queue(str_to_byte[self.choices[column]])
-                value = str(data_queue[max(-len(data_queue) + 1, -num_rows + row)][0])[0:7]
-                # print ("value", value)
-                data_line = data_line + value + ' ' * (10 - len(value))
-            data_line = data_line + '\n'
-            self.data_logs.insert('end', data_line)
-
-        averages = ''
-        for column in range(len(self.choices)):
-            data_queue = self.backend_adapter.get_queue(str_to_byte[self.choices[column]])
-            avg = str(sum([cal for cal, t in data_queue[-num_rows:]]) / num_rows)[0:7]
-            # data = str(average)[:9]
-            # data = '%-7s' % (data,)
-            averages = averages + avg + ' ' * (10 - len(avg))
-        self.data_logs.insert('end', averages)
-        self.data_logs.tag_add("yellow", '20.0', '20.' + str(len(averages)))
+        Updates the sensor data part of the log displays, only touching
+        the cells whose text changed, and only if any channel has new samples.
+        @return: True if any channel had new samples.
+        """
+        versions = [self.backend_adapter.get_queue(str_to_byte[choice]).sequence for choice in self.choices]
+        if versions == self.logged_versions:
+            return False
+        self.logged_versions = versions
+
+        width = GUIFrontend.LOG_COLUMN_WIDTH
+
+        for column, choice in enumerate(self.choices):
+            recent, _, _ = self.backend_adapter.get_queue(str_to_byte[choice]).snapshot(self.num_recent_rows)
+            _, windows = self.backend_adapter.get_stats(str_to_byte[choice])
+
+            # The newest sample goes at the bottom of the recent rows
+            values = [np.nan] * (self.num_recent_rows - len(recent)) + recent.tolist()
+            for stats in windows:
+                values.extend(stats[key] for _, key in GUIFrontend.STAT_ROWS)
+
+            for row, value in enumerate(values):
+                cell = self.format_log_cell(value)
+                if cell != self.log_cells[row][column]:
+                    self.log_cells[row][column] = cell
+                    start = '{0}.{1}'.format(row + 1, width * (column + 1))
+                    self.data_logs.delete(start, '{0} + {1} chars'.format(start, width))
+                    self.data_logs.insert(start, cell, *self.log_row_tags[row])
+
+        return True
+
+    @staticmethod
+    def format_log_cell(value):
+        """
+        Formats a value for a cell of the data log.
+        @param value: The value, which may be NaN if there is none.
+        @return: The text of the cell, padded to the column width.
+        """
+        text = '' if np.isnan(value) else str(value)[0:7]
+        return text + ' ' * (GUIFrontend.LOG_COLUMN_WIDTH - len(text))
+
+    def update_metrics_panel(self):
+        """
+        Shows the rates, queue depths, lag and timings of the pipeline, and
+        which stage of it is falling behind, at most once per metrics sample.
+        """
+        now = time.perf_counter()
+        if now - self.last_metrics_update < Metrics.SAMPLE_INTERVAL:
+            return
+        self.last_metrics_update = now
+
+        lines = self.format_metrics(self.backend_adapter.get_metrics() or {}, self.metrics.snapshot())
+        self.metrics_panel.settext('\n'.join(lines))
+
+    def format_metrics(self, backend, render):
+        """
+        Formats metrics for the metrics panel.
+        @param backend: A snapshot of the backend's metrics (see GUIBackend.get_metrics).
+        @param render: A snapshot of the frontend's metrics.
+        @return: The lines of text to show.
+        """
+        def value(metrics, name, key):
+            return metrics.get(name, {}).get(key) or 0.0
+
+        width = GUIFrontend.LOG_COLUMN_WIDTH
+        frame_rate = value(backend, 'network.frames', 'rate')
+        queue_max = value(backend, 'backend.queue_depth', 'max')
+        frame_p50 = value(render, 'render.frame_seconds', 'p50')
+        dropped_rate = value(render, 'render.dropped_frames', 'rate')
+
+        if frame_rate == 0:
+            status = "No data from the network"
+        elif queue_max > GUIFrontend.QUEUE_WARNING:
+            status = "Backend is falling behind the network"
+        elif frame_p50 * 1000 > self.frame_delay_ms or dropped_rate > 0 or self.governor.level > 0:
+            status = "Renderer is falling behind the target framerate"
+        else:
+            status = "Keeping up"
+
+        lines = [
+            "Network  {0:.0f} frames/s, {1:.1f} kB/s, {2:.0f} bad frames, {3:.0f} bytes skipped".format(
+                frame_rate, value(backend, 'network.bytes', 'rate') / 1000,
+                value(backend, 'backend.bad_frames', 'total'), value(backend, 'network.skipped_bytes', 'total')),
+            "Backend  queue {0:.0f} (max {1:.0f}), decode p50 {2:.2f} ms p99 {3:.2f} ms, "
+            "latency mean {4:.2f} ms p99 {5:.2f} ms max {6:.2f} ms".format(
+                value(backend, 'backend.queue_depth', 'value'), queue_max,
+                1000 * value(backend, 'backend.decode_seconds', 'p50'),
+                1000 * value(backend, 'backend.decode_seconds', 'p99'),
+                1000 * value(backend, 'backend.ingest_latency_seconds', 'mean'),
+                1000 * value(backend, 'backend.ingest_latency_seconds', 'p99'),
+                1000 * value(backend, 'backend.ingest_latency_seconds', 'max')),
+            "Render   frame p50 {0:.1f} ms p99 {1:.1f} ms (target {2} ms), copy p99 {3:.1f} ms, "
+            "dropped {4:.1f} frames/s, interval {5} ms, quality level {6}".format(
+                1000 * frame_p50, 1000 * value(render, 'render.frame_seconds', 'p99'), self.frame_delay_ms,
+                1000 * value(render, 'render.present_seconds', 'p99'), dropped_rate, self.governor.interval_ms,
+                self.governor.level),
+            "Commands " + self.format_round_trips(backend),
+            "Status   " + status,
+            ' ' * width + ''.join(choice.ljust(width) for choice in self.choices),
+        ]
+        for label, name, key, scale in [('Samples/s', 'samples.', 'rate', 1),
+                                        ('Frames/s', 'network.frames.', 'rate', 1),
+                                        ('Lag ms', 'lag.', 'value', 1000)]:
+            cells = [str(round(scale * value(backend, name + choice, key), 1))[0:width - 1].ljust(width)
+                     for choice in self.choices]
+            lines.append(label.ljust(width) + ''.join(cells))
+
+        return lines
+
+    @staticmethod
+    def format_round_trips(metrics):
+        """
+        Formats the last round trip of each command (see CommandSender).
+        @param metrics: A snapshot of the backend's metrics.
+        @return: A line of text.
+        """
+        prefix = 'command.last_round_trip.'
+        round_trips = ["{0} {1:.1f} ms".format(name[len(prefix):], 1000 * metric['value'])
+                       for name, metric in sorted(metrics.items()) if name.startswith(prefix)]
+        unacknowledged = metrics.get('command.unacknowledged', {}).get('total', 0)
+        dropped = metrics.get('command.dropped', {}).get('total', 0)
+
+        return (', '.join(round_trips) or "none acknowledged") + \
+            ", {0} unacknowledged, {1} dropped".format(unacknowledged, dropped)
 
     def network_log_append(self, network_log_msg):
         """
         Appends a message to the network log display in the
-        logging tab.
+        logging tab. Safe to call from any thread; the message
+        is shown by the next frame.
         @param network_log_msg: The message to append.
         """
-        self.network_logs.insert('end', network_log_msg + '\n')
+        self.log_bridge.post(network_log_msg)
+
+    def show_alert(self, msg):
+        """
+        Shows a message that needs the operator's attention under the network
+        controls. Safe to call from any thread; the message is shown by the
+        next frame.
+        @param msg: The message to show.
+        """
+        self.alert_bridge.post(time.strftime("%H:%M:%S ") + msg)
+
+    def flush_alerts(self):
+        """
+        Shows the newest alert posted since the last frame.
+        """
+        alerts = self.alert_bridge.drain()
+        if alerts and self.alert_label is not None:
+            self.alert_label.configure(text=alerts[-1])
+
+    def flush_network_log(self):
+        """
+        Shows the messages posted since the last frame with a single insert,
+        dropping the oldest lines beyond network_log_lines.
+        """
+        lines = self.log_bridge.drain()[-self.network_log_lines:]
+        if not lines:
+            return
+
+        self.network_logs.insert('end', '\n'.join(lines) + '\n')
+        self.network_log_count += len(lines)
+
+        excess = self.network_log_count - self.network_log_lines
+        if excess > 0:
+            self.network_logs.delete('1.0', '{0}.0'.format(excess + 1))
+            self.network_log_count -= excess
 
     def start(self):
         """